@@ -0,0 +1,191 @@
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from bench.fakes import FakeClock, FakeTextChannel
+from bench.replay import compare_states, tracking_state
+from bench.voice_load import VoiceWorld, isolate_environment
+from core.cluster import ClusterCoordinator, shard_of
+from core.storage import create_storage
+
+# Guild IDs one shard apart, so consecutive guilds land on different shards
+GUILD_ID_STEP = 1 << 22
+# Fake clock of the run: one second per voice event
+START_TIME = 1700000000.0
+# Seconds a worker waits for the others (connect, config propagation) before giving up
+WAIT_TIMEOUT = 30.0
+
+
+async def wait_for(condition, timeout=WAIT_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(0.02)
+    return True
+
+
+def barrier(name, worker, workers):
+    """Condition that holds once every worker reached the named point (marker files in the working directory)."""
+    open(f"{name}.{worker}", 'w').close()
+    return lambda: len(glob.glob(f"{name}.*")) >= workers
+
+
+async def run_worker(args):
+    """One clustered worker: bot.py driven by the same synthetic world as every other worker, handling only its own guilds."""
+    import bot
+    worker = int(os.environ['CLUSTER_WORKER'])
+    clock = FakeClock(START_TIME)
+    bot.clock = clock
+    bot.presence.clock = clock
+    bot.offline_alert_cooldown.clock = clock
+    bot.outbox.coalesce_window = 0
+    bot.outbox.per = 0
+
+    # Every worker builds the same world from the seed and keeps the guilds of its shards
+    world = VoiceWorld(args.guilds, args.members, args.channels, random.Random(args.seed), guild_id_step=GUILD_ID_STEP)
+    world.seat(0.3)
+    owned = {guild.id: guild for guild in world.guilds if bot.owns_guild(guild.id)}
+    bot.bot._connection._guilds = owned
+
+    bot.cluster.start()
+    if not await wait_for(lambda: bot.cluster.connected) or not await wait_for(barrier('connected', worker, args.workers)):
+        raise SystemExit(f"worker {worker}: the other workers did not connect")
+    await bot.resync_voice_tracking()
+
+    handled = 0
+    for number, (member, before, after) in enumerate(world.events(args.events)):
+        clock.now = START_TIME + number
+        if member.guild.id in owned:
+            await bot.on_voice_state_update(member, before, after)
+            handled += 1
+        if number % 1000 == 0:
+            await asyncio.sleep(0)
+
+    # Concurrent config writes from every worker must all survive and reach every worker
+    added = [700000000000000000 + worker * 10000 + n for n in range(args.config_writes)]
+    await asyncio.gather(*(bot.config.add_watched(user_id) for user_id in added))
+    expected = {700000000000000000 + other * 10000 + n for other in range(args.workers) for n in range(args.config_writes)}
+    config_started = time.monotonic()
+    converged = await wait_for(lambda: expected <= bot.config.watched_user_ids)
+    config_seconds = time.monotonic() - config_started
+
+    # Every worker tries to send the same users' offline notices; the cluster-wide claim lets one through
+    channel = FakeTextChannel(600000000000000000 + worker, 'alerts', None)
+    for n in range(args.notices):
+        await bot.send_offline_alert(710000000000000000 + n, channel)
+    await bot.outbox.flush()
+
+    bot.update_voice_times()
+    await bot.flush_memory()
+    result = {
+        'worker': worker,
+        'shards': bot.SHARD_IDS,
+        'guilds': sorted(owned),
+        'events_handled': handled,
+        'config_converged': converged,
+        'config_seconds': config_seconds,
+        'notices_sent': channel.sent,
+    }
+    with open(f"result.{worker}.json", 'w') as f:
+        json.dump(result, f)
+    await bot.cluster.close()
+    bot.blocking_io.shutdown()
+
+
+async def run_cluster(args, workdir, workers):
+    """Run workers bot.py processes under a coordinator in workdir. Returns (per-worker results, persisted state)."""
+    os.makedirs(workdir)
+    isolate_environment(workdir, args.storage)
+    command = [sys.executable, os.path.abspath(__file__), '--worker',
+               '--workers', str(workers), '--guilds', str(args.guilds), '--members', str(args.members),
+               '--channels', str(args.channels), '--events', str(args.events), '--seed', str(args.seed),
+               '--config-writes', str(args.config_writes), '--notices', str(args.notices)]
+    coordinator = ClusterCoordinator('127.0.0.1:0', workers, args.shards, command, restart=False)
+    started = time.perf_counter()
+    await coordinator.start()
+    await coordinator.wait()
+    await coordinator.stop()
+    elapsed = time.perf_counter() - started
+
+    results = []
+    for worker in range(workers):
+        try:
+            with open(os.path.join(workdir, f"result.{worker}.json")) as f:
+                results.append(json.load(f))
+        except FileNotFoundError:
+            raise SystemExit(f"worker {worker} of the {workers}-worker run failed, see {workdir}/bot.log")
+    storage = create_storage(args.storage)
+    state = tracking_state(storage.load())
+    storage.close()
+    return results, state, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check clustered mode on one machine: the same synthetic voice load '
+                                                 'through one worker and through several sharded workers must persist the same state.')
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--shards', type=int, default=6)
+    parser.add_argument('--guilds', type=int, default=24)
+    parser.add_argument('--members', type=int, default=12000)
+    parser.add_argument('--channels', type=int, default=240)
+    parser.add_argument('--events', type=int, default=40000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--config-writes', type=int, default=10, help='watchlist additions per worker, written concurrently')
+    parser.add_argument('--notices', type=int, default=50, help='offline notices every worker tries to send for the same users')
+    parser.add_argument('--storage', choices=('json', 'binary', 'sqlite'), default='json')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        logging.basicConfig(level=logging.INFO, filename='bot.log',
+                            format=f"%(asctime)s - %(levelname)s - worker {os.environ.get('CLUSTER_WORKER')} - %(message)s")
+        asyncio.run(run_worker(args))
+        return
+    if args.shards < args.workers:
+        parser.error('--shards must be at least --workers')
+
+    with tempfile.TemporaryDirectory(prefix='voice-cluster-') as root:
+        reference, expected, single_seconds = asyncio.run(run_cluster(args, os.path.join(root, 'single'), 1))
+        results, state, cluster_seconds = asyncio.run(run_cluster(args, os.path.join(root, 'cluster'), args.workers))
+
+    problems = compare_states(state, expected)
+    owners = {}
+    for result in results:
+        for guild_id in result['guilds']:
+            owners.setdefault(guild_id, []).append(result['worker'])
+        if not result['config_converged']:
+            problems.append(f"worker {result['worker']} did not see every worker's watchlist additions")
+    problems += [f"guild {guild_id} is run by workers {workers}" for guild_id, workers in owners.items() if len(workers) > 1]
+    notices = sum(result['notices_sent'] for result in results)
+    if notices != args.notices:
+        problems.append(f"{notices} offline notices sent for {args.notices} users")
+
+    print(f"Single worker:  {single_seconds:.1f}s, {sum(len(users) for users in expected.values())} users in {len(expected)} guilds")
+    print(f"{args.workers} workers:      {cluster_seconds:.1f}s, {args.shards} shards")
+    for result in results:
+        shard_guilds = sorted({shard_of(guild_id, args.shards) for guild_id in result['guilds']})
+        print(f"  worker {result['worker']}: shards {result['shards']} (guilds on {shard_guilds}), {len(result['guilds'])} guilds, "
+              f"{result['events_handled']} events, config seen by all after {result['config_seconds'] * 1000:.0f}ms, "
+              f"{result['notices_sent']} notices")
+    print(f"Offline notices: {notices} sent for {args.notices} users (reference run: {reference[0]['notices_sent']})")
+    if problems:
+        print(f"{len(problems)} problems:")
+        for line in problems[:20]:
+            print(f"  {line}")
+        sys.exit(1)
+    print("Persisted state matches the single-worker run")
+
+
+if __name__ == '__main__':
+    main()
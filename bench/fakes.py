@@ -0,0 +1,103 @@
+# Lightweight stand-ins for the discord.py objects the voice tracking path reads
+# (Member, VoiceState, VoiceChannel, Guild). They carry only the attributes bot.py
+# uses, so large synthetic servers fit in memory and benchmarks run fully offline.
+
+
+class FakeVoiceState:
+    __slots__ = ('channel', 'self_mute', 'self_deaf', 'mute', 'deaf')
+
+    def __init__(self, channel=None, self_mute=False, self_deaf=False, mute=False, deaf=False):
+        self.channel = channel
+        self.self_mute = self_mute
+        self.self_deaf = self_deaf
+        self.mute = mute
+        self.deaf = deaf
+
+
+class FakeMember:
+    __slots__ = ('id', 'name', 'display_name', 'guild', 'voice', 'bot', 'status')
+
+    def __init__(self, member_id, name, guild, bot=False, status='online'):
+        self.id = member_id
+        self.name = name
+        self.display_name = name
+        self.guild = guild
+        self.voice = None
+        self.bot = bot
+        self.status = status
+
+    @property
+    def mention(self):
+        return f"<@{self.id}>"
+
+
+class FakeVoiceChannel:
+    def __init__(self, channel_id, name, guild):
+        self.id = channel_id
+        self.name = name
+        self.guild = guild
+        self.roster = {}    # member_id -> FakeMember, kept in step by change_voice
+
+    @property
+    def members(self):
+        return list(self.roster.values())
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __eq__(self, other):
+        return getattr(other, 'id', None) == self.id
+
+
+class FakeGuild:
+    def __init__(self, guild_id, name):
+        self.id = guild_id
+        self.name = name
+        self.members_by_id = {}
+        self.voice_channels = []
+        self.text_channels = []
+
+    @property
+    def members(self):
+        return list(self.members_by_id.values())
+
+    def get_member(self, member_id):
+        return self.members_by_id.get(member_id)
+
+    def get_channel(self, channel_id):
+        return next((channel for channel in self.voice_channels + self.text_channels if channel.id == channel_id), None)
+
+
+class FakeTextChannel:
+    def __init__(self, channel_id, name, guild):
+        self.id = channel_id
+        self.name = name
+        self.guild = guild
+        self.sent = 0
+
+    async def send(self, content=None, **kwargs):
+        self.sent += 1
+
+
+class FakeClock:
+    """A settable stand-in for time.time."""
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def change_voice(member, channel, self_mute=False, self_deaf=False, mute=False, deaf=False):
+    """Move member to channel (None leaves voice) like the gateway does. Returns (before, after) voice states."""
+    before = member.voice or FakeVoiceState()
+    if before.channel is not None:
+        before.channel.roster.pop(member.id, None)
+    after = FakeVoiceState(channel, self_mute, self_deaf, mute, deaf)
+    if channel is not None:
+        channel.roster[member.id] = member
+        member.voice = after
+    else:
+        member.voice = None
+    return before, after
@@ -0,0 +1,284 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from bench.fakes import FakeClock, FakeGuild, FakeMember, FakeTextChannel, FakeVoiceChannel, FakeVoiceState, change_voice
+from bench.voice_load import isolate_environment, percentile
+from core.persistence import atomic_write_bytes
+from core.recorder import BOT, DEAF, MUTE, SELF_DEAF, SELF_MUTE
+
+# Seconds two total_time values may differ by and still match an expected state
+STATE_TOLERANCE = 0.01
+
+
+class ReplayWorld:
+    """Fake guilds, channels and members created on first sight of their IDs in a recording."""
+
+    def __init__(self):
+        self.guilds = {}
+        self.channels = {}
+
+    def guild(self, guild_id):
+        guild = self.guilds.get(guild_id)
+        if guild is None:
+            guild = self.guilds[guild_id] = FakeGuild(guild_id, f"guild-{guild_id}")
+        return guild
+
+    def member(self, guild_id, user_id, flags=0):
+        guild = self.guild(guild_id)
+        member = guild.get_member(user_id)
+        if member is None:
+            member = guild.members_by_id[user_id] = FakeMember(user_id, f"user{user_id}", guild)
+        member.bot = bool(flags & BOT)
+        return member
+
+    def voice_channel(self, guild_id, channel_id):
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            guild = self.guild(guild_id)
+            channel = self.channels[channel_id] = FakeVoiceChannel(channel_id, f"voice-{channel_id}", guild)
+            guild.voice_channels.append(channel)
+        return channel
+
+    def text_channel(self, guild_id, channel_id):
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            guild = self.guild(guild_id) if guild_id else None
+            channel = self.channels[channel_id] = FakeTextChannel(channel_id, f"text-{channel_id}", guild)
+            if guild is not None:
+                guild.text_channels.append(channel)
+        return channel
+
+    def voice_state(self, guild_id, recorded):
+        if recorded is None:
+            return FakeVoiceState()
+        channel_id, flags = recorded
+        return FakeVoiceState(self.voice_channel(guild_id, channel_id), bool(flags & SELF_MUTE), bool(flags & SELF_DEAF),
+                              bool(flags & MUTE), bool(flags & DEAF))
+
+    def reset_rosters(self, rosters):
+        """Replace who is in voice in the given guilds with a recorded roster."""
+        for guild_key, channels in rosters.items():
+            guild = self.guild(int(guild_key))
+            for channel in guild.voice_channels:
+                for member in channel.members:
+                    change_voice(member, None)
+            for channel_key, members in channels.items():
+                channel = self.voice_channel(guild.id, int(channel_key))
+                for user_id, flags in members:
+                    state = self.voice_state(guild.id, [channel.id, flags])
+                    change_voice(self.member(guild.id, user_id, flags), channel,
+                                 state.self_mute, state.self_deaf, state.mute, state.deaf)
+
+    def in_voice(self, guild_id, user_id):
+        guild = self.guilds.get(guild_id)
+        member = guild.get_member(user_id) if guild else None
+        return member is not None and member.voice is not None
+
+
+def read_recording(path):
+    with open(path, encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logging.warning(f"{path}:{number}: skipping a truncated line")
+
+
+def write_config(event):
+    """Write the recorded lists to the config files, as the bot had them at that point."""
+    files = {
+        'ignore.json': {'ignored_user_ids': event['ignore']},
+        'afkchannels.json': {'afk_channel_ids': event['afk']},
+        'watchlist.json': {'watch_everyone': event['watch_everyone'], 'watched_user_ids': event['watch']},
+    }
+    for filename, data in files.items():
+        atomic_write_bytes(filename, json.dumps(data, indent=4).encode('utf-8'))
+
+
+def tracking_state(voice_time_tracking):
+    return {
+        guild_key: {
+            user_id: {
+                'total_time': round(record.get('total_time', 0), 3),
+                'in_voice': record.get('in_voice', False),
+                'tracking': 'join_time' in record,
+            }
+            for user_id, record in tracking.items()
+        }
+        for guild_key, tracking in voice_time_tracking.items()
+    }
+
+
+def find_anomalies(bot, world, initial_totals, span):
+    """Drift symptoms: sessions open for users not in voice, and more time gained than the recording lasted."""
+    anomalies = []
+    for guild_key, tracking in bot.voice_time_tracking.items():
+        for user_id, record in tracking.items():
+            in_voice = world.in_voice(int(guild_key), int(user_id))
+            if 'join_time' in record and not in_voice:
+                anomalies.append(f"guild {guild_key} user {user_id}: join_time set but not in voice")
+            elif record.get('in_voice', False) and not in_voice:
+                anomalies.append(f"guild {guild_key} user {user_id}: marked in_voice but not in voice")
+            gained = record.get('total_time', 0) - initial_totals.get((guild_key, user_id), 0)
+            if gained > span + 1:
+                anomalies.append(f"guild {guild_key} user {user_id}: gained {gained:.0f}s in a {span:.0f}s recording")
+    return anomalies
+
+
+def compare_states(state, expected):
+    """Differences between two tracking states, one line each."""
+    differences = []
+    for guild_key in sorted(set(state) | set(expected)):
+        current, wanted = state.get(guild_key, {}), expected.get(guild_key, {})
+        for user_id in sorted(set(current) | set(wanted)):
+            have, want = current.get(user_id), wanted.get(user_id)
+            if have is None or want is None:
+                differences.append(f"guild {guild_key} user {user_id}: {'missing' if have is None else 'unexpected'}")
+            elif (abs(have['total_time'] - want['total_time']) > STATE_TOLERANCE
+                  or have['in_voice'] != want['in_voice'] or have['tracking'] != want['tracking']):
+                differences.append(f"guild {guild_key} user {user_id}: {have} != {want}")
+    return differences
+
+
+async def replay(args):
+    import bot
+    world = ReplayWorld()
+    clock = FakeClock()
+    bot.clock = clock
+    bot.presence.clock = clock
+    bot.offline_alert_cooldown.clock = clock
+    # Offline notices go straight to the fake channels
+    bot.outbox.coalesce_window = 0
+    bot.outbox.per = 0
+    bot.bot._connection._guilds = world.guilds
+    initial_totals = {(guild_key, user_id): record.get('total_time', 0)
+                      for guild_key, tracking in bot.voice_time_tracking.items() for user_id, record in tracking.items()}
+
+    counts = {}
+    voice_latencies = []
+    first = last = None
+    started = time.perf_counter()
+    for number, event in enumerate(read_recording(args.recording), 1):
+        kind = event['e']
+        clock.now = event['t']
+        first = clock.now if first is None else first
+        last = clock.now
+        counts[kind] = counts.get(kind, 0) + 1
+        if kind == 'voice':
+            guild_id = event['g']
+            before = world.voice_state(guild_id, event['b'])
+            after = world.voice_state(guild_id, event['a'])
+            member = world.member(guild_id, event['u'], (event['a'] or event['b'] or [0, 0])[1])
+            change_voice(member, after.channel, after.self_mute, after.self_deaf, after.mute, after.deaf)
+            event_start = time.perf_counter()
+            await bot.on_voice_state_update(member, before, after)
+            voice_latencies.append(time.perf_counter() - event_start)
+        elif kind == 'presence':
+            guild_member = FakeMember(event['u'], f"user{event['u']}", None, status=event['s'])
+            await bot.on_presence_update(guild_member, guild_member)
+        elif kind in ('message', 'reaction'):
+            # on_message and the raw reaction handlers hand these to check_and_respond
+            guild_id = event['g']
+            member = world.member(guild_id, event['u']) if guild_id and event.get('op') != 'remove' else None
+            await bot.check_and_respond(event['u'], world.text_channel(guild_id, event['c']), member)
+        elif kind == 'config':
+            write_config(event)
+            await bot.config.reload_if_changed_async()
+        elif kind == 'ready':
+            world.reset_rosters(event['guilds'])
+            await bot.resync_voice_tracking()
+        elif kind == 'reconcile':
+            world.reset_rosters(event['guilds'])
+            await bot.update_tracking_for_channel_changes()
+        elif kind == 'job':
+            await {'accrual': bot.accrual_job, 'backup': bot.backup_job, 'reset': bot.reset_job}[event['name']]()
+        # Commands are recorded by name only (no arguments), so they are counted but not replayed
+        if number % args.batch == 0:
+            await asyncio.sleep(0)
+    elapsed = time.perf_counter() - started
+
+    # Accrue open sessions up to the end of the recording so states of different runs compare
+    bot.update_voice_times()
+    await bot.flush_memory()
+    await bot.outbox.flush()
+
+    events = sum(counts.values())
+    span = (last - first) if first is not None else 0.0
+    voice_latencies.sort()
+    state = tracking_state(bot.voice_time_tracking)
+    result = {
+        'events': events,
+        'by_kind': counts,
+        'recording_seconds': span,
+        'replay_seconds': elapsed,
+        'events_per_sec': events / elapsed if elapsed else 0.0,
+        'voice_p50_us': percentile(voice_latencies, 0.50) * 1e6,
+        'voice_p99_us': percentile(voice_latencies, 0.99) * 1e6,
+        'tracked_users': sum(len(tracking) for tracking in state.values()),
+        'offline_messages': bot.outbox.stats()['sent'],
+        'anomalies': find_anomalies(bot, world, initial_totals, span),
+    }
+    bot.blocking_io.shutdown()
+    return result, state
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a RECORD_EVENTS recording through the handlers in bot.py at full speed.')
+    parser.add_argument('recording')
+    parser.add_argument('--memory-dir', help='start from this MEMORY_DIR instead of empty tracking data')
+    parser.add_argument('--save-state', metavar='PATH', help='write the final tracking state as JSON')
+    parser.add_argument('--expect', metavar='PATH', help='compare the final tracking state against a saved one')
+    parser.add_argument('--fail-on-anomalies', action='store_true', help='exit with 1 when drift symptoms are found')
+    parser.add_argument('--batch', type=int, default=100, help='events between yields to the event loop')
+    parser.add_argument('--storage', choices=('json', 'binary', 'sqlite'), default='json')
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+    args.recording = os.path.abspath(args.recording)
+
+    save_path = os.path.abspath(args.save_state) if args.save_state else None
+    expect_path = os.path.abspath(args.expect) if args.expect else None
+    with tempfile.TemporaryDirectory(prefix='voice-replay-') as workdir:
+        if args.memory_dir:
+            shutil.copytree(args.memory_dir, os.path.join(workdir, 'memory'))
+        isolate_environment(workdir, args.storage)
+        logging.basicConfig(level=args.log_level.upper(), filename=os.path.join(workdir, 'bot.log'),
+                            format='%(asctime)s - %(levelname)s - %(message)s')
+        result, state = asyncio.run(replay(args))
+
+    anomalies = result.pop('anomalies')
+    print(json.dumps(result, indent=2))
+    for anomaly in anomalies[:50]:
+        print(f"ANOMALY {anomaly}")
+    if len(anomalies) > 50:
+        print(f"... and {len(anomalies) - 50} more anomalies")
+    if save_path:
+        with open(save_path, 'w') as f:
+            json.dump(state, f, indent=2, sort_keys=True)
+
+    failed = bool(anomalies) and args.fail_on_anomalies
+    if expect_path:
+        with open(expect_path) as f:
+            differences = compare_states(state, json.load(f))
+        for difference in differences[:50]:
+            print(f"DIFF {difference}")
+        print(f"{len(differences)} differences from {args.expect}")
+        failed = failed or bool(differences)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from bench.fakes import FakeGuild, FakeMember, FakeVoiceChannel, change_voice
+
+# Share of each event kind in a run; a storm empties a whole channel in one burst
+EVENT_MIX = {'join': 0.30, 'leave': 0.25, 'move': 0.25, 'mute': 0.15, 'storm': 0.05}
+
+# Metrics compared against a baseline: name -> True when higher is better
+COMPARED_METRICS = {
+    'events_per_sec': True,
+    'p50_us': False,
+    'p99_us': False,
+    'reconcile_ms': False,
+    'final_flush_ms': False,
+    'peak_rss_mb': False,
+    'bytes_written': False,
+}
+
+
+def isolate_environment(workdir, storage):
+    """Point every file the bot touches into workdir before bot.py is imported."""
+    os.chdir(workdir)
+    os.environ.update({
+        'STORAGE_BACKEND': storage,
+        'MEMORY_DIR': os.path.join(workdir, 'memory'),
+        'SQLITE_PATH': os.path.join(workdir, 'memory.db'),
+        'HISTORY_DIR': os.path.join(workdir, 'history'),
+        'BACKUP_DIR': os.path.join(workdir, 'backup'),
+        'PROFILE_DIR': os.path.join(workdir, 'profiles'),
+        'METRICS_PORT': '0',
+        'INVISIBLE_ALERT_CHANNEL_ID': '0',
+        'LEGACY_GUILD_ID': '',
+    })
+
+
+def bytes_written_by_process():
+    """Bytes passed to write() by this process so far (Linux), or None."""
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('wchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss_mb():
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+class VoiceWorld:
+    """Synthetic guilds with members and voice channels; channel popularity is skewed like real servers."""
+
+    def __init__(self, guilds, members, channels, rng, guild_id_step=1):
+        self.rng = rng
+        self.guilds = []
+        self.members = []
+        self.in_voice = []          # members currently in a voice channel
+        self.in_voice_index = {}    # member id -> position in in_voice
+        self.channel_weights = {}   # guild id -> cumulative weights of its channels
+        for g in range(guilds):
+            # A step of 1 << 22 or more spreads the guilds over gateway shards
+            guild = FakeGuild(900000000000000000 + g * guild_id_step, f"guild-{g}")
+            for c in range(max(1, channels // guilds)):
+                guild.voice_channels.append(FakeVoiceChannel(800000000000000000 + g * 100000 + c, f"voice-{g}-{c}", guild))
+            weight = 0.0
+            cumulative = []
+            for rank in range(len(guild.voice_channels)):
+                weight += 1 / (rank + 1) ** 0.8
+                cumulative.append(weight)
+            self.channel_weights[guild.id] = cumulative
+            self.guilds.append(guild)
+        for m in range(members):
+            guild = self.guilds[m % guilds]
+            member = FakeMember(100000000000000000 + m, f"user{m}", guild)
+            guild.members_by_id[member.id] = member
+            self.members.append(member)
+
+    def pick_channel(self, guild, exclude=None):
+        channel = self.rng.choices(guild.voice_channels, cum_weights=self.channel_weights[guild.id])[0]
+        if channel is exclude and len(guild.voice_channels) > 1:
+            channel = self.rng.choice(guild.voice_channels)
+        return channel
+
+    def _joined(self, member):
+        if member.id not in self.in_voice_index:
+            self.in_voice_index[member.id] = len(self.in_voice)
+            self.in_voice.append(member)
+
+    def _left(self, member):
+        position = self.in_voice_index.pop(member.id)
+        last = self.in_voice.pop()
+        if last is not member:
+            self.in_voice[position] = last
+            self.in_voice_index[last.id] = position
+
+    def seat(self, fraction):
+        """Put a fraction of the members into voice before the run (no events)."""
+        for member in self.rng.sample(self.members, int(len(self.members) * fraction)):
+            change_voice(member, self.pick_channel(member.guild))
+            self._joined(member)
+
+    def events(self, count):
+        """Yield (member, before, after) voice updates until count events were produced."""
+        kinds = list(EVENT_MIX)
+        weights = list(EVENT_MIX.values())
+        produced = 0
+        while produced < count:
+            kind = self.rng.choices(kinds, weights)[0]
+            if kind != 'join' and not self.in_voice:
+                kind = 'join'
+            if kind == 'join':
+                member = self.rng.choice(self.members)
+                if member.voice is not None:
+                    continue
+                before, after = change_voice(member, self.pick_channel(member.guild))
+                self._joined(member)
+                produced += 1
+                yield member, before, after
+            elif kind == 'leave':
+                member = self.rng.choice(self.in_voice)
+                before, after = change_voice(member, None)
+                self._left(member)
+                produced += 1
+                yield member, before, after
+            elif kind == 'move':
+                member = self.rng.choice(self.in_voice)
+                before, after = change_voice(member, self.pick_channel(member.guild, exclude=member.voice.channel))
+                produced += 1
+                yield member, before, after
+            elif kind == 'mute':
+                member = self.rng.choice(self.in_voice)
+                muted = not (member.voice.self_mute and member.voice.self_deaf)
+                before, after = change_voice(member, member.voice.channel, self_mute=muted, self_deaf=muted)
+                produced += 1
+                yield member, before, after
+            else:
+                # Storm: everyone in one channel leaves or moves to another channel at once
+                channel = self.rng.choice(self.in_voice).voice.channel
+                target = self.pick_channel(channel.guild, exclude=channel) if self.rng.random() < 0.5 else None
+                for member in channel.members:
+                    if produced >= count:
+                        break
+                    before, after = change_voice(member, target)
+                    if target is None:
+                        self._left(member)
+                    produced += 1
+                    yield member, before, after
+
+
+async def run_benchmark(args):
+    rng = random.Random(args.seed)
+    rss_before = peak_rss_mb()
+    import bot
+    world = VoiceWorld(args.guilds, args.members, args.channels, rng)
+    bot.bot._connection._guilds = {guild.id: guild for guild in world.guilds}
+    world.seat(args.seated)
+    written_before = bytes_written_by_process()
+
+    # Startup reconciliation over every channel, as on_ready does
+    start = time.perf_counter()
+    await bot.update_tracking_for_channel_changes()
+    reconcile_ms = (time.perf_counter() - start) * 1000
+
+    latencies = []
+    handler = bot.on_voice_state_update
+    started = time.perf_counter()
+    for number, (member, before, after) in enumerate(world.events(args.events), 1):
+        event_start = time.perf_counter()
+        await handler(member, before, after)
+        latencies.append(time.perf_counter() - event_start)
+        if number % args.batch == 0:
+            # Let write-behind flushes and other background tasks run, as between gateway events
+            await asyncio.sleep(0)
+    elapsed = time.perf_counter() - started
+
+    start = time.perf_counter()
+    await bot.flush_memory()
+    final_flush_ms = (time.perf_counter() - start) * 1000
+    written_after = bytes_written_by_process()
+
+    latencies.sort()
+    store_stats = bot.memory_store.stats()
+    result = {
+        'members': args.members,
+        'channels': args.channels,
+        'guilds': args.guilds,
+        'events': len(latencies),
+        'storage': args.storage,
+        'events_per_sec': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_us': percentile(latencies, 0.50) * 1e6,
+        'p99_us': percentile(latencies, 0.99) * 1e6,
+        'max_us': (latencies[-1] if latencies else 0.0) * 1e6,
+        'reconcile_ms': reconcile_ms,
+        'final_flush_ms': final_flush_ms,
+        'tracked_users': sum(len(tracking) for tracking in bot.voice_time_tracking.values()),
+        'peak_rss_mb': peak_rss_mb(),
+        'rss_growth_mb': peak_rss_mb() - rss_before,
+        'bytes_written': (written_after - written_before) if written_before is not None else store_stats['bytes_written'],
+        'snapshot_bytes_written': store_stats['bytes_written'],
+        'flushes': store_stats['flushes'],
+    }
+    bot.blocking_io.shutdown()
+    return result
+
+
+def compare(result, baseline, tolerance):
+    """Print current vs baseline. Returns the metrics that got worse by more than tolerance percent."""
+    regressions = []
+    print(f"{'metric':<18}{'baseline':>14}{'current':>14}{'change':>10}")
+    for name, higher_is_better in COMPARED_METRICS.items():
+        if name not in baseline:
+            continue
+        old, new = baseline[name], result[name]
+        change = (new - old) / old * 100 if old else 0.0
+        worse = -change if higher_is_better else change
+        flag = '  REGRESSION' if worse > tolerance else ''
+        if flag:
+            regressions.append(name)
+        print(f"{name:<18}{old:>14.1f}{new:>14.1f}{change:>+9.1f}%{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline load benchmark of on_voice_state_update with synthetic servers.')
+    parser.add_argument('--members', type=int, default=50000)
+    parser.add_argument('--channels', type=int, default=2000)
+    parser.add_argument('--guilds', type=int, default=20)
+    parser.add_argument('--events', type=int, default=200000)
+    parser.add_argument('--seated', type=float, default=0.1, help='share of members in voice before the run')
+    parser.add_argument('--batch', type=int, default=100, help='events between yields to the event loop')
+    parser.add_argument('--storage', choices=('json', 'binary', 'sqlite'), default='json')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--log-level', default='WARNING', help='bot log level (INFO logs every join, as in production)')
+    parser.add_argument('--save', metavar='PATH', help='write the result as JSON, e.g. to use as the baseline')
+    parser.add_argument('--baseline', metavar='PATH', help='compare against a saved result')
+    parser.add_argument('--tolerance', type=float, default=10.0, help='percent a metric may get worse before it is a regression')
+    args = parser.parse_args()
+
+    save_path = os.path.abspath(args.save) if args.save else None
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    with tempfile.TemporaryDirectory(prefix='voice-bench-') as workdir:
+        isolate_environment(workdir, args.storage)
+        # bot.py configures the root logger on import; the level and file are set here first
+        logging.basicConfig(level=args.log_level.upper(), filename=os.path.join(workdir, 'bot.log'),
+                            format='%(asctime)s - %(levelname)s - %(message)s')
+        result = asyncio.run(run_benchmark(args))
+
+    print(json.dumps(result, indent=2))
+    if save_path:
+        with open(save_path, 'w') as f:
+            json.dump(result, f, indent=2)
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        if compare(result, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,15 +2,12 @@ import os
 import sys
 import signal
 import asyncio
+import gc
 import discord
 from discord.ext import commands, tasks
 from dotenv import load_dotenv
-import subprocess
-from datetime import datetime, timedelta
-import json
 import logging
-import pytz  # Add pytz for timezone handling
-import shutil
+import time
 from commands.leaderboard import setup_leaderboard
 from commands.restart import setup_restart
 from commands.update import setup_update
@@ -20,10 +17,43 @@ from commands.listid import setup_listid
 from commands.backup import setup_backup
 from commands.afkchannel import setup_afkchannel
 from commands.timeedit import setup_timeedit
+from commands.stats import setup_stats
+from commands.profile import setup_profile
+from commands.cluster import setup_cluster
+from core.backups import BackupEngine
+from core.blocking_io import BlockingIO
+from core.cluster import ClusterClient, shard_of
+from core.columnar import ColumnarTracking
+from core.config_store import ConfigStore
+from core.cooldowns import CooldownStore
+from core.deltas import LeaderboardDeltas
+from core.history import HistoryArchive
+from core.journal import LEGACY_GUILD_KEY, VoiceJournal
+from core.metrics import MetricsRegistry, MetricsServer
+from core.occupancy import OccupancyIndex
+from core.outbox import Outbox
+from core.persistence import WriteBehindStore
+from core.presence import OFFLINE_STATUSES, PresenceIndex
+from core.profiler import Profiler
+from core.recorder import EventRecorder
+from core.ranking import RankingIndex
+from core.render_cache import RenderCache
+from core.scheduler import Scheduler
+from core.storage import JsonStorage, create_storage
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Time to ready, broken down by phase (seconds); logged by on_ready and exported as a gauge
+startup_started = time.perf_counter()
+startup_phases = {}
+
+def startup_phase(name, since):
+    """Record that a startup phase which began at since (perf_counter) is done. Returns the current perf_counter."""
+    now = time.perf_counter()
+    startup_phases[name] = now - since
+    return now
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -36,648 +66,1018 @@ intents.reactions = True
 intents.guild_messages = True
 intents.voice_states = True  # Enable voice state updates
 
+# Clustered mode (python -m core.cluster): this process runs the gateway shards SHARD_IDS out of SHARD_COUNT
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '0'))
+SHARD_IDS = [int(shard_id) for shard_id in os.getenv('SHARD_IDS', '').split(',') if shard_id.strip()] or None
+CLUSTER_WORKER = os.getenv('CLUSTER_WORKER')
+
 # Initialize bot with prefix '!' and required intents
-bot = commands.Bot(command_prefix='!', intents=intents)
+if SHARD_COUNT:
+    bot = commands.AutoShardedBot(command_prefix='!', intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+else:
+    bot = commands.Bot(command_prefix='!', intents=intents)
 
-# Dictionary to store the last message time for each user
-last_message_time = {}
+def worker_path(path):
+    """Per-process name of a state file in clustered mode (cache.json -> cache.worker1.json)."""
+    if CLUSTER_WORKER is None:
+        return path
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.worker{CLUSTER_WORKER}{ext}"
 
-# Load ignored user IDs from ignore.json
-def load_ignored_users():
-    """Load ignored user IDs from ignore.json file"""
-    try:
-        with open('ignore.json', 'r') as f:
-            data = json.load(f)
-            return data.get('ignored_user_ids', [])
-    except (FileNotFoundError, json.JSONDecodeError):
-        logging.warning("ignore.json not found or invalid, using empty ignore list")
-        return []
-
-# Load watchlist configuration from watchlist.json
-def load_watchlist_config():
-    """Load watchlist configuration from watchlist.json file"""
-    try:
-        with open('watchlist.json', 'r') as f:
-            data = json.load(f)
-            return {
-                'watch_everyone': data.get('watch_everyone', False),
-                'watched_user_ids': data.get('watched_user_ids', []),
-                'offline_message': data.get('offline_message', '<@{user_id}> is now offline')
-            }
-    except (FileNotFoundError, json.JSONDecodeError):
-        logging.warning("watchlist.json not found or invalid, using default config")
-        return {
-            'watch_everyone': False, 
-            'watched_user_ids': [],
-            'offline_message': '<@{user_id}> is now offline'
-        }
+def owns_guild(guild_id):
+    """True when this process runs the shard of a guild (always, unless SHARD_IDS is set)."""
+    if not SHARD_COUNT or SHARD_IDS is None:
+        return True
+    if str(guild_id) == LEGACY_GUILD_KEY:
+        # Data from before partitioning goes with the guild it will be migrated into
+        return owns_guild(os.getenv('LEGACY_GUILD_ID') or 0)
+    return shard_of(guild_id, SHARD_COUNT) in SHARD_IDS
+
+# Bounded thread pool (and async subprocesses) for blocking I/O, so no command stalls gateway processing
+blocking_io = BlockingIO(
+    max_workers=int(os.getenv('IO_THREADS', '4')),
+    timeout=float(os.getenv('IO_TIMEOUT', '30'))
+)
+
+# Prometheus metrics, served on METRICS_HOST:METRICS_PORT/metrics when METRICS_PORT is set
+metrics = MetricsRegistry()
+handler_latency = metrics.histogram('voice_bot_handler_duration_seconds', 'Time spent in event handlers and commands', ('handler',))
+save_memory_calls = metrics.counter('voice_bot_save_memory_total', 'Tracking transitions recorded by save_memory', ('op',))
+storage_bytes_written = metrics.counter('voice_bot_storage_bytes_written_total', 'Bytes written by storage flushes', ('store',))
+storage_flush_duration = metrics.histogram('voice_bot_storage_flush_duration_seconds', 'Duration of storage flushes', ('store',))
+metrics_server = MetricsServer(metrics, os.getenv('METRICS_HOST', '127.0.0.1'), int(os.getenv('METRICS_PORT', '0')))
+
+def observe_flushes(store, name):
+    def on_flush(duration, written):
+        storage_bytes_written.inc(name, amount=written)
+        storage_flush_duration.observe(duration, name)
+    store.on_flush = on_flush
+
+# On-demand cProfile/stack-sample captures of the event loop (!profile start)
+profiler = Profiler(os.getenv('PROFILE_DIR', 'profiles'), os.path.dirname(os.path.abspath(__file__)), io=blocking_io)
+
+# Wall clock of the tracking code; bench/replay.py swaps in the clock of a recording
+clock = time.time
 
-# Load AFK channels configuration from afkchannels.json
-def load_afk_channels():
-    """Load AFK channel IDs from afkchannels.json file"""
+# Optional NDJSON recording of voice, presence, message, reaction and command events (IDs only)
+recorder = EventRecorder(os.getenv('RECORD_EVENTS')) if os.getenv('RECORD_EVENTS') else None
+
+# Per-channel send queues: offline notices for the same channel are merged, list output is packed
+outbox = Outbox(coalesce_window=float(os.getenv('OUTBOX_COALESCE_SECONDS', '0.5')))
+
+# Ignore list, watchlist and AFK channels: indexed in memory, hot-reloaded when the files change
+config = ConfigStore(io=blocking_io)
+
+def cluster_stats():
+    """What this worker reports to the coordinator for !cluster."""
+    return {
+        'guilds': len(bot.guilds),
+        'tracked_users': sum(len(tracking) for tracking in voice_time_tracking.values()),
+        # nan/inf until the shards are connected
+        'latency_ms': bot.latency * 1000 if bot.latency < float('inf') else None,
+    }
+
+# Connection to the coordinator of a clustered deployment: cluster-wide offline notice cooldowns,
+# config changes pushed to the other workers, worker status and restarts
+cluster = ClusterClient(os.getenv('CLUSTER_ADDRESS'), int(CLUSTER_WORKER), SHARD_IDS, stats=cluster_stats) if CLUSTER_WORKER is not None else None
+if cluster:
+    # A worker changed a config file through a command: reload it now instead of at the next poll
+    config.on_write = lambda name: asyncio.get_running_loop().create_task(cluster.publish('config', name))
+    cluster.on('config', lambda name: asyncio.get_running_loop().create_task(config.reload_if_changed_async()))
+
+# Set while on_ready reloads the config and reconciles, so config listeners don't queue a second pass
+resync_pending = False
+
+def request_reconciliation():
+    """Schedule a reconciliation pass so the occupancy index picks up ignore/AFK list changes."""
+    if resync_pending:
+        # on_ready reconciles everything right after reloading the config
+        return
     try:
-        with open('afkchannels.json', 'r') as f:
-            data = json.load(f)
-            return data.get('afk_channel_ids', [])
-    except (FileNotFoundError, json.JSONDecodeError):
-        logging.warning("afkchannels.json not found or invalid, using empty AFK channels list")
-        return []
-
-# List of user IDs to ignore in voice tracking
-IGNORED_USER_IDS = load_ignored_users()
-
-# Watchlist configuration
-WATCHLIST_CONFIG = load_watchlist_config()
-
-# AFK channels configuration
-AFK_CHANNEL_IDS = load_afk_channels()
-
-def reload_watchlist_config():
-    """Reload the watchlist configuration from file."""
-    global WATCHLIST_CONFIG
-    WATCHLIST_CONFIG = load_watchlist_config()
-
-def reload_ignored_users():
-    """Reload the ignored users list from file."""
-    global IGNORED_USER_IDS, voice_time_tracking
-    IGNORED_USER_IDS = load_ignored_users()
-    logging.info(f"Reloaded ignore list: {IGNORED_USER_IDS}")
-    
-    # Remove ignored users from voice_time_tracking
-    users_to_remove = [user_id for user_id in voice_time_tracking.keys() 
-                       if int(user_id) in IGNORED_USER_IDS]
-    
-    logging.info(f"Found {len(users_to_remove)} ignored users to remove from tracking")
-    for user_id in users_to_remove:
-        username = voice_time_tracking[user_id].get('username', 'Unknown')
-        del voice_time_tracking[user_id]
-        logging.info(f"Removed ignored user {user_id} ({username}) from voice tracking")
-    
-    if users_to_remove:
-        save_memory()
-        logging.info("Saved memory after removing ignored users")
-
-def reload_afk_channels():
-    """Reload the AFK channels list from file."""
-    global AFK_CHANNEL_IDS
-    AFK_CHANNEL_IDS = load_afk_channels()
+        asyncio.get_running_loop().create_task(update_tracking_for_channel_changes())
+    except RuntimeError:
+        # No event loop yet - on_ready builds the index anyway
+        pass
+
+def purge_ignored_users(reconcile=True):
+    """Remove ignored users from voice tracking after the ignore list changed."""
+    logging.info(f"Ignore list: {sorted(config.ignored_user_ids)}")
+    
+    # Remove ignored users from every guild's voice tracking (one lookup per ignored user, no scan of all users)
+    removed_count = 0
+    for guild_id, tracking in voice_time_tracking.items():
+        users_to_remove = [str(user_id) for user_id in sorted(config.ignored_user_ids) if str(user_id) in tracking]
+        for user_id in users_to_remove:
+            username = tracking[user_id].get('username', 'Unknown')
+            del tracking[user_id]
+            logging.info(f"Removed ignored user {user_id} ({username}) from voice tracking in guild {guild_id}")
+        if users_to_remove:
+            save_memory('delete', guild_id, *users_to_remove)
+            leaderboard_deltas.forget(guild_id, *users_to_remove)
+            removed_count += len(users_to_remove)
+    
+    logging.info(f"Found {removed_count} ignored users to remove from tracking")
+    
+    if reconcile:
+        request_reconciliation()
 
 def get_ignored_users():
-    """Get the current ignored users list."""
-    return IGNORED_USER_IDS
+    """Get the current ignored user IDs (a frozenset, O(1) membership)."""
+    return config.ignored_user_ids
 
-def is_muted_and_deafened(member):
-    """Check if a member is both muted AND deafened (either self or server).
-    Users who are both muted AND deafened should not be tracked.
-    """
-    if not member.voice:
+config.listen('ignore', purge_ignored_users)
+config.listen('afk', request_reconciliation)
+if recorder:
+    for config_name in ('ignore', 'watchlist', 'afk'):
+        config.listen(config_name, lambda: recorder.config(config))
+
+@tasks.loop(seconds=float(os.getenv('CONFIG_POLL_SECONDS', '5')))
+async def watch_config_files():
+    """Pick up hand edits to ignore.json, watchlist.json and afkchannels.json without a restart."""
+    await config.reload_if_changed_async()
+
+def is_voice_state_muted_and_deafened(voice_state):
+    """Check if a voice state is both muted AND deafened (either self or server)."""
+    if not voice_state or not voice_state.channel:
         return False
     
     # Check if muted (either self-muted or server-muted)
-    is_muted = member.voice.self_mute or member.voice.mute
+    is_muted = voice_state.self_mute or voice_state.mute
     
     # Check if deafened (either self-deafened or server-deafened)
-    is_deafened = member.voice.self_deaf or member.voice.deaf
+    is_deafened = voice_state.self_deaf or voice_state.deaf
     
     # Return True only if BOTH muted AND deafened
     return is_muted and is_deafened
 
-# Load voice tracking data from memory.json if it exists
-try:
-    with open('memory.json', 'r') as f:
-        voice_time_tracking = json.load(f)
-    
-    logging.info(f"Loaded {len(voice_time_tracking)} users from memory.json")
-    logging.info(f"Ignored users list: {IGNORED_USER_IDS}")
-    
-    # Clean up any ignored users from loaded data
-    users_to_remove = [user_id for user_id in voice_time_tracking.keys() 
-                       if int(user_id) in IGNORED_USER_IDS]
-    
-    logging.info(f"Startup cleanup: Found {len(users_to_remove)} ignored users to remove")
-    for user_id in users_to_remove:
-        username = voice_time_tracking[user_id].get('username', 'Unknown')
-        del voice_time_tracking[user_id]
-        logging.info(f"Startup cleanup: Removed ignored user {user_id} ({username})")
-    
-    if users_to_remove:
-        # Save the cleaned up memory immediately
-        with open('memory.json', 'w') as f:
-            json.dump(voice_time_tracking, f, indent=4)
-        logging.info("Startup cleanup: Saved cleaned memory.json")
-except (FileNotFoundError, json.JSONDecodeError):
-    voice_time_tracking = {}
-
-def save_memory():
-    """Save voice tracking data to memory.json"""
-    with open('memory.json', 'w') as f:
-        json.dump(voice_time_tracking, f, indent=4)
-
-def update_voice_times():
-    """Update voice times for users currently being tracked in voice channels (only those with multiple people)."""
-    current_time = datetime.now().timestamp()
-    
-    # Update time for users currently being tracked in voice channels
-    # Only users with 'join_time' are being actively tracked (not alone)
-    for user_id, time_data in voice_time_tracking.items():
-        if time_data.get('in_voice', False) and 'join_time' in time_data:
-            time_spent = current_time - time_data['join_time']
-            time_data['total_time'] += time_spent
-            time_data['join_time'] = current_time  # Reset join time to current time
-    
-    save_memory()
+def is_muted_and_deafened(member):
+    """Check if a member is both muted AND deafened (either self or server).
+    Users who are both muted AND deafened should not be tracked.
+    """
+    return is_voice_state_muted_and_deafened(member.voice)
 
-def should_reset():
-    """Check if it's time to reset the counters (00:10 CET)"""
-    cet = pytz.timezone('CET')
-    current_time = datetime.now(cet)
-    reset_time = current_time.replace(hour=0, minute=10, second=0, microsecond=0)
-    
-    # If current time is past reset time but before reset time + 1 minute
-    if current_time >= reset_time and current_time < reset_time + timedelta(minutes=1):
-        return True
-    return False
+# Channel -> roster index maintained from voice state events
+occupancy = OccupancyIndex()
 
-def organize_backup_files():
-    """Organize backup files into year/month/day subdirectories"""
-    backup_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backup')
-    
-    if not os.path.exists(backup_dir):
-        return
-    
-    # Get all .json files in the backup directory (not in subdirectories)
-    json_files = []
-    for file in os.listdir(backup_dir):
-        file_path = os.path.join(backup_dir, file)
-        if os.path.isfile(file_path) and file.endswith('.json') and file.startswith('memory-'):
-            json_files.append(file)
-    
-    organized_count = 0
+# Load voice tracking data from the configured storage backend (per-guild JSON files, binary snapshots or SQLite)
+# voice_time_tracking is partitioned by guild: {guild_id: {user_id: record}}
+phase_start = startup_phase('init', startup_started)
+tracking_storage = create_storage()
+if tracking_storage.name == 'sqlite' and tracking_storage.is_empty():
+    # First start on SQLite - carry over the existing JSON data
+    for guild_id, tracking in JsonStorage(os.getenv('MEMORY_DIR', 'memory')).load().items():
+        tracking_storage.import_memory(tracking, guild_id)
+        logging.info(f"Imported {len(tracking)} users of guild {guild_id} into the SQLite backend")
+voice_time_tracking = tracking_storage.load()
+phase_start = startup_phase('load', phase_start)
+logging.info(f"Loaded {sum(len(tracking) for tracking in voice_time_tracking.values())} users in {len(voice_time_tracking)} guilds from {tracking_storage}")
+
+# In-memory layout of each guild's tracking data: plain dicts, or parallel typed arrays (TRACKING_LAYOUT=columnar)
+TRACKING_LAYOUT = os.getenv('TRACKING_LAYOUT', 'dict').lower()
+
+def new_guild_tracking(records=None):
+    if TRACKING_LAYOUT == 'columnar':
+        # The binary backend already loads snapshots as columns
+        return records if isinstance(records, ColumnarTracking) else ColumnarTracking(records)
+    return dict(records or {})
+
+def guild_tracking(guild_id):
+    """Return one guild's tracking dictionary ({user_id: record}), creating it on first use."""
+    guild_key = str(guild_id)
+    tracking = voice_time_tracking.get(guild_key)
+    if tracking is None:
+        tracking = voice_time_tracking[guild_key] = new_guild_tracking()
+    return tracking
+
+# Replay transitions journaled since the last snapshot (snapshot + journal tail = exact state)
+memory_journal = VoiceJournal(worker_path('memory.journal')) if os.getenv('MEMORY_JOURNAL', '1') != '0' else None
+replayed_entries = memory_journal.replay(voice_time_tracking) if memory_journal else 0
+if replayed_entries:
+    logging.info(f"Replayed {replayed_entries} journal entries on top of {tracking_storage}")
+
+# Every worker of a cluster shares the storage backend but only keeps (and writes) the guilds of its shards
+foreign_guilds = [guild_id for guild_id in voice_time_tracking if not owns_guild(guild_id)]
+for guild_id in foreign_guilds:
+    del voice_time_tracking[guild_id]
+if foreign_guilds:
+    logging.info(f"Skipped {len(foreign_guilds)} guilds run by other shards, keeping {len(voice_time_tracking)} of shards {SHARD_IDS}")
+phase_start = startup_phase('journal', phase_start)
+
+logging.info(f"Ignored users list: {sorted(config.ignored_user_ids)}")
+
+# Clean up any ignored users from loaded data
+users_to_remove = []
+for guild_id, tracking in voice_time_tracking.items():
+    for user_id in [str(user_id) for user_id in sorted(config.ignored_user_ids) if str(user_id) in tracking]:
+        username = tracking[user_id].get('username', 'Unknown')
+        del tracking[user_id]
+        users_to_remove.append(user_id)
+        logging.info(f"Startup cleanup: Removed ignored user {user_id} ({username}) from guild {guild_id}")
+
+logging.info(f"Startup cleanup: Found {len(users_to_remove)} ignored users to remove")
+
+if TRACKING_LAYOUT == 'columnar':
+    # Loaded and replayed as dicts, then converted once
+    for guild_id in list(voice_time_tracking):
+        voice_time_tracking[guild_id] = new_guild_tracking(voice_time_tracking[guild_id])
+    logging.info(f"Voice tracking kept in columnar arrays ({'NumPy' if ColumnarTracking.vectorized() else 'no NumPy, batch loops'})")
+
+# Write-behind persistence: transitions go to the journal, snapshots are coalesced background writes
+memory_store = WriteBehindStore(
+    tracking_storage,
+    lambda: voice_time_tracking,
+    flush_window=float(os.getenv('MEMORY_FLUSH_WINDOW', '2')),
+    journal=memory_journal,
+    compact_every=int(os.getenv('MEMORY_COMPACT_EVERY', '1000')),
+    io=blocking_io,
+    # Snapshot writes grow with the data; 0 waits for them however long the disk takes
+    write_timeout=float(os.getenv('MEMORY_FLUSH_TIMEOUT', '0'))
+)
+
+observe_flushes(memory_store, 'memory')
+
+if users_to_remove or replayed_entries:
+    # Saved (and the journal compacted) by the single write after on_ready's reconciliation;
+    # until then the journal still holds everything that was replayed
+    memory_store.mark_all_dirty()
+# Opt-in: the loaded tracking data lives for the whole run, so it can be kept out of the garbage
+# collector's full collections, which rescan every record. Off by default because frozen objects
+# are never collected, so records deleted later (resets, !remove, restores) are not freed either
+if os.getenv('GC_FREEZE', '0') == '1':
+    gc.freeze()
+phase_start = startup_phase('cleanup', phase_start)
+
+# Leaderboard order per guild, updated from every save instead of sorting on each !leaderboard
+ranking = RankingIndex(lambda: voice_time_tracking)
+
+# Rendered leaderboard pages, reused while fresh and unchanged at minute resolution
+leaderboard_cache = RenderCache(
+    ttl=float(os.getenv('LEADERBOARD_CACHE_TTL', '30')),
+    cooldown=float(os.getenv('LEADERBOARD_COOLDOWN', '10'))
+)
+
+# Totals and ranks from the last leaderboard post (cache.json), for "+1h 12m, ▲3" deltas
+leaderboard_deltas = LeaderboardDeltas(worker_path('cache.json'), flush_window=float(os.getenv('MEMORY_FLUSH_WINDOW', '2')), io=blocking_io)
+observe_flushes(leaderboard_deltas.store, 'cache')
+
+metrics.gauge('voice_bot_tracked_users', 'Users with tracking data', ('guild',),
+              collect=lambda: {(guild_id,): len(tracking) for guild_id, tracking in voice_time_tracking.items()})
+metrics.gauge('voice_bot_active_sessions', 'Users whose voice time is being counted right now', ('guild',),
+              collect=lambda: {(guild_id,): tracking.active_count() if isinstance(tracking, ColumnarTracking)
+                               else sum(1 for record in tracking.values() if 'join_time' in record)
+                               for guild_id, tracking in voice_time_tracking.items()})
+metrics.gauge('voice_bot_startup_phase_seconds', 'Duration of each startup phase, on_ready phases from the last (re)connect', ('phase',),
+              collect=lambda: {(name,): seconds for name, seconds in startup_phases.items()})
+metrics.gauge('voice_bot_outbox_pending_messages', 'Messages waiting in the per-channel send queues',
+              collect=lambda: {(): outbox.stats()['pending']})
+
+def save_memory(op, guild_id, *user_ids, ts=None):
+    """Record a tracking transition in a guild (journaled); storage is updated by the next coalesced flush."""
+    save_memory_calls.inc(op)
+    memory_store.record(op, guild_id, *user_ids, ts=ts)
+    if op == 'reset':
+        ranking.invalidate(guild_id)
+    else:
+        ranking.update(guild_id, *user_ids)
+
+# Hourly voice time history: survives the daily reset and answers range queries (!stats, !top)
+voice_history = HistoryArchive(os.getenv('HISTORY_DIR', 'history'))
+
+async def flush_history():
+    """Write changed history blocks off the event loop."""
+    writes = voice_history.take_snapshot()
+    try:
+        await blocking_io.run('flush history', voice_history.write, writes)
+    except Exception as e:
+        # Rewritten by the next flush
+        voice_history.restore_dirty(writes)
+        logging.error(f"Failed to write voice history to {voice_history}: {e}")
+
+async def flush_memory():
+    """Write all pending voice tracking changes and voice history to storage right away."""
+    await memory_store.flush_async()
+    await flush_history()
+    await leaderboard_deltas.flush_async()
+
+def log_persistence_stats():
+    """Log flush rate and bytes written by the write-behind store, and the periodic stats of the other subsystems."""
+    stats = memory_store.stats()
+    logging.info(
+        f"Persistence: {stats['mutations']} mutations coalesced into {stats['flushes']} flushes "
+        f"({stats['flush_rate_per_min']:.2f}/min), {stats['bytes_written']} bytes written, "
+        f"last flush {stats['last_flush_ms']:.1f}ms"
+    )
+    history_stats = voice_history.stats()
+    logging.info(f"Voice history: {history_stats['blocks']} day blocks in {history_stats['guilds']} guilds ({history_stats['bytes']} bytes)")
+    cache_stats = leaderboard_cache.stats()
+    logging.info(
+        f"Leaderboard cache: {cache_stats['hits']} hits, {cache_stats['throttled']} throttled, "
+        f"{cache_stats['misses']} misses ({cache_stats['hit_rate']:.0%} served without rendering)"
+    )
+    outbox_stats = outbox.stats()
+    logging.info(
+        f"Outbox: {outbox_stats['sent']} messages sent, {outbox_stats['coalesced']} notices merged, "
+        f"{outbox_stats['rate_limit_waits']} rate limit waits, {outbox_stats['pending']} pending"
+    )
+    io_stats = blocking_io.stats()
+    if io_stats['operations']:
+        logging.info("Blocking I/O: " + ', '.join(
+            f"{name} {op['calls']}x avg {op['avg_ms']:.1f}ms max {op['max_ms']:.1f}ms"
+            + (f" ({op['errors']} errors, {op['timeouts']} timeouts)" if op['errors'] or op['timeouts'] else "")
+            for name, op in sorted(io_stats['operations'].items())
+        ))
+    logging.info("Scheduler: " + '; '.join(
+        f"{name} {job['runs']} runs ({job['failures']} failed), last {job['last_duration_ms']:.0f}ms, next at {job['next_run']:%Y-%m-%d %H:%M}"
+        for name, job in scheduler.stats().items()
+    ))
+
+def update_voice_times(guild_id=None):
+    """Update voice times for users currently being tracked in voice channels (only those with multiple people).
+    Only the given guild is updated when guild_id is set, otherwise every guild."""
+    current_time = clock()
+    guild_ids = [str(guild_id)] if guild_id is not None else list(voice_time_tracking)
     
-    for filename in json_files:
-        # Parse filename: memory-YEAR-MONTH-DAY-COUNT.json
-        try:
-            # Remove 'memory-' prefix and '.json' suffix
-            date_part = filename[7:-5]  # Remove 'memory-' and '.json'
-            
-            # Split by '-' to get year, month, day, count
-            parts = date_part.split('-')
-            if len(parts) >= 4:
-                year = parts[0]
-                month = parts[1]
-                day = parts[2]
-                
-                # Create year directory
-                year_dir = os.path.join(backup_dir, year)
-                os.makedirs(year_dir, exist_ok=True)
-                
-                # Create month directory
-                month_dir = os.path.join(year_dir, month)
-                os.makedirs(month_dir, exist_ok=True)
-                
-                # Create day directory
-                day_dir = os.path.join(month_dir, day)
-                os.makedirs(day_dir, exist_ok=True)
-                
-                # Move file to day directory
-                old_path = os.path.join(backup_dir, filename)
-                new_path = os.path.join(day_dir, filename)
-                
-                if not os.path.exists(new_path):
-                    shutil.move(old_path, new_path)
-                    organized_count += 1
-                    logging.info(f"Organized backup file: {filename} -> {year}/{month}/{day}/")
-                
-        except (ValueError, IndexError) as e:
-            logging.warning(f"Could not parse backup filename: {filename} - {e}")
+    for guild_key in guild_ids:
+        # Update time for users currently being tracked in voice channels
+        # Only users with 'join_time' are being actively tracked (not alone)
+        updated_ids = []
+        tracking = voice_time_tracking.get(guild_key, {})
+        if isinstance(tracking, ColumnarTracking):
+            # One batch update over the arrays
+            for user_id, join_time in tracking.accrue(current_time):
+                voice_history.record(guild_key, user_id, join_time, current_time)
+                updated_ids.append(user_id)
+        else:
+            for user_id, time_data in tracking.items():
+                if time_data.get('in_voice', False) and 'join_time' in time_data:
+                    time_spent = current_time - time_data['join_time']
+                    time_data['total_time'] += time_spent
+                    voice_history.record(guild_key, user_id, time_data['join_time'], current_time)
+                    time_data['join_time'] = current_time  # Reset join time to current time
+                    updated_ids.append(user_id)
+        
+        if updated_ids:
+            save_memory('accrue', guild_key, *updated_ids, ts=current_time)
+
+# Incremental compressed backups (base + deltas of changed records) with tiered retention
+backup_engine = BackupEngine(
+    os.getenv('BACKUP_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backup'),
+    max_chain=int(os.getenv('BACKUP_MAX_CHAIN', '50'))
+)
+
+async def backup_memory(guild_id=None):
+    """Create an incremental backup of each guild's tracking data in backup/<guild_id>/YEAR/MONTH/DAY/ and prune old backups"""
+    guild_ids = [str(guild_id)] if guild_id is not None else list(voice_time_tracking)
+    for guild_key in guild_ids:
+        tracking = voice_time_tracking.get(guild_key)
+        if not tracking:
+            # Nothing has been tracked for this guild yet
             continue
-    
-    if organized_count > 0:
-        logging.info(f"Organized {organized_count} backup files into subdirectories")
+        # Copy the records on the loop; compressing and writing happens in the I/O pool
+        records = {user_id: dict(record) for user_id, record in tracking.items()}
+        result = await blocking_io.run('backup', backup_engine.backup, guild_key, records)
+        if result is None:
+            logging.info(f"Backup skipped for guild {guild_key}: nothing changed since the last backup")
+        else:
+            backup_path, written = result
+            logging.info(f"Created backup: {os.path.relpath(backup_path, backup_engine.directory)} ({written} bytes)")
+        removed = await blocking_io.run('prune backups', backup_engine.prune, guild_key)
+        if removed:
+            logging.info(f"Retention: removed {removed} old backups of guild {guild_key}")
 
-def backup_memory():
-    """Create a backup of memory.json with date in filename in organized directory structure"""
-    # Create backup directory if it doesn't exist
-    backup_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backup')
-    os.makedirs(backup_dir, exist_ok=True)
-    
-    # Generate backup filename with current date and time
-    current_datetime = datetime.now()
-    year = current_datetime.strftime('%Y')
-    month = current_datetime.strftime('%m')
-    day = current_datetime.strftime('%d')
-    time_str = current_datetime.strftime('%H%M')
-    
-    # Create organized directory structure
-    year_dir = os.path.join(backup_dir, year)
-    os.makedirs(year_dir, exist_ok=True)
-    
-    month_dir = os.path.join(year_dir, month)
-    os.makedirs(month_dir, exist_ok=True)
+async def restore_guild(guild, point):
+    """
+    Replace a guild's live tracking data with its data as of a backup point, without a restart.
+    The current data is backed up first. Users in voice right now keep their running session.
+    Returns (restored user count, backup point of the data before the restore).
+    """
+    guild_key = str(guild.id)
+    # Rebuild the snapshot from its base and deltas off the event loop
+    state = await blocking_io.run('restore backup', backup_engine.restore, guild_key, point.taken_at)
     
-    day_dir = os.path.join(month_dir, day)
-    os.makedirs(day_dir, exist_ok=True)
+    # Back up the current data (with running sessions accrued) so the restore can be undone
+    update_voice_times(guild_key)
+    records = {user_id: dict(record) for user_id, record in guild_tracking(guild_key).items()}
+    await blocking_io.run('backup', backup_engine.backup, guild_key, records)
+    undo_point = backup_engine.latest(guild_key)
     
-    # Generate backup filename and path in organized structure
-    backup_filename = f'memory-{year}-{month}-{day}-{time_str}.json'
-    backup_path = os.path.join(day_dir, backup_filename)
+    tracking = guild_tracking(guild_key)
+    live = {user_id: dict(record) for user_id, record in tracking.items()}
+    tracking.clear()
+    for user_id, record in state.items():
+        if int(user_id) in config.ignored_user_ids:
+            continue
+        tracking[user_id] = {
+            'username': record.get('username', 'Unknown'),
+            'total_time': record.get('total_time', 0),
+            'in_voice': False
+        }
+    for user_id, record in live.items():
+        # Sessions running right now were accrued up to now above and continue from here
+        if record.get('in_voice', False):
+            restored = tracking.setdefault(user_id, {'username': record['username'], 'total_time': 0})
+            restored['in_voice'] = True
+            if 'join_time' in record:
+                restored['join_time'] = record['join_time']
     
-    # Copy the file
-    shutil.copy2('memory.json', backup_path)
-    logging.info(f"Created backup: {backup_filename} in {year}/{month}/{day}/")
+    # Rewrite the whole guild in storage and drop everything derived from the old data
+    memory_store.mark_dirty(guild_key)
+    ranking.invalidate(guild_key)
+    leaderboard_cache.invalidate(lambda key: key[0] == guild.id)
+    for channel in guild.voice_channels:
+        await update_tracking_for_specific_channel(channel)
+    await flush_memory()
+    logging.info(f"Restored {len(tracking)} users of guild {guild_key} from the backup of {point.taken_at}")
+    return len(state), undo_point
 
-def reset_counters():
-    """Reset all users' total_time to 0"""
+async def reset_counters(guild_id=None):
+    """Reset all users' total_time to 0 (in one guild when guild_id is set, otherwise in every guild)"""
     logging.info("Resetting daily voice time counters...")
     # Create backup before reset
-    backup_memory()
-    for user_id in voice_time_tracking:
-        voice_time_tracking[user_id]['total_time'] = 0
-    save_memory()
-
-@tasks.loop(minutes=120)
-async def periodic_update():
-    """Task that runs every 2 hours to update voice times, create backup, and check for daily reset."""
+    await memory_store.flush_async()
+    guild_ids = [str(guild_id)] if guild_id is not None else list(voice_time_tracking)
+    for guild_key in guild_ids:
+        await backup_memory(guild_key)
+        tracking = voice_time_tracking.get(guild_key, {})
+        if isinstance(tracking, ColumnarTracking):
+            tracking.reset_totals()
+        else:
+            for user_id in tracking:
+                tracking[user_id]['total_time'] = 0
+        save_memory('reset', guild_key)
+
+def legacy_target_guild_id():
+    """
+    The guild that data from before per-guild partitioning belongs to: LEGACY_GUILD_ID, or
+    the only guild the bot is in (a clustered worker only sees its own shards, so there
+    LEGACY_GUILD_ID is required). None when it cannot be told.
+    """
+    if os.getenv('LEGACY_GUILD_ID'):
+        return int(os.getenv('LEGACY_GUILD_ID'))
+    if not SHARD_COUNT and len(bot.guilds) == 1:
+        return bot.guilds[0].id
+    return None
+
+legacy_backup_import = None
+
+async def adopt_legacy_backups():
+    """
+    Load the backup catalog, then list the backups from before per-guild backups
+    (backup/YYYY/MM/DD/memory-*.json) under their guild for !backup and !restore.
+    """
+    try:
+        # The first catalog load may have to read every old backup file for its checksum
+        await blocking_io.run('load backup catalog', backup_engine.load_catalog, timeout=600)
+    except Exception as e:
+        logging.error(f"Could not load the backup catalog: {e}")
+        return
+    guild_id = legacy_target_guild_id()
+    if guild_id is None or not owns_guild(guild_id):
+        return
+    try:
+        adopted = await blocking_io.run('adopt legacy backups', backup_engine.adopt_legacy, guild_id, timeout=600)
+    except Exception as e:
+        logging.error(f"Could not catalog backups from before per-guild backups: {e}")
+        return
+    if adopted:
+        logging.info(f"Listed {adopted} backups from before per-guild backups under guild {guild_id}")
+
+async def migrate_legacy_partition():
+    """
+    Move tracking data written before it was partitioned by guild (old memory.json, journal
+    entries and SQLite rows without a guild) into the guild it belongs to (legacy_target_guild_id).
+    """
+    legacy = voice_time_tracking.get(LEGACY_GUILD_KEY)
+    if not legacy:
+        return
+    target_guild_id = legacy_target_guild_id()
+    if target_guild_id is None:
+        logging.warning(f"Found {len(legacy)} users tracked before per-guild partitioning but the bot is in {len(bot.guilds)} guilds{' (this shard)' if SHARD_COUNT else ''} - set LEGACY_GUILD_ID to migrate them")
+        return
+    
+    tracking = guild_tracking(target_guild_id)
+    for user_id, record in legacy.items():
+        # Records the guild already has win, so running the migration twice changes nothing
+        tracking.setdefault(user_id, record)
+    # Persist the guild before dropping the legacy data
+    memory_store.mark_dirty(target_guild_id)
+    await memory_store.flush_async()
+    memory_store.drop_guild(LEGACY_GUILD_KEY)
+    ranking.invalidate(target_guild_id)
+    logging.info(f"Migrated {len(legacy)} users tracked before per-guild partitioning into guild {target_guild_id}")
+
+# Wall-clock jobs (cron syntax, SCHEDULER_TIMEZONE); the scheduler only wakes up when a job is due
+scheduler = Scheduler(os.getenv('SCHEDULER_TIMEZONE', 'CET'), worker_path('scheduler.json'), io=blocking_io)
+
+async def accrual_job():
+    """Add running sessions to the totals and write everything to storage."""
+    if recorder:
+        recorder.record('job', name='accrual')
+        recorder.flush()
     logging.info("Updating voice chat times...")
     update_voice_times()
-    
-    # Create backup
-    backup_memory()
-    
-    if should_reset():
-        reset_counters()
-        # Log the reset
-        logging.info("Daily voice time counters have been reset")
+    await flush_memory()
+    log_persistence_stats()
+
+async def backup_job():
+    """Back up every guild's tracking data."""
+    if recorder:
+        recorder.record('job', name='backup')
+    update_voice_times()
+    await flush_memory()
+    await backup_memory()
+
+async def reset_job():
+    """Daily reset of the voice time counters (backed up first)."""
+    if recorder:
+        recorder.record('job', name='reset')
+    update_voice_times()
+    await reset_counters()
+    logging.info("Daily voice time counters have been reset")
+
+scheduler_jitter = float(os.getenv('SCHEDULER_JITTER', '60'))
+scheduler.add('accrual', os.getenv('ACCRUAL_CRON', '0 */2 * * *'), accrual_job, jitter=scheduler_jitter)
+# A backup or reset missed while the bot was down runs once on startup
+scheduler.add('backup', os.getenv('BACKUP_CRON', '0 */2 * * *'), backup_job, jitter=scheduler_jitter, catch_up=True)
+scheduler.add('reset', os.getenv('RESET_CRON', '10 0 * * *'), reset_job, catch_up=True)
+
+# Minutes between optional full rescans of every voice channel (0 disables them)
+VOICE_RECONCILE_MINUTES = float(os.getenv('VOICE_RECONCILE_MINUTES', '30'))
+
+@tasks.loop(minutes=VOICE_RECONCILE_MINUTES or 30)
+async def reconcile_voice_tracking():
+    """Safety net: rescan all voice channels in case the occupancy index drifted from Discord's state."""
+    if reconcile_voice_tracking.current_loop == 0:
+        # on_ready has just run a full pass
+        return
+    logging.info("Reconciling voice tracking against all voice channels...")
+    if recorder:
+        recorder.rosters('reconcile', bot.guilds)
+    await update_tracking_for_channel_changes()
 
 @bot.event
 async def on_ready():
-    """Event handler for when the bot is ready and connected to Discord."""
+    """
+    Event handler for when the bot is ready and connected to Discord: one reconciliation
+    pass against the live voice rosters and one write, with slow housekeeping moved to
+    background tasks. Time to ready is logged per phase.
+    """
+    global legacy_backup_import, resync_pending
     logging.info(f'{bot.user} has connected to Discord!')
     logging.info(f'Bot is in {len(bot.guilds)} guilds')
+    phase_start = time.perf_counter()
+    first_ready = legacy_backup_import is None
+    if cluster:
+        cluster.start()
+    if first_ready:
+        startup_phases['connect'] = phase_start - startup_loaded
+        # Load the backup catalog and catalog old backup files in the background (on_ready also runs after every reconnect)
+        legacy_backup_import = asyncio.get_running_loop().create_task(adopt_legacy_backups())
     
-    # Organize backup files into subdirectories
-    organize_backup_files()
+    resync_pending = True
+    try:
+        # Reload config files that changed while disconnected and drop ignored users
+        await config.reload_if_changed_async()
+        purge_ignored_users(reconcile=False)
+        logging.info(f'Loaded {len(config.ignored_user_ids)} ignored users from ignore.json')
+        phase_start = startup_phase('config', phase_start)
+        
+        # Move data tracked before per-guild partitioning into its guild
+        await migrate_legacy_partition()
+        phase_start = startup_phase('migrate', phase_start)
+        
+        if recorder:
+            recorder.config(config)
+            recorder.rosters('ready', bot.guilds)
+        await resync_voice_tracking()
+        phase_start = startup_phase('reconcile', phase_start)
+    finally:
+        resync_pending = False
+    
+    # One write of everything loaded, cleaned up and reconciled
+    await flush_memory()
+    phase_start = startup_phase('persist', phase_start)
     
-    # Reload ignored users and watchlist config to ensure they're up to date
-    reload_ignored_users()
-    reload_watchlist_config()
-    logging.info(f'Loaded {len(IGNORED_USER_IDS)} ignored users from ignore.json')
+    seed_presence()
     
-    # Check all users marked as in_voice
+    if metrics_server.port:
+        try:
+            await metrics_server.start()
+        except OSError as e:
+            logging.error(f"Could not start the metrics endpoint on {metrics_server.host}:{metrics_server.port}: {e}")
+    
+    scheduler.start()  # Start the accrual, backup and reset jobs (no-op after a reconnect)
+    if VOICE_RECONCILE_MINUTES > 0 and not reconcile_voice_tracking.is_running():
+        reconcile_voice_tracking.start()
+    if not watch_config_files.is_running():
+        watch_config_files.start()
+    startup_phase('start', phase_start)
+    log_startup_phases(first_ready)
+
+def log_startup_phases(first_ready):
+    """Log time to ready per phase: from process start on the first connect, on_ready's own phases after a reconnect."""
+    if first_ready:
+        names = [name for name in startup_phases]
+        total = time.perf_counter() - startup_started
+        label = 'Ready'
+    else:
+        names = ['config', 'migrate', 'reconcile', 'persist', 'start']
+        total = sum(startup_phases[name] for name in names)
+        label = 'Ready again after reconnect'
+    breakdown = ', '.join(f"{name} {startup_phases[name] * 1000:.0f}ms" for name in names)
+    logging.info(f"{label} in {total * 1000:.0f}ms ({breakdown})")
+
+@handler_latency.time('resync_voice_tracking')
+async def resync_voice_tracking():
+    """
+    Bring tracking in line with who is in voice right now, in one pass per guild: close the
+    sessions of users who left while the bot was disconnected, rebuild the occupancy index
+    from the live rosters and mark everyone found in voice, starting their session only
+    where it is tracked (not alone, not muted AND deafened, not in an AFK channel).
+    """
+    occupancy.clear()
+    ignored_ids = get_ignored_users()
     for guild in bot.guilds:
-        voice_members = set()
-        for voice_channel in guild.voice_channels:
-            for member in voice_channel.members:
-                voice_members.add(str(member.id))
+        current_time = clock()
+        tracking = guild_tracking(guild.id)
+        found = {}  # member_id -> (member, channel_id, counted)
+        for channel in guild.voice_channels:
+            members = [member for member in channel.members if member.id not in ignored_ids]
+            counted = channel.id not in config.afk_channel_ids
+            # The index holds the members reconciliation would track; bots in AFK channels are not tracked at all
+            indexed = members if counted else [member for member in members if not member.bot]
+            occupancy.reset_channel(guild.id, channel.id,
+                                    [(member.id, member.name, not is_muted_and_deafened(member)) for member in indexed])
+            for member in members:
+                found[str(member.id)] = (member, channel.id, counted)
         
-        # Update voice_time_tracking for users not actually in voice
-        for user_id, data in voice_time_tracking.items():
-            if data.get('in_voice', False) and user_id not in voice_members:
-                current_time = datetime.now().timestamp()
-                if 'join_time' in data:
-                    time_spent = current_time - data['join_time']
-                    data['total_time'] += time_spent
-                    del data['join_time']
-                data['in_voice'] = False
-        save_memory()
-    
-    # Check for users already in voice channels
-    current_time = datetime.now().timestamp()
-    for guild in bot.guilds:
-        for voice_channel in guild.voice_channels:
-            for member in voice_channel.members:
-                # Skip ignored users
-                if member.id in IGNORED_USER_IDS:
-                    continue
-                    
-                member_id = str(member.id)
-                if member_id not in voice_time_tracking:
-                    voice_time_tracking[member_id] = {
-                        'username': member.name,
-                        'total_time': 0,
-                        'in_voice': False
-                    }
-                
-                # Update status and join time for users already in voice
-                voice_time_tracking[member_id]['in_voice'] = True
-                voice_time_tracking[member_id]['join_time'] = current_time
-                logging.info(f"Found user {member.name} in channel {voice_channel.name}")
-    
-    save_memory()
-    periodic_update.start()  # Start the periodic update task
+        # Sessions of users who are no longer in voice
+        left_ids = []
+        in_voice_ids = tracking.in_voice_ids() if isinstance(tracking, ColumnarTracking) else [
+            user_id for user_id, data in tracking.items() if data.get('in_voice', False)]
+        for user_id in in_voice_ids:
+            if user_id in found:
+                continue
+            data = tracking[user_id]
+            if 'join_time' in data:
+                data['total_time'] += current_time - data['join_time']
+                voice_history.record(guild.id, user_id, data['join_time'], current_time)
+                del data['join_time']
+            data['in_voice'] = False
+            left_ids.append(user_id)
+        
+        # Everyone in voice: tracked from now on where the channel allows it
+        for member_id, (member, channel_id, counted) in found.items():
+            data = tracking.get(member_id)
+            if data is None:
+                tracking[member_id] = {'username': member.name, 'total_time': 0, 'in_voice': True}
+                data = tracking[member_id]
+            else:
+                data['in_voice'] = True
+            if counted and occupancy.should_track(channel_id, member.id):
+                data['join_time'] = current_time
+            elif 'join_time' in data:
+                del data['join_time']
+        # Not journaled: on_ready writes the result right after this pass, and a crash before
+        # that only means the next start reconciles the same sessions again
+        changed_ids = left_ids + list(found)
+        if changed_ids:
+            memory_store.mark_dirty(guild.id, *changed_ids)
+            ranking.update(guild.id, *changed_ids)
+        if found or left_ids:
+            logging.info(f"Reconciled {guild.name}: {len(found)} users in voice, {len(left_ids)} sessions closed")
+        # Let commands and gateway events in between guilds
+        await asyncio.sleep(0)
 
 # Setup commands
-setup_leaderboard(bot, voice_time_tracking, get_ignored_users, update_voice_times)
-setup_restart(bot, save_memory, periodic_update, update_voice_times)
-setup_update(bot, save_memory, periodic_update, update_voice_times)
-setup_watchlist(bot)
-setup_ignore(bot, reload_ignored_users)
-setup_listid(bot)
-setup_backup(bot)
-setup_afkchannel(bot, reload_afk_channels)
-setup_timeedit(bot, voice_time_tracking, update_voice_times, save_memory)
+setup_leaderboard(bot, guild_tracking, get_ignored_users, update_voice_times, ranking, leaderboard_cache, leaderboard_deltas)
+setup_restart(bot, flush_memory, scheduler, update_voice_times, cluster)
+setup_update(bot, flush_memory, scheduler, update_voice_times, blocking_io, cluster)
+setup_watchlist(bot, config, outbox)
+setup_ignore(bot, config, outbox)
+setup_listid(bot, guild_tracking, outbox)
+setup_backup(bot, backup_engine, restore_guild, blocking_io)
+setup_afkchannel(bot, config, outbox)
+setup_timeedit(bot, guild_tracking, update_voice_times, save_memory)
+setup_stats(bot, guild_tracking, get_ignored_users, update_voice_times, voice_history)
+setup_profile(bot, profiler)
+if cluster:
+    setup_cluster(bot, cluster)
+
+@bot.before_invoke
+async def start_command_timer(ctx):
+    ctx.started_at = time.perf_counter()
+    if recorder:
+        recorder.record('command', g=ctx.guild.id if ctx.guild else None, c=ctx.channel.id, u=ctx.author.id,
+                        name=ctx.command.qualified_name)
+
+@bot.after_invoke
+async def observe_command_latency(ctx):
+    handler_latency.observe(time.perf_counter() - ctx.started_at, f"command:{ctx.command.qualified_name}")
 
 @bot.event
+@handler_latency.time('on_voice_state_update')
 async def on_voice_state_update(member, before, after):
     """Track time spent in voice channels, but only when there are multiple people in the channel and not in AFK channels."""
+    if recorder:
+        recorder.voice(member, before, after)
     # Ignore specified users
     if member.id in get_ignored_users():
         return
         
-    current_time = datetime.now().timestamp()
+    current_time = clock()
     member_id = str(member.id)
+    guild_id = member.guild.id
+    tracking = guild_tracking(guild_id)
     
     # Initialize user data if not exists
-    if member_id not in voice_time_tracking:
-        voice_time_tracking[member_id] = {
+    if member_id not in tracking:
+        tracking[member_id] = {
             'username': member.name,
             'total_time': 0,
             'in_voice': False
         }
     
+    # Update the occupancy index in O(1) and collect the members whose tracking may flip
+    new_channel_id = after.channel.id if after and after.channel else None
+    candidates = occupancy.move(
+        guild_id, member.id, member.name, new_channel_id,
+        trackable=not is_voice_state_muted_and_deafened(after)
+    )
+    
     # Handle leaving voice channel
     if before and before.channel:
         # Check if the channel is an AFK channel - if so, don't track time
-        if before.channel.id not in AFK_CHANNEL_IDS:
-            if voice_time_tracking[member_id].get('in_voice', False):
-                if 'join_time' in voice_time_tracking[member_id]:
+        if before.channel.id not in config.afk_channel_ids:
+            if tracking[member_id].get('in_voice', False):
+                if 'join_time' in tracking[member_id]:
                     # Only count time if there were multiple people in the channel
                     # Check if there are still other members in the channel after this user left
-                    remaining_members = [m for m in before.channel.members if m.id != member.id and m.id not in get_ignored_users()]
-                    if len(remaining_members) >= 1:  # There were at least 2 people (including the leaving member)
-                        time_spent = current_time - voice_time_tracking[member_id]['join_time']
-                        voice_time_tracking[member_id]['total_time'] += time_spent
-                    del voice_time_tracking[member_id]['join_time']
+                    if occupancy.roster_size(before.channel.id, exclude_member_id=member.id) >= 1:  # There were at least 2 people (including the leaving member)
+                        time_spent = current_time - tracking[member_id]['join_time']
+                        tracking[member_id]['total_time'] += time_spent
+                        voice_history.record(guild_id, member_id, tracking[member_id]['join_time'], current_time)
+                    del tracking[member_id]['join_time']
         
         # Always update in_voice status regardless of AFK channel
-        voice_time_tracking[member_id]['in_voice'] = False
+        tracking[member_id]['in_voice'] = False
         # Clean up join_time if it exists when leaving any channel
-        if 'join_time' in voice_time_tracking[member_id]:
-            del voice_time_tracking[member_id]['join_time']
-        save_memory()
+        if 'join_time' in tracking[member_id]:
+            del tracking[member_id]['join_time']
+        save_memory('leave', guild_id, member_id)
     
     # Handle joining voice channel
     if after and after.channel:
-        logging.info(f"VOICE JOIN EVENT: {member.name} joined channel '{after.channel.name}' - checking ALL members")
+        logging.info(f"VOICE JOIN EVENT: {member.name} joined channel '{after.channel.name}'")
         # Check if the channel is an AFK channel - if so, don't track time
-        if after.channel.id in AFK_CHANNEL_IDS:
+        if after.channel.id in config.afk_channel_ids:
             # Mark as in voice but don't track time in AFK channels
-            voice_time_tracking[member_id]['in_voice'] = True
+            tracking[member_id]['in_voice'] = True
             # Remove join_time if it exists to prevent tracking
-            if 'join_time' in voice_time_tracking[member_id]:
-                del voice_time_tracking[member_id]['join_time']
+            if 'join_time' in tracking[member_id]:
+                del tracking[member_id]['join_time']
             logging.info(f"User joined AFK channel - marked as in voice but not tracked")
         else:
             # Count non-ignored members in the channel (including the joining member)
-            # Exclude users who are both muted AND deafened from being counted
-            non_ignored_members = [m for m in after.channel.members if m.id not in get_ignored_users() and not is_muted_and_deafened(m)]
+            # Users who are both muted AND deafened are not counted by the index
+            trackable_count = occupancy.trackable_count(after.channel.id)
             
             # Check if the joining user is both muted AND deafened
-            if is_muted_and_deafened(member):
+            if is_voice_state_muted_and_deafened(after):
                 # Mark as in voice but don't track (muted AND deafened)
-                voice_time_tracking[member_id]['in_voice'] = True
-                if 'join_time' in voice_time_tracking[member_id]:
-                    del voice_time_tracking[member_id]['join_time']
+                tracking[member_id]['in_voice'] = True
+                if 'join_time' in tracking[member_id]:
+                    del tracking[member_id]['join_time']
                 logging.info(f"User {member.name} is muted AND deafened - marked as in voice but not tracked")
             # Only start tracking if there are multiple people in the channel who can be tracked
-            elif len(non_ignored_members) >= 2:
-                voice_time_tracking[member_id]['join_time'] = current_time
-                voice_time_tracking[member_id]['in_voice'] = True
-                logging.info(f"Started tracking for {member.name} (channel now has {len(non_ignored_members)} trackable members)")
+            elif trackable_count >= 2:
+                tracking[member_id]['join_time'] = current_time
+                tracking[member_id]['in_voice'] = True
+                logging.info(f"Started tracking for {member.name} (channel now has {trackable_count} trackable members)")
             else:
                 # If alone, mark as in voice but don't set join_time (no tracking)
-                voice_time_tracking[member_id]['in_voice'] = True
+                tracking[member_id]['in_voice'] = True
                 # Remove join_time if it exists to prevent tracking
-                if 'join_time' in voice_time_tracking[member_id]:
-                    del voice_time_tracking[member_id]['join_time']
+                if 'join_time' in tracking[member_id]:
+                    del tracking[member_id]['join_time']
                 logging.info(f"User is alone in channel - marked as in voice but not tracked")
-        save_memory()
-    
-    # Handle case where someone joins/leaves and affects tracking for others
-    # CRITICAL: Check ALL members' status on every voice channel change
-    channels_to_update = set()
-    if before and before.channel:
-        channels_to_update.add(before.channel)
-    if after and after.channel:
-        channels_to_update.add(after.channel)
+        save_memory('join', guild_id, member_id)
     
-    # Update tracking for affected channels - this checks EVERY member in each channel
-    for channel in channels_to_update:
-        await update_tracking_for_specific_channel(channel)
-        # Log for verification that all members are being checked
-        member_count = len([m for m in channel.members if m.id not in get_ignored_users()])
-        logging.info(f"Voice channel update: Checked status for {member_count} members in channel '{channel.name}'")
+    # Handle case where someone joins/leaves and affects tracking for others:
+    # only members whose "should track" state flipped are touched
+    apply_tracking_changes(guild_id, candidates, current_time)
+
+def apply_tracking_changes(guild_id, candidates, current_time):
+    """Start or stop tracking for a guild's (member_id, channel_id) pairs returned by the occupancy index."""
+    tracking = guild_tracking(guild_id)
+    changes = []
+    for candidate_id, channel_id in candidates:
+        candidate_key = str(candidate_id)
+        time_data = tracking.get(candidate_key)
+        if time_data is None:
+            if channel_id is None:
+                continue
+            # Initialize user data if not exists
+            tracking[candidate_key] = {
+                'username': occupancy.names.get(candidate_id, 'Unknown'),
+                'total_time': 0,
+                'in_voice': True
+            }
+            time_data = tracking[candidate_key]
+            changes.append(('join', candidate_key))
+        
+        should_track = (
+            channel_id is not None
+            and channel_id not in config.afk_channel_ids
+            and occupancy.should_track(channel_id, candidate_id)
+        )
+        is_currently_tracking = 'join_time' in time_data
+        
+        if should_track and not is_currently_tracking:
+            # Should be tracking but isn't - start tracking
+            time_data['join_time'] = current_time
+            changes.append(('start', candidate_key))
+            logging.debug(f"Started tracking for {time_data['username']} (channel has {occupancy.trackable_count(channel_id)} trackable members)")
+        elif not should_track and is_currently_tracking:
+            # Shouldn't be tracking but is - stop tracking and save time
+            time_spent = current_time - time_data['join_time']
+            time_data['total_time'] += time_spent
+            voice_history.record(guild_id, candidate_key, time_data['join_time'], current_time)
+            del time_data['join_time']
+            changes.append(('stop', candidate_key))
+            logging.debug(f"Stopped tracking for {time_data['username']}")
     
-    # Also run the global update to catch any edge cases and ensure comprehensive coverage
-    await update_tracking_for_channel_changes()
+    for op, candidate_key in changes:
+        save_memory(op, guild_id, candidate_key)
 
+@handler_latency.time('update_tracking_for_specific_channel')
 async def update_tracking_for_specific_channel(channel):
     """
     COMPREHENSIVE STATUS CHECK: Update tracking status for ALL users in a specific voice channel.
-    This function checks EVERY SINGLE MEMBER in the channel and updates their status accordingly.
+    This function checks EVERY SINGLE MEMBER in the channel, refreshes the occupancy index
+    from the live roster and updates their status accordingly. Only used for reconciliation.
     """
     if not channel:
         return
         
-    current_time = datetime.now().timestamp()
-    members_checked = 0
-    members_updated = 0
-    
-    # Skip AFK channels - no tracking should occur in these channels
-    if channel.id in AFK_CHANNEL_IDS:
-        logging.info(f"Processing AFK channel '{channel.name}' - ensuring no tracking occurs")
-        # For users in AFK channels, ensure they're not being tracked
-        for member in channel.members:
-            if not member.bot and member.id not in get_ignored_users():
-                members_checked += 1
-                member_id = str(member.id)
-                # Initialize user data if not exists
-                if member_id not in voice_time_tracking:
-                    voice_time_tracking[member_id] = {
-                        'username': member.name,
-                        'total_time': 0,
-                        'in_voice': True
-                    }
-                    members_updated += 1
-                else:
-                    # Ensure they're marked as in voice but not tracked
-                    voice_time_tracking[member_id]['in_voice'] = True
-                    if 'join_time' in voice_time_tracking[member_id]:
-                        # Stop tracking if they were being tracked
-                        del voice_time_tracking[member_id]['join_time']
-                        members_updated += 1
-        logging.info(f"AFK channel check complete: {members_checked} members checked, {members_updated} members updated")
-        save_memory()
-        return
+    current_time = clock()
+    tracking = guild_tracking(channel.guild.id)
+    changes = []
     
-    # Count members excluding ignored users AND those who are both muted and deafened
-    non_ignored_members = [m for m in channel.members if m.id not in get_ignored_users() and not is_muted_and_deafened(m)]
-    logging.info(f"Checking ALL {len(non_ignored_members)} trackable members in channel '{channel.name}' for status updates")
+    members = [m for m in channel.members if m.id not in get_ignored_users()]
+    if channel.id in config.afk_channel_ids:
+        # Bots in AFK channels are not tracked at all
+        members = [m for m in members if not m.bot]
+    occupancy.reset_channel(
+        channel.guild.id, channel.id,
+        [(m.id, m.name, not is_muted_and_deafened(m)) for m in members]
+    )
     
-    # CRITICAL: Check EVERY SINGLE MEMBER in the channel (except ignored users)
-    for member in channel.members:
-        # Skip ignored users
-        if member.id in get_ignored_users():
-            continue
-            
-        members_checked += 1
+    for member in members:
         member_id = str(member.id)
         
         # Initialize user data if not exists
-        if member_id not in voice_time_tracking:
-            voice_time_tracking[member_id] = {
+        if member_id not in tracking:
+            tracking[member_id] = {
                 'username': member.name,
                 'total_time': 0,
                 'in_voice': True  # They're in voice since we're processing them
             }
-            members_updated += 1
-            logging.debug(f"Initialized new user data for {member.name}")
-        else:
+            changes.append(('join', member_id))
+        elif not tracking[member_id].get('in_voice', False):
             # Ensure they're marked as in voice
-            voice_time_tracking[member_id]['in_voice'] = True
-        
-        # Check if user is both muted AND deafened
-        user_muted_and_deafened = is_muted_and_deafened(member)
-        
-        # Determine if tracking should be active based on member count and mute/deafen status
-        should_track = len(non_ignored_members) >= 2 and not user_muted_and_deafened
-        is_currently_tracking = 'join_time' in voice_time_tracking[member_id]
-        
-        if should_track and not is_currently_tracking:
-            # Should be tracking but isn't - start tracking
-            voice_time_tracking[member_id]['join_time'] = current_time
-            members_updated += 1
-            logging.debug(f"Started tracking for {member.name} (channel has {len(non_ignored_members)} trackable members)")
-        elif not should_track and is_currently_tracking:
-            # Shouldn't be tracking but is - stop tracking and save time
-            time_spent = current_time - voice_time_tracking[member_id]['join_time']
-            voice_time_tracking[member_id]['total_time'] += time_spent
-            del voice_time_tracking[member_id]['join_time']
-            members_updated += 1
-            reason = "muted AND deafened" if user_muted_and_deafened else f"channel has {len(non_ignored_members)} trackable members"
-            logging.debug(f"Stopped tracking for {member.name} ({reason})")
+            tracking[member_id]['in_voice'] = True
+            changes.append(('join', member_id))
+    
+    for op, member_id in changes:
+        save_memory(op, channel.guild.id, member_id)
     
-    logging.info(f"Channel status check complete: {members_checked} members checked, {members_updated} members updated")
-    save_memory()
+    # Start/stop tracking for every member of the channel (AFK channels never track)
+    apply_tracking_changes(channel.guild.id, {(member.id, channel.id) for member in members}, current_time)
 
+@handler_latency.time('update_tracking_for_channel_changes')
 async def update_tracking_for_channel_changes():
-    """Update tracking status for all users based on current voice channel member counts, excluding AFK channels."""
-    current_time = datetime.now().timestamp()
+    """
+    Reconciliation pass: rebuild the occupancy index from every voice channel of every guild
+    and correct any tracking state that drifted. Voice events keep the index up to date
+    incrementally, so this only runs on startup, after config changes and every
+    VOICE_RECONCILE_MINUTES.
+    """
+    occupancy.clear()
     
     # Get all guilds the bot is in
     for guild in bot.guilds:
         # Check all voice channels in the guild
         for channel in guild.voice_channels:
-            # Skip AFK channels - no tracking should occur in these channels
-            if channel.id in AFK_CHANNEL_IDS:
-                # For users in AFK channels, ensure they're not being tracked
-                for member in channel.members:
-                    if member.id not in get_ignored_users():
-                        member_id = str(member.id)
-                        # Initialize user data if not exists
-                        if member_id not in voice_time_tracking:
-                            voice_time_tracking[member_id] = {
-                                'username': member.name,
-                                'total_time': 0,
-                                'in_voice': True
-                            }
-                        else:
-                            # Ensure they're marked as in voice but not tracked
-                            voice_time_tracking[member_id]['in_voice'] = True
-                            if 'join_time' in voice_time_tracking[member_id]:
-                                # Stop tracking if they were being tracked
-                                del voice_time_tracking[member_id]['join_time']
-                continue
-            
-            # Count members excluding ignored users AND those who are both muted and deafened
-            non_ignored_members = [m for m in channel.members if m.id not in get_ignored_users() and not is_muted_and_deafened(m)]
-            
-            # For each member in the channel
-            for member in channel.members:
-                if member.id in get_ignored_users():
-                    continue
-                    
-                member_id = str(member.id)
-                
-                # Initialize user data if not exists
-                if member_id not in voice_time_tracking:
-                    voice_time_tracking[member_id] = {
-                        'username': member.name,
-                        'total_time': 0,
-                        'in_voice': True  # They're in voice since we're processing them
-                    }
-                else:
-                    # Ensure they're marked as in voice
-                    voice_time_tracking[member_id]['in_voice'] = True
-                
-                # Check if user is both muted AND deafened
-                user_muted_and_deafened = is_muted_and_deafened(member)
-                
-                # Determine if tracking should be active based on member count and mute/deafen status
-                should_track = len(non_ignored_members) >= 2 and not user_muted_and_deafened
-                is_currently_tracking = 'join_time' in voice_time_tracking[member_id]
-                
-                if should_track and not is_currently_tracking:
-                    # Should be tracking but isn't - start tracking
-                    voice_time_tracking[member_id]['join_time'] = current_time
-                elif not should_track and is_currently_tracking:
-                    # Shouldn't be tracking but is - stop tracking and save time
-                    time_spent = current_time - voice_time_tracking[member_id]['join_time']
-                    voice_time_tracking[member_id]['total_time'] += time_spent
-                    del voice_time_tracking[member_id]['join_time']
-    
-    save_memory()
-
-async def check_and_respond(user_id, channel):
-    """Common function to check user status and respond if needed."""
-    member = channel.guild.get_member(user_id)
-    
-    # Check if we should watch this user based on watchlist configuration
-    should_watch = False
-    if WATCHLIST_CONFIG['watch_everyone']:
-        should_watch = True
-    elif member and member.id in WATCHLIST_CONFIG['watched_user_ids']:
-        should_watch = True
-    
-    if member and should_watch:
-        current_time = datetime.now()
-        last_time = last_message_time.get(member.id)
-        
-        if last_time is None or (current_time - last_time) > timedelta(days=1):
-            if member.status in [discord.Status.offline, discord.Status.invisible]:
-                message = WATCHLIST_CONFIG['offline_message'].format(user_id=member.id)
-                await channel.send(message)
-                last_message_time[member.id] = current_time
+            await update_tracking_for_specific_channel(channel)
 
-@bot.event
-async def on_message(message):
-    if message.author == bot.user:
+# One offline message per user per OFFLINE_ALERT_COOLDOWN_HOURS, kept in cooldowns.json across restarts
+offline_alert_cooldown = CooldownStore(
+    worker_path('cooldowns.json'),
+    ttl=float(os.getenv('OFFLINE_ALERT_COOLDOWN_HOURS', '24')) * 3600,
+    io=blocking_io
+)
+
+def is_watched(user_id):
+    return config.watch_everyone or user_id in config.watched_user_ids
+
+# Status of watched users, kept up to date by on_presence_update
+presence = PresenceIndex(is_watched)
+
+# Optional channel alerted as soon as a watched user who was just active goes offline (invisible)
+INVISIBLE_ALERT_CHANNEL_ID = int(os.getenv('INVISIBLE_ALERT_CHANNEL_ID', '0'))
+INVISIBLE_ALERT_ACTIVE_MINUTES = float(os.getenv('INVISIBLE_ALERT_ACTIVE_MINUTES', '10'))
+
+def seed_presence():
+    """Take the current status of listed watched users from the member cache (one lookup per user, no member scan)."""
+    presence.retain_watched()
+    for user_id in config.watched_user_ids:
+        if presence.status(user_id) is not None:
+            continue
+        for guild in bot.guilds:
+            member = guild.get_member(user_id)
+            if member is not None:
+                presence.update(user_id, member.status)
+                break
+
+config.listen('watchlist', seed_presence)
+
+async def send_offline_alert(user_id, channel):
+    # Start the cooldown before queueing, so a burst of events from the same user sends one message
+    await offline_alert_cooldown.mark(user_id)
+    if cluster and not await cluster.claim(f"offline:{user_id}", offline_alert_cooldown.ttl):
+        # Another worker (a guild on another shard) already sent this user's notice
         return
-    await check_and_respond(message.author.id, message.channel)
-    await bot.process_commands(message)
+    sent = outbox.send(channel, config.offline_message.format(user_id=user_id), coalesce=True)
+    
+    def clear_cooldown_if_failed(future):
+        if future.cancelled() or future.exception() is not None:
+            asyncio.get_running_loop().create_task(offline_alert_cooldown.clear(user_id))
+            if cluster:
+                asyncio.get_running_loop().create_task(cluster.release(f"offline:{user_id}"))
+    sent.add_done_callback(clear_cooldown_if_failed)
+
+@handler_latency.time('check_and_respond')
+async def check_and_respond(user_id, channel, member=None):
+    """Common function to check user status and respond if needed."""
+    # O(1) rejection first: most events come from users that are not watched
+    if not is_watched(user_id):
+        return
+    
+    if presence.status(user_id) is None:
+        # Not seen by on_presence_update yet - fall back to the member cache once
+        guild = getattr(channel, 'guild', None)
+        if member is None and guild is not None:
+            member = guild.get_member(user_id)
+        if member is None:
+            return
+        presence.update(user_id, member.status)
+    presence.touch(user_id)
+    
+    if presence.is_offline(user_id) and not offline_alert_cooldown.active(user_id):
+        await send_offline_alert(user_id, channel)
 
 @bot.event
-async def on_reaction_add(reaction, user):
-    if user.bot:
+async def on_presence_update(before, after):
+    """Keep the presence index of watched users up to date and alert when an active user goes invisible."""
+    if recorder and is_watched(after.id):
+        recorder.record('presence', u=after.id, s=str(after.status))
+    previous = presence.update(after.id, after.status)
+    if previous is None or not INVISIBLE_ALERT_CHANNEL_ID:
         return
-    await check_and_respond(user.id, reaction.message.channel)
+    if (presence.is_offline(after.id) and previous not in OFFLINE_STATUSES
+            and presence.active_within(after.id, INVISIBLE_ALERT_ACTIVE_MINUTES * 60)
+            and not offline_alert_cooldown.active(after.id)):
+        channel = bot.get_channel(INVISIBLE_ALERT_CHANNEL_ID)
+        if channel is not None:
+            await send_offline_alert(after.id, channel)
 
 @bot.event
-async def on_reaction_remove(reaction, user):
-    if user.bot:
+async def on_message(message):
+    if message.author == bot.user:
         return
-    await check_and_respond(user.id, reaction.message.channel)
+    if recorder:
+        recorder.record('message', g=message.guild.id if message.guild else None, c=message.channel.id, u=message.author.id)
+    member = message.author if isinstance(message.author, discord.Member) else None
+    await check_and_respond(message.author.id, message.channel, member)
+    await bot.process_commands(message)
 
+# Reactions are only handled through the raw events: they fire for every reaction, while
+# on_reaction_add/remove would fire a second time for reactions on cached messages
 @bot.event
 async def on_raw_reaction_add(payload):
     if bot.user and payload.user_id != bot.user.id:
+        if recorder:
+            recorder.record('reaction', g=payload.guild_id, c=payload.channel_id, u=payload.user_id, op='add')
         channel = bot.get_channel(payload.channel_id)
         if channel:
-            await check_and_respond(payload.user_id, channel)
+            await check_and_respond(payload.user_id, channel, payload.member)
 
 @bot.event
 async def on_raw_reaction_remove(payload):
     if bot.user and payload.user_id != bot.user.id:
+        if recorder:
+            recorder.record('reaction', g=payload.guild_id, c=payload.channel_id, u=payload.user_id, op='remove')
         channel = bot.get_channel(payload.channel_id)
         if channel:
             await check_and_respond(payload.user_id, channel)
@@ -692,13 +1092,36 @@ async def graceful_shutdown():
     
     logging.info("Graceful shutdown initiated...")
     
+    # Let a running backup or reset finish, so the state saved below includes it
+    if scheduler.is_running():
+        await scheduler.shutdown()
+        logging.info("Stopped scheduled jobs")
+    
     # Save current state
-    save_memory()
+    await flush_memory()
+    
+    # End a running profile capture so its files are still written
+    profiler.stop()
+    
+    if recorder:
+        recorder.close()
+    
+    if cluster:
+        await cluster.close()
+    
+    # Deliver queued messages while the connection is still up
+    try:
+        await asyncio.wait_for(outbox.flush(), 10)
+    except asyncio.TimeoutError:
+        logging.warning(f"Shutdown: {outbox.stats()['pending']} queued messages were not sent")
+    
+    await metrics_server.stop()
     
     # Stop periodic tasks
-    if periodic_update.is_running():
-        periodic_update.stop()
-        logging.info("Stopped periodic update task")
+    if reconcile_voice_tracking.is_running():
+        reconcile_voice_tracking.stop()
+    if watch_config_files.is_running():
+        watch_config_files.stop()
     
     # Close the bot connection
     if not bot.is_closed():
@@ -710,6 +1133,10 @@ async def graceful_shutdown():
 def signal_handler(signum, frame):
     """Handle shutdown signals."""
     logging.info(f"Received signal {signum}, initiating shutdown...")
+    # Write pending tracking changes before anything else; the process exits below
+    memory_store.flush()
+    voice_history.flush()
+    leaderboard_deltas.flush()
     # Create a new event loop if one doesn't exist
     try:
         loop = asyncio.get_event_loop()
@@ -726,6 +1153,9 @@ def signal_handler(signum, frame):
     # Force exit
     sys.exit(0)
 
+# Everything from here to on_ready is login and the gateway handshake
+startup_loaded = startup_phase('setup', phase_start)
+
 async def main():
     """Main function to run the bot with proper shutdown handling."""
     # Set up signal handlers for graceful shutdown
@@ -1,10 +1,9 @@
 import discord
 from discord.ext import commands
-import json
 import logging
 
-def setup_afkchannel(bot, reload_afk_channels_func):
-    # Use the reload function passed as parameter to avoid circular imports
+def setup_afkchannel(bot, config, outbox):
+    # The config store is passed as parameter to avoid circular imports
     
     @bot.group(name='afkchannel', invoke_without_command=True)
     async def afkchannel(ctx):
@@ -25,37 +24,16 @@ def setup_afkchannel(bot, reload_afk_channels_func):
                 await ctx.send(f"❌ Channel {channel.name} is not a voice channel.")
                 return
             
-            # Load current AFK channels list
-            try:
-                with open('afkchannels.json', 'r') as f:
-                    data = json.load(f)
-            except FileNotFoundError:
-                data = {'afk_channel_ids': []}
-            
-            # Check if channel is already in the list
-            if channel_id in data.get('afk_channel_ids', []):
+            # Add channel to the list and save it (the config store also rechecks voice tracking)
+            if not await config.add_afk_channel(channel_id):
                 await ctx.send(f"Voice channel **{channel.name}** is already in the AFK list.")
                 return
             
-            # Add channel to the list
-            if 'afk_channel_ids' not in data:
-                data['afk_channel_ids'] = []
-            data['afk_channel_ids'].append(channel_id)
-            
-            # Save updated AFK channels list
-            with open('afkchannels.json', 'w') as f:
-                json.dump(data, f, indent=2)
-            
             await ctx.send(f"✅ Added voice channel **{channel.name}** to the AFK list. Voice activity will not be tracked in this channel.")
             logging.info(f"Added channel {channel_id} ({channel.name}) to AFK list by {ctx.author}")
             
-            # Reload the AFK channels configuration
-            reload_afk_channels_func()
-            
         except ValueError:
             await ctx.send("❌ Invalid channel ID. Please provide a valid numeric channel ID.")
-        except json.JSONDecodeError:
-            await ctx.send("❌ Error reading AFK channels file. Please contact an administrator.")
         except Exception as e:
             await ctx.send(f"❌ An error occurred: {str(e)}")
             logging.error(f"Error adding channel to AFK list: {e}")
@@ -64,26 +42,11 @@ def setup_afkchannel(bot, reload_afk_channels_func):
     async def afkchannel_remove(ctx, channel_id: int):
         """Remove a voice channel from the AFK list."""
         try:
-            # Load current AFK channels list
-            try:
-                with open('afkchannels.json', 'r') as f:
-                    data = json.load(f)
-            except FileNotFoundError:
-                await ctx.send("❌ No AFK channels configured.")
-                return
-            
-            # Check if channel is in the list
-            if channel_id not in data.get('afk_channel_ids', []):
+            # Remove channel from the list and save it
+            if not await config.remove_afk_channel(channel_id):
                 await ctx.send(f"Channel ID {channel_id} is not in the AFK list.")
                 return
             
-            # Remove channel from the list
-            data['afk_channel_ids'].remove(channel_id)
-            
-            # Save updated AFK channels list
-            with open('afkchannels.json', 'w') as f:
-                json.dump(data, f, indent=2)
-            
             # Try to get channel name for display
             channel = ctx.guild.get_channel(channel_id)
             channel_name = channel.name if channel else f"Channel ID {channel_id}"
@@ -91,13 +54,8 @@ def setup_afkchannel(bot, reload_afk_channels_func):
             await ctx.send(f"✅ Removed voice channel **{channel_name}** from the AFK list. Voice activity tracking is now enabled.")
             logging.info(f"Removed channel {channel_id} from AFK list by {ctx.author}")
             
-            # Reload the AFK channels configuration
-            reload_afk_channels_func()
-            
         except ValueError:
             await ctx.send("❌ Invalid channel ID. Please provide a valid numeric channel ID.")
-        except json.JSONDecodeError:
-            await ctx.send("❌ Error reading AFK channels file. Please contact an administrator.")
         except Exception as e:
             await ctx.send(f"❌ An error occurred: {str(e)}")
             logging.error(f"Error removing channel from AFK list: {e}")
@@ -106,15 +64,8 @@ def setup_afkchannel(bot, reload_afk_channels_func):
     async def afkchannel_list(ctx):
         """List all voice channels in the AFK list."""
         try:
-            # Load current AFK channels list
-            try:
-                with open('afkchannels.json', 'r') as f:
-                    data = json.load(f)
-            except FileNotFoundError:
-                await ctx.send("📝 No AFK channels configured. All voice channels will track activity based on member count.")
-                return
-            
-            afk_channels = data.get('afk_channel_ids', [])
+            # Current AFK channels list, in file order
+            afk_channels = config.list_ids('afk', 'afk_channel_ids')
             
             if not afk_channels:
                 await ctx.send("📝 No AFK channels configured. All voice channels will track activity based on member count.")
@@ -130,10 +81,9 @@ def setup_afkchannel(bot, reload_afk_channels_func):
                     channel_list += f"🔇 Unknown Channel (ID: {channel_id})\n"
             
             channel_list += "\n*Voice activity is not tracked in these channels regardless of member count.*"
-            await ctx.send(channel_list)
+            # Long lists are split at Discord's message limit
+            outbox.send_lines(ctx.channel, channel_list.split('\n'))
             
-        except json.JSONDecodeError:
-            await ctx.send("❌ Error reading AFK channels file. Please contact an administrator.")
         except Exception as e:
             await ctx.send(f"❌ An error occurred: {str(e)}")
             logging.error(f"Error listing AFK channels: {e}")
@@ -1,69 +1,133 @@
 import discord
 from discord.ext import commands
-import os
+import asyncio
+import gzip
+import io
+import json
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 
-def setup_backup(bot):
+# Discord file limit for non-nitro users
+MAX_UPLOAD_BYTES = 8 * 1024 * 1024
+
+BACKUP_TIME_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M',
+                       '%Y-%m-%d-%H%M%S', '%Y-%m-%d-%H%M')
+
+def parse_backup_time(text):
+    """
+    Parse a backup timestamp: YYYY-MM-DD, YYYY-MM-DD HH:MM[:SS], YYYY-MM-DDTHH:MM[:SS]
+    or the filename form YYYY-MM-DD-HHMM[SS]. A bare date means the end of that day.
+    Returns a datetime or None.
+    """
+    text = text.strip()
+    for fmt in BACKUP_TIME_FORMATS:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            pass
+    try:
+        return datetime.strptime(text, '%Y-%m-%d') + timedelta(days=1, seconds=-1)
+    except ValueError:
+        return None
+
+def find_backup(backup_engine, guild_id, timestamp):
+    """Look up the newest backup at or before timestamp (the latest one when timestamp is None). Returns (point, error)."""
+    if timestamp is None:
+        point = backup_engine.latest(guild_id)
+        return point, None if point else "❌ No backups found for this server."
+    at = parse_backup_time(timestamp)
+    if at is None:
+        return None, "❌ Invalid timestamp. Use YYYY-MM-DD or YYYY-MM-DD HH:MM."
+    point = backup_engine.at_or_before(guild_id, at)
+    if point is None:
+        first = backup_engine.points(guild_id)[:1]
+        if first:
+            return None, f"❌ No backup at or before {at:%Y-%m-%d %H:%M}. The oldest backup is from {first[0].taken_at:%Y-%m-%d %H:%M}."
+        return None, "❌ No backups found for this server."
+    return point, None
+
+def encode_backup(state):
+    return json.dumps(state, indent=4).encode('utf-8')
+
+def setup_backup(bot, backup_engine, restore_guild, blocking_io):
     @bot.command(name='backup')
-    async def backup(ctx):
-        """Upload the latest backup file from the backup folder (Manage Server permission required)."""
+    async def backup(ctx, *, timestamp: str = None):
+        """Upload the server's data as of a backup (Manage Server permission required). Usage: !backup [YYYY-MM-DD [HH:MM]]"""
         # Check if the user has manage server permissions
         if not ctx.author.guild_permissions.manage_guild:
             await ctx.send("❌ This command requires 'Manage Server' permission.")
             return
-        
+
         try:
-            backup_folder = 'backup'
-            
-            # Check if backup folder exists
-            if not os.path.exists(backup_folder):
-                await ctx.send("❌ Backup folder not found.")
-                return
-            
-            # Get all backup files
-            backup_files = [f for f in os.listdir(backup_folder) if f.startswith('memory-') and f.endswith('.json')]
-            
-            if not backup_files:
-                await ctx.send("❌ No backup files found in the backup folder.")
+            # Catalog lookups wait for a running backup of the guild, so they stay off the event loop
+            point, error = await blocking_io.run('find backup', find_backup, backup_engine, ctx.guild.id, timestamp)
+            if error:
+                await ctx.send(error)
                 return
-            
-            # Sort files by name (which includes timestamp) to get the latest
-            backup_files.sort(reverse=True)
-            latest_backup = backup_files[0]
-            latest_backup_path = os.path.join(backup_folder, latest_backup)
-            
+
+            # Rebuild the snapshot from its base and deltas off the event loop
+            state = await blocking_io.run('restore backup', backup_engine.restore, ctx.guild.id, point.taken_at)
+            filename = f"memory-{point.taken_at:%Y-%m-%d-%H%M%S}.json"
+            payload = await blocking_io.run('encode backup', encode_backup, state)
+            if len(payload) > MAX_UPLOAD_BYTES:
+                payload = await blocking_io.run('compress backup', gzip.compress, payload)
+                filename += '.gz'
+
             # Check file size (Discord has a file size limit)
-            file_size = os.path.getsize(latest_backup_path)
-            if file_size > 8 * 1024 * 1024:  # 8MB limit for non-nitro users
-                await ctx.send(f"❌ Backup file is too large ({file_size / 1024 / 1024:.1f}MB). Discord file limit is 8MB.")
+            if len(payload) > MAX_UPLOAD_BYTES:
+                await ctx.send(f"❌ Backup file is too large ({len(payload) / 1024 / 1024:.1f}MB). Discord file limit is 8MB.")
                 return
-            
-            # Extract timestamp from filename for display
-            timestamp_part = latest_backup.replace('memory-', '').replace('.json', '')
-            try:
-                # Parse the timestamp (format: YYYY-MM-DD-HHMM)
-                date_part, time_part = timestamp_part.split('-')[0:3], timestamp_part.split('-')[3]
-                formatted_date = f"{date_part[0]}-{date_part[1]}-{date_part[2]}"
-                formatted_time = f"{time_part[:2]}:{time_part[2:]}"
-                display_timestamp = f"{formatted_date} {formatted_time}"
-            except:
-                display_timestamp = timestamp_part
-            
-            # Create Discord file object and send it
-            with open(latest_backup_path, 'rb') as f:
-                discord_file = discord.File(f, filename=latest_backup)
-            
-            await ctx.send(file=discord_file)
-            
-            logging.info(f"User {ctx.author} downloaded backup file: {latest_backup}")
-            
+
+            message = f"📦 Backup from {point.taken_at:%Y-%m-%d %H:%M:%S} ({len(state)} users)"
+            day_start = point.taken_at.replace(hour=0, minute=0, second=0)
+            same_day = await blocking_io.run('list backups', backup_engine.in_range, ctx.guild.id, day_start, day_start + timedelta(days=1))
+            if len(same_day) > 1:
+                message += f"\nBackups on {day_start:%Y-%m-%d}: " + ', '.join(f"{p.taken_at:%H:%M:%S}" for p in same_day)
+
+            await ctx.send(message, file=discord.File(io.BytesIO(payload), filename=filename))
+
+            logging.info(f"User {ctx.author} downloaded backup {filename} of guild {ctx.guild.id}")
+
         except FileNotFoundError:
             await ctx.send("❌ Backup file not found or has been moved.")
+        except asyncio.TimeoutError:
+            await ctx.send("❌ Reading the backup took too long, try again later.")
         except PermissionError:
             await ctx.send("❌ Permission denied accessing backup file.")
         except Exception as e:
             await ctx.send(f"❌ An error occurred: {str(e)}")
             logging.error(f"Error in backup command: {e}")
-    
-    return backup
\ No newline at end of file
+
+    @bot.command(name='restore')
+    async def restore(ctx, *, timestamp: str = None):
+        """Load the server's data as of a backup into the bot (Manage Server permission required). Usage: !restore <YYYY-MM-DD [HH:MM]>"""
+        if not ctx.author.guild_permissions.manage_guild:
+            await ctx.send("❌ This command requires 'Manage Server' permission.")
+            return
+        if timestamp is None:
+            await ctx.send("❌ Usage: !restore <YYYY-MM-DD [HH:MM]>")
+            return
+
+        try:
+            point, error = await blocking_io.run('find backup', find_backup, backup_engine, ctx.guild.id, timestamp)
+            if error:
+                await ctx.send(error)
+                return
+
+            restored_count, undo_point = await restore_guild(ctx.guild, point)
+            message = f"✅ Restored {restored_count} users from the backup of {point.taken_at:%Y-%m-%d %H:%M:%S}."
+            if undo_point is not None:
+                message += f"\nThe previous data was backed up first - undo with `!restore {undo_point.taken_at:%Y-%m-%d %H:%M:%S}`"
+            await ctx.send(message)
+
+            logging.info(f"User {ctx.author} restored guild {ctx.guild.id} from the backup of {point.taken_at}")
+
+        except FileNotFoundError:
+            await ctx.send("❌ Backup file not found or has been moved.")
+        except asyncio.TimeoutError:
+            await ctx.send("❌ Reading the backup took too long, nothing was restored.")
+        except Exception as e:
+            await ctx.send(f"❌ An error occurred: {str(e)}")
+            logging.error(f"Error in restore command: {e}")
+
+    return backup, restore
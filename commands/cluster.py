@@ -0,0 +1,32 @@
+import discord
+from discord.ext import commands
+import logging
+
+def format_uptime(seconds):
+    hours, remainder = divmod(int(seconds), 3600)
+    return f"{hours}h {remainder // 60}m"
+
+def setup_cluster(bot, cluster):
+    @bot.command(name='cluster')
+    async def cluster_status(ctx):
+        """Show the workers of a clustered deployment, their shards and what they track."""
+        status = await cluster.status()
+        if status is None:
+            await ctx.send("❌ The cluster coordinator is not reachable")
+            return
+
+        lines = [f"🖧 **Cluster: {len(status['workers'])} workers, {status['shard_count']} shards** (this is worker {cluster.worker})", "```"]
+        for worker in status['workers']:
+            stats = worker['stats']
+            state = 'up' if worker['running'] and worker['connected'] else ('starting' if worker['running'] else 'down')
+            latency = f"{stats['latency_ms']:.0f}ms" if stats.get('latency_ms') is not None else '-'
+            lines.append(
+                f"#{worker['worker']} shards {','.join(map(str, worker['shards']))}: {state}, "
+                f"{stats.get('guilds', '-')} guilds, {stats.get('tracked_users', '-')} users, "
+                f"latency {latency}, up {format_uptime(worker['uptime'])}, {worker['restarts']} restarts"
+            )
+        lines.append("```")
+        await ctx.send('\n'.join(lines))
+        logging.info(f"Cluster status requested by {ctx.author}")
+
+    return cluster_status
@@ -1,10 +1,9 @@
 import discord
 from discord.ext import commands
-import json
 import logging
 
-def setup_ignore(bot, reload_ignored_users_func):
-    # Use the reload function passed as parameter to avoid circular imports
+def setup_ignore(bot, config, outbox):
+    # The config store is passed as parameter to avoid circular imports
     
     @bot.group(name='ignore', invoke_without_command=True)
     async def ignore(ctx):
@@ -15,38 +14,18 @@ def setup_ignore(bot, reload_ignored_users_func):
     async def ignore_add(ctx, user_id: int):
         """Add a user to the ignore list."""
         try:
-            # Load current ignore list
-            with open('ignore.json', 'r') as f:
-                data = json.load(f)
-            
-            # Check if user is already in the list
-            if user_id in data.get('ignored_user_ids', []):
+            # Add user to the list and save it (the config store also cleans up voice_time_tracking)
+            if not await config.add_ignored(user_id):
                 await ctx.send(f"User ID {user_id} is already in the ignore list.")
                 return
             
-            # Add user to the list
-            if 'ignored_user_ids' not in data:
-                data['ignored_user_ids'] = []
-            data['ignored_user_ids'].append(user_id)
-            
-            # Save updated ignore list
-            with open('ignore.json', 'w') as f:
-                json.dump(data, f, indent=2)
-            
             # Try to get user's display name
             user = ctx.guild.get_member(user_id)
             user_name = user.display_name if user else f"User ID {user_id}"
             
-            # Reload the ignore configuration (this will also clean up voice_time_tracking)
-            reload_ignored_users_func()
-            
             await ctx.send(f"✅ Added {user_name} to the ignore list. They will be excluded from the leaderboard and their tracking data has been removed.")
             logging.info(f"Added user {user_id} to ignore list by {ctx.author}")
             
-        except FileNotFoundError:
-            await ctx.send("❌ Ignore file not found. Please contact an administrator.")
-        except json.JSONDecodeError:
-            await ctx.send("❌ Error reading ignore file. Please contact an administrator.")
         except Exception as e:
             await ctx.send(f"❌ An error occurred: {str(e)}")
             logging.error(f"Error adding user to ignore list: {e}")
@@ -55,22 +34,11 @@ def setup_ignore(bot, reload_ignored_users_func):
     async def ignore_remove(ctx, user_id: int):
         """Remove a user from the ignore list."""
         try:
-            # Load current ignore list
-            with open('ignore.json', 'r') as f:
-                data = json.load(f)
-            
-            # Check if user is in the list
-            if user_id not in data.get('ignored_user_ids', []):
+            # Remove user from the list and save it
+            if not await config.remove_ignored(user_id):
                 await ctx.send(f"User ID {user_id} is not in the ignore list.")
                 return
             
-            # Remove user from the list
-            data['ignored_user_ids'].remove(user_id)
-            
-            # Save updated ignore list
-            with open('ignore.json', 'w') as f:
-                json.dump(data, f, indent=2)
-            
             # Try to get user's display name
             user = ctx.guild.get_member(user_id)
             user_name = user.display_name if user else f"User ID {user_id}"
@@ -78,13 +46,6 @@ def setup_ignore(bot, reload_ignored_users_func):
             await ctx.send(f"✅ Removed {user_name} from the ignore list. They will now appear in the leaderboard.")
             logging.info(f"Removed user {user_id} from ignore list by {ctx.author}")
             
-            # Reload the ignore configuration
-            reload_ignored_users_func()
-            
-        except FileNotFoundError:
-            await ctx.send("❌ Ignore file not found. Please contact an administrator.")
-        except json.JSONDecodeError:
-            await ctx.send("❌ Error reading ignore file. Please contact an administrator.")
         except Exception as e:
             await ctx.send(f"❌ An error occurred: {str(e)}")
             logging.error(f"Error removing user from ignore list: {e}")
@@ -93,11 +54,8 @@ def setup_ignore(bot, reload_ignored_users_func):
     async def ignore_list(ctx):
         """List all users in the ignore list."""
         try:
-            # Load current ignore list
-            with open('ignore.json', 'r') as f:
-                data = json.load(f)
-            
-            ignored_users = data.get('ignored_user_ids', [])
+            # Current ignore list, in file order
+            ignored_users = config.list_ids('ignore', 'ignored_user_ids')
             
             if not ignored_users:
                 await ctx.send("📝 The ignore list is currently empty. All users will appear in the leaderboard.")
@@ -113,12 +71,9 @@ def setup_ignore(bot, reload_ignored_users_func):
                     user_list += f"• Unknown User (ID: {user_id})\n"
             
             user_list += "\n*These users are excluded from the voice chat leaderboard.*"
-            await ctx.send(user_list)
+            # Long lists are split at Discord's message limit
+            outbox.send_lines(ctx.channel, user_list.split('\n'))
             
-        except FileNotFoundError:
-            await ctx.send("❌ Ignore file not found. Please contact an administrator.")
-        except json.JSONDecodeError:
-            await ctx.send("❌ Error reading ignore file. Please contact an administrator.")
         except Exception as e:
             await ctx.send(f"❌ An error occurred: {str(e)}")
             logging.error(f"Error listing ignore list: {e}")
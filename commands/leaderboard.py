@@ -1,64 +1,160 @@
 import discord
 from discord.ext import commands
 from datetime import datetime
+import logging
+import re
 
-def setup_leaderboard(bot, voice_time_tracking, get_ignored_users_func, update_voice_times):
-    @bot.command(name='leaderboard')
-    async def leaderboard(ctx):
-        """Display the voice chat time leaderboard."""
-        # Get current ignored users list
-        current_ignored_users = get_ignored_users_func()
-        
-        import logging
-        logging.info(f"Leaderboard: Ignored users list: {current_ignored_users}")
-        logging.info(f"Leaderboard: Total users in tracking: {len(voice_time_tracking)}")
-        
+# Entries per leaderboard page; keeps an embed far below Discord's size limits
+PAGE_SIZE = 15
+
+def display_state(time_data, current_time):
+    """What a leaderboard line shows for a user: (status, hours, minutes)."""
+    # Calculate total time including current session if user is in voice
+    total_seconds = time_data['total_time']
+    if time_data.get('in_voice', False) and 'join_time' in time_data:
+        current_session = current_time - time_data['join_time']
+        total_seconds += current_session
+
+    hours = int(total_seconds // 3600)
+    minutes = int((total_seconds % 3600) // 60)
+    # Show different status based on tracking state
+    if time_data.get('in_voice', False):
+        if 'join_time' in time_data:
+            status = "🔊"  # In voice and being tracked (with others)
+        else:
+            status = "🔇"  # In voice but not tracked (alone)
+    else:
+        status = "💤"  # Not in voice
+    return status, hours, minutes
+
+def format_delta(delta):
+    """Format the change since the user was last shown, e.g. ' (+1h 12m, ▲3)'."""
+    if delta is None:
+        return ""
+    gained, climbed = delta
+    if gained is None:
+        return " 🆕"
+    parts = []
+    if gained >= 60:
+        parts.append(f"+{int(gained // 3600)}h {int((gained % 3600) // 60)}m")
+    if climbed > 0:
+        parts.append(f"▲{climbed}")
+    elif climbed < 0:
+        parts.append(f"▼{-climbed}")
+    return f" ({', '.join(parts)})" if parts else ""
+
+def format_entry(rank, time_data, current_time, delta=None):
+    """Format one leaderboard line: rank, tracking status, username, total time and change since last shown."""
+    status, hours, minutes = display_state(time_data, current_time)
+    user = time_data['username']
+    return f"{rank}. {status} **{user}** - {hours}h {minutes}m{format_delta(delta)}"
+
+def page_signature(entries, total_users, current_time):
+    """Everything a rendered page displays, at minute resolution; a cached page is reused while this is unchanged."""
+    return total_users, tuple(
+        (user_id, time_data['username']) + display_state(time_data, current_time)
+        for user_id, time_data in entries
+    )
+
+def setup_leaderboard(bot, get_guild_tracking, get_ignored_users_func, update_voice_times, ranking, render_cache, deltas):
+    def render_page(guild_id, page, page_count, total_users):
+        """Accrue running sessions and build the embed for one page. Returns (signature, embed)."""
+        # Update times for all active users of this server before displaying
+        update_voice_times(guild_id)
         current_time = datetime.now().timestamp()
-        
-        # Update times for all active users before displaying
-        update_voice_times()
-        
-        # Filter out ignored users and sort by total time (highest to lowest)
-        sorted_users = sorted(
-            [(user_id, time_data) for user_id, time_data in voice_time_tracking.items() 
-             if int(user_id) not in current_ignored_users],
-            key=lambda x: x[1]['total_time'],
-            reverse=True
+        offset = (page - 1) * PAGE_SIZE
+
+        # Only the displayed page is read from the index
+        entries = ranking.top(guild_id, offset, PAGE_SIZE)
+        # Compare the displayed users with their values from the last post (cache.json)
+        changes = deltas.compare(guild_id, [
+            (rank, user_id, time_data['total_time'])
+            for rank, (user_id, time_data) in enumerate(entries, offset + 1)
+        ])
+        lines = [
+            format_entry(rank, time_data, current_time, changes.get(user_id))
+            for rank, (user_id, time_data) in enumerate(entries, offset + 1)
+        ]
+
+        embed = discord.Embed(
+            title="Voice Chat Time Leaderboard",
+            description='\n'.join(lines),
+            color=discord.Color.blurple()
         )
-        
-        filtered_count = len(voice_time_tracking) - len(sorted_users)
-        logging.info(f"Leaderboard: Filtered out {filtered_count} users, showing {len(sorted_users)} users")
-        
-        # Log which users are being shown
-        logging.info(f"Leaderboard users: {[(uid, data.get('username')) for uid, data in sorted_users[:10]]}")
-        
-        # Create simple text leaderboard
-        leaderboard_text = "**Voice Chat Time Leaderboard**\n\n"
-        
-        # Add user entries to text
-        for rank, (user_id, time_data) in enumerate(sorted_users, 1):
-            # Calculate total time including current session if user is in voice
-            total_seconds = time_data['total_time']
-            if time_data.get('in_voice', False) and 'join_time' in time_data:
-                current_session = current_time - time_data['join_time']
-                total_seconds += current_session
-            
-            hours = int(total_seconds // 3600)
-            minutes = int((total_seconds % 3600) // 60)
-            # Show different status based on tracking state
-            if time_data.get('in_voice', False):
-                if 'join_time' in time_data:
-                    status = "🔊"  # In voice and being tracked (with others)
-                else:
-                    status = "🔇"  # In voice but not tracked (alone)
+        embed.set_footer(text=f"Page {page}/{page_count} • {total_users} users • !leaderboard <page>")
+        logging.info(f"Leaderboard: rendered page {page}/{page_count} of {total_users} users")
+        return page_signature(entries, total_users, current_time), embed
+
+    @bot.command(name='leaderboard')
+    async def leaderboard(ctx, page: int = 1):
+        """Display the voice chat time leaderboard of this server. Usage: !leaderboard [page]"""
+        guild_id = ctx.guild.id
+
+        # Ignored users are purged from tracking, so the ranking index never contains them
+        total_users = ranking.count(guild_id)
+        if total_users == 0:
+            await ctx.send("📝 No voice chat time tracked yet")
+            return
+
+        page_count = (total_users + PAGE_SIZE - 1) // PAGE_SIZE
+        page = min(max(page, 1), page_count)
+        cache_key = (guild_id, page)
+
+        # Repeated requests in the same channel get the cached copy without any work
+        embed = render_cache.throttled_copy(ctx.channel.id, cache_key)
+        if embed is None:
+            current_time = datetime.now().timestamp()
+            entries = ranking.top(guild_id, (page - 1) * PAGE_SIZE, PAGE_SIZE)
+            embed = render_cache.get(cache_key, page_signature(entries, total_users, current_time))
+        if embed is None:
+            signature, embed = render_page(guild_id, page, page_count, total_users)
+            render_cache.put(cache_key, signature, embed)
+
+        await ctx.send(embed=embed)
+        render_cache.mark_sent(ctx.channel.id, cache_key)
+
+    @bot.command(name='rank')
+    async def rank(ctx, *, user_identifier: str = None):
+        """Show a user's leaderboard rank. Usage: !rank [USER_ID/USERNAME/@mention]"""
+        voice_time_tracking = get_guild_tracking(ctx.guild.id)
+
+        if user_identifier is None:
+            user_id = str(ctx.author.id)
+        else:
+            mention_match = re.fullmatch(r'<@!?(\d+)>', user_identifier)
+            if mention_match:
+                user_id = mention_match.group(1)
+            elif user_identifier.isdigit():
+                user_id = user_identifier
             else:
-                status = "💤"  # Not in voice
-            user = time_data['username']
-            
-            # Add user line to leaderboard
-            time_text = f"{hours}h {minutes}m"
-            leaderboard_text += f"{rank}. {status} **{user}** - {time_text}\n"
-        
-        await ctx.send(leaderboard_text)
-    
-    return leaderboard
+                identifier_lower = user_identifier.lower()
+                matches = [
+                    uid for uid, data in voice_time_tracking.items()
+                    if data.get('username', '').lower() == identifier_lower
+                ]
+                if len(matches) != 1:
+                    await ctx.send(f"❌ No unique user found matching '{user_identifier}'. Try using their user ID instead.")
+                    return
+                user_id = matches[0]
+
+        if int(user_id) in get_ignored_users_func():
+            await ctx.send("❌ This user is ignored and not on the leaderboard.")
+            return
+
+        update_voice_times(ctx.guild.id)
+        position = ranking.rank(ctx.guild.id, user_id)
+        if position is None:
+            await ctx.send("❌ This user has no tracked voice chat time.")
+            return
+
+        current_time = datetime.now().timestamp()
+        rank_text = format_entry(position, voice_time_tracking[user_id], current_time)
+        rank_text += f"\nRank **{position}** of {ranking.count(ctx.guild.id)}"
+        if position > 1:
+            _above_id, above = ranking.top(ctx.guild.id, position - 2, 1)[0]
+            gap = above['total_time'] - voice_time_tracking[user_id]['total_time']
+            rank_text += f" • {int(gap // 3600)}h {int((gap % 3600) // 60)}m behind #{position - 1}"
+
+        await ctx.send(rank_text)
+
+    return leaderboard, rank
@@ -1,24 +1,22 @@
 import discord
 from discord.ext import commands
-import json
 import logging
 
-def setup_listid(bot):
+def setup_listid(bot, get_guild_tracking, outbox):
     @bot.command(name='listid')
     async def listid(ctx):
-        """List all user IDs and usernames from memory.json (Manage Server permission required)."""
+        """List all tracked user IDs and usernames (Manage Server permission required)."""
         # Check if the user has manage server permissions
         if not ctx.author.guild_permissions.manage_guild:
             await ctx.send("❌ This command requires 'Manage Server' permission.")
             return
         
         try:
-            # Load memory.json
-            with open('memory.json', 'r') as f:
-                memory_data = json.load(f)
+            # Use this server's live tracking data instead of re-reading it from disk
+            memory_data = get_guild_tracking(ctx.guild.id)
             
             if not memory_data:
-                await ctx.send("📝 No user data found in memory.json")
+                await ctx.send("📝 No user data found in memory")
                 return
             
             # Build the user list
@@ -38,30 +36,11 @@ def setup_listid(bot):
                 
                 user_list += f"{status} **{username}** - ID: `{user_id}` ({hours:.1f}h)\n"
             
-            # Split message if too long (Discord has a 2000 character limit)
-            if len(user_list) > 1900:
-                # Send in chunks
-                lines = user_list.split('\n')
-                current_chunk = lines[0] + '\n'  # Start with header
-                
-                for line in lines[1:]:
-                    if len(current_chunk + line + '\n') > 1900:
-                        await ctx.send(current_chunk)
-                        current_chunk = line + '\n'
-                    else:
-                        current_chunk += line + '\n'
-                
-                if current_chunk.strip():
-                    await ctx.send(current_chunk)
-            else:
-                await ctx.send(user_list)
+            # Packed into as few messages as Discord's 2000 character limit allows and sent in the background
+            outbox.send_lines(ctx.channel, user_list.rstrip('\n').split('\n'))
             
             logging.info(f"User {ctx.author} with manage server permissions requested user ID list")
             
-        except FileNotFoundError:
-            await ctx.send("❌ Memory file not found. No user data available.")
-        except json.JSONDecodeError:
-            await ctx.send("❌ Error reading memory file. Data may be corrupted.")
         except Exception as e:
             await ctx.send(f"❌ An error occurred: {str(e)}")
             logging.error(f"Error in listid command: {e}")
@@ -0,0 +1,68 @@
+import discord
+from discord.ext import commands
+import asyncio
+import logging
+import os
+
+# Longest capture allowed, in seconds
+MAX_PROFILE_SECONDS = 600
+
+# Discord file limit for non-nitro users
+MAX_UPLOAD_BYTES = 8 * 1024 * 1024
+
+def setup_profile(bot, profiler):
+    async def post_report(ctx, task):
+        try:
+            report = await task
+        except Exception as e:
+            await ctx.send(f"❌ Profiling failed: {str(e)}")
+            logging.error(f"Profiling failed: {e}")
+            return
+
+        # Keep the summary inside one message including the code block
+        summary = report.summary if len(report.summary) <= 1800 else report.summary[:1800] + '\n...'
+        files = [discord.File(path) for path in (report.collapsed_path, report.pstats_path)
+                 if os.path.getsize(path) <= MAX_UPLOAD_BYTES]
+        await ctx.send(
+            f"📈 Profile of {report.duration:.0f}s ({report.samples} stack samples), "
+            f"saved to `{report.pstats_path}` and `{report.collapsed_path}`:\n```\n{summary}\n```",
+            files=files
+        )
+
+    @bot.group(name='profile', invoke_without_command=True)
+    async def profile(ctx):
+        """Profile the bot's event loop. Only allowed for specific administrator."""
+        status = "running" if profiler.is_running() else "not running"
+        await ctx.send(f"Profiler is {status}. Usage: `!profile start [seconds]` or `!profile stop`")
+
+    @profile.command(name='start')
+    async def profile_start(ctx, seconds: int = 60):
+        """Profile event handlers and commands for a number of seconds (default 60)."""
+        if ctx.author.id != 220301180562046977:  # Check for specific admin ID
+            await ctx.send("You don't have permission to use this command.")
+            return
+        if not 1 <= seconds <= MAX_PROFILE_SECONDS:
+            await ctx.send(f"❌ Seconds must be between 1 and {MAX_PROFILE_SECONDS}.")
+            return
+        if profiler.is_running():
+            await ctx.send("❌ A profile is already running. Use `!profile stop` to end it.")
+            return
+
+        task = profiler.start(seconds)
+        # Report from a separate task so this command does not stay open for the whole capture
+        asyncio.get_running_loop().create_task(post_report(ctx, task))
+        await ctx.send(f"⏱️ Profiling for {seconds}s...")
+        logging.info(f"Profiling for {seconds}s started by {ctx.author}")
+
+    @profile.command(name='stop')
+    async def profile_stop(ctx):
+        """End the running profile early and post its results."""
+        if ctx.author.id != 220301180562046977:  # Check for specific admin ID
+            await ctx.send("You don't have permission to use this command.")
+            return
+        if not profiler.is_running():
+            await ctx.send("No profile is running.")
+            return
+        profiler.stop()
+
+    return profile
@@ -4,7 +4,7 @@ import subprocess
 import logging
 from discord.ext import commands
 
-def setup_restart(bot, save_memory, periodic_update, update_voice_times):
+def setup_restart(bot, flush_memory, scheduler, update_voice_times, cluster=None):
     @bot.command(name='restart')
     async def restart(ctx):
         """Restart the bot. Only allowed for specific administrator."""
@@ -14,10 +14,13 @@ def setup_restart(bot, save_memory, periodic_update, update_voice_times):
             
         await ctx.send("Restarting bot...")
         logging.info("Restart command received. Restarting bot...")
-        save_memory()
-        periodic_update.stop()
+        await scheduler.shutdown()  # Lets a running backup or reset finish
         update_voice_times()  # Update all active voice times before saving
-        save_memory()
+        await flush_memory()
+        
+        # Clustered: the coordinator restarts every worker, this one included
+        if cluster and await cluster.request_restart():
+            return
         
         script_path = os.path.abspath(sys.argv[0])
         subprocess.Popen([sys.executable, script_path])
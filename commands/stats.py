@@ -0,0 +1,167 @@
+import discord
+from discord.ext import commands
+from datetime import datetime, timedelta
+import logging
+import re
+import time
+
+DEFAULT_RANGE = '7d'
+
+def parse_range(range_str, now=None):
+    """
+    Parse a time range and return (start, end, label) as datetimes, or None if it is not a range.
+    Accepts: 24h, 7d, 4w (ending now), today, yesterday, month, year,
+    YYYY-MM, YYYY-MM-DD and YYYY-MM-DD..YYYY-MM-DD (inclusive).
+    """
+    now = now or datetime.now()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    range_str = range_str.strip().lower()
+
+    relative_match = re.fullmatch(r'(\d+)([hdw])', range_str)
+    if relative_match:
+        amount = int(relative_match.group(1))
+        unit = {'h': 'hours', 'd': 'days', 'w': 'weeks'}[relative_match.group(2)]
+        return now - timedelta(**{unit: amount}), now, f"last {range_str}"
+    if range_str == 'today':
+        return today, now, 'today'
+    if range_str == 'yesterday':
+        return today - timedelta(days=1), today, 'yesterday'
+    if range_str == 'month':
+        return today.replace(day=1), now, 'this month'
+    if range_str == 'year':
+        return today.replace(month=1, day=1), now, 'this year'
+
+    try:
+        if '..' in range_str:
+            first, last = range_str.split('..', 1)
+            start = datetime.strptime(first, '%Y-%m-%d')
+            end = datetime.strptime(last, '%Y-%m-%d') + timedelta(days=1)
+            return start, end, f"{first} to {last}"
+        if re.fullmatch(r'\d{4}-\d{2}', range_str):
+            start = datetime.strptime(range_str, '%Y-%m')
+            end = (start + timedelta(days=32)).replace(day=1)
+            return start, end, range_str
+        if re.fullmatch(r'\d{4}-\d{2}-\d{2}', range_str):
+            start = datetime.strptime(range_str, '%Y-%m-%d')
+            return start, start + timedelta(days=1), range_str
+    except ValueError:
+        return None
+    return None
+
+def format_duration(seconds):
+    hours = int(seconds // 3600)
+    minutes = int((seconds % 3600) // 60)
+    return f"{hours}h {minutes}m"
+
+def setup_stats(bot, get_guild_tracking, get_ignored_users_func, update_voice_times, voice_history):
+    def resolve_user(voice_time_tracking, identifier):
+        """
+        Resolve a mention, user ID or username to a user ID.
+        Returns: (user_id, error_message) tuple. error_message is None on success.
+        """
+        mention_match = re.fullmatch(r'<@!?(\d+)>', identifier)
+        if mention_match:
+            return mention_match.group(1), None
+        if identifier.isdigit():
+            return identifier, None
+
+        identifier_lower = identifier.lower()
+        matches = [
+            (user_id, data.get('username', ''))
+            for user_id, data in voice_time_tracking.items()
+            if data.get('username', '').lower().startswith(identifier_lower)
+        ]
+        exact = [match for match in matches if match[1].lower() == identifier_lower]
+        if len(exact) == 1:
+            return exact[0][0], None
+        if len(matches) == 0:
+            return None, f"❌ No user found matching '{identifier}'. Try using their user ID instead."
+        if len(matches) == 1:
+            return matches[0][0], None
+        match_list = '\n'.join([f"• {name} (ID: {uid})" for uid, name in matches[:10]])
+        return None, f"❌ Multiple users match '{identifier}':\n{match_list}\nPlease use the user ID instead."
+
+    @bot.command(name='stats')
+    async def stats(ctx, *args):
+        """
+        Show a user's voice chat time over a range from the hourly history.
+        Usage: !stats [USER_ID/USERNAME/@mention] [range]
+        Ranges: 24h, 7d, 4w, today, yesterday, month, year, 2025-01, 2025-01-15, 2025-01-01..2025-01-31
+        """
+        voice_time_tracking = get_guild_tracking(ctx.guild.id)
+        args = list(args)
+
+        # The range is the last argument when it parses as one
+        parsed = parse_range(args[-1]) if args else None
+        if parsed:
+            args.pop()
+        elif len(args) > 1:
+            await ctx.send(f"❌ Invalid range '{args[-1]}'. Use e.g. `7d`, `month`, `2025-01` or `2025-01-01..2025-01-31`")
+            return
+        else:
+            parsed = parse_range(DEFAULT_RANGE)
+        start, end, label = parsed
+
+        if args:
+            user_id, error = resolve_user(voice_time_tracking, ' '.join(args))
+            if error:
+                await ctx.send(error)
+                return
+        else:
+            user_id = str(ctx.author.id)
+
+        # Bring running sessions into the history before querying
+        update_voice_times(ctx.guild.id)
+
+        query_start = time.perf_counter()
+        daily = voice_history.user_daily(ctx.guild.id, user_id, start.timestamp(), end.timestamp())
+        query_ms = (time.perf_counter() - query_start) * 1000
+
+        total_seconds = sum(seconds for _day, seconds in daily)
+        days_in_range = max((end - start).total_seconds() / 86400, 1)
+        username = voice_time_tracking.get(user_id, {}).get('username', f'User_{user_id}')
+
+        stats_text = f"**Voice Chat Time for {username}** ({label})\n\n"
+        stats_text += f"Total: **{format_duration(total_seconds)}**\n"
+        stats_text += f"Active days: {len(daily)}\n"
+        stats_text += f"Daily average: {format_duration(total_seconds / days_in_range)}\n"
+
+        await ctx.send(stats_text)
+        logging.info(f"Stats for {user_id} over {label} answered in {query_ms:.2f}ms")
+
+    @bot.command(name='top')
+    async def top(ctx, range_str: str = DEFAULT_RANGE):
+        """
+        Show the users with the most voice chat time over a range from the hourly history.
+        Usage: !top [range]  (same ranges as !stats, default 7d)
+        """
+        parsed = parse_range(range_str)
+        if not parsed:
+            await ctx.send(f"❌ Invalid range '{range_str}'. Use e.g. `7d`, `month`, `2025-01` or `2025-01-01..2025-01-31`")
+            return
+        start, end, label = parsed
+        voice_time_tracking = get_guild_tracking(ctx.guild.id)
+
+        # Bring running sessions into the history before querying
+        update_voice_times(ctx.guild.id)
+
+        query_start = time.perf_counter()
+        ranked = voice_history.top(
+            ctx.guild.id, start.timestamp(), end.timestamp(), limit=10,
+            exclude_ids=get_ignored_users_func()
+        )
+        query_ms = (time.perf_counter() - query_start) * 1000
+
+        if not ranked:
+            await ctx.send(f"📝 No voice chat time recorded for {label}")
+            return
+
+        top_text = f"**Voice Chat Time Top 10** ({label})\n\n"
+        for rank, (user_id, seconds) in enumerate(ranked, 1):
+            username = voice_time_tracking.get(str(user_id), {}).get('username', f'User_{user_id}')
+            top_text += f"{rank}. **{username}** - {format_duration(seconds)}\n"
+
+        await ctx.send(top_text)
+        logging.info(f"Top users over {label} answered in {query_ms:.2f}ms")
+
+    return stats, top
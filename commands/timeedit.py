@@ -4,8 +4,8 @@ import json
 import logging
 import re
 
-def setup_timeedit(bot, voice_time_tracking, update_voice_times, save_memory):
-    def resolve_user(identifier):
+def setup_timeedit(bot, get_guild_tracking, update_voice_times, save_memory):
+    def resolve_user(voice_time_tracking, identifier):
         """
         Resolve a user identifier to a user ID.
         Accepts: user ID (numeric string) or Discord username/tag.
@@ -82,11 +82,12 @@ def setup_timeedit(bot, voice_time_tracking, update_voice_times, save_memory):
             return
         
         try:
-            # Update all voice times first to ensure accurate current values
-            update_voice_times()
+            # Update this server's voice times first to ensure accurate current values
+            voice_time_tracking = get_guild_tracking(ctx.guild.id)
+            update_voice_times(ctx.guild.id)
             
             # Resolve user identifier to user ID
-            user_id, error = resolve_user(user_identifier)
+            user_id, error = resolve_user(voice_time_tracking, user_identifier)
             if error:
                 await ctx.send(error)
                 return
@@ -105,7 +106,7 @@ def setup_timeedit(bot, voice_time_tracking, update_voice_times, save_memory):
             voice_time_tracking[user_id]['total_time'] += seconds_to_add
             
             # Save the changes
-            save_memory()
+            save_memory('add', ctx.guild.id, user_id)
             
             # Format the added time for display
             hours = int(seconds_to_add // 3600)
@@ -152,11 +153,12 @@ def setup_timeedit(bot, voice_time_tracking, update_voice_times, save_memory):
             return
         
         try:
-            # Update all voice times first to ensure accurate current values
-            update_voice_times()
+            # Update this server's voice times first to ensure accurate current values
+            voice_time_tracking = get_guild_tracking(ctx.guild.id)
+            update_voice_times(ctx.guild.id)
             
             # Resolve user identifier to user ID
-            user_id, error = resolve_user(user_identifier)
+            user_id, error = resolve_user(voice_time_tracking, user_identifier)
             if error:
                 await ctx.send(error)
                 return
@@ -170,7 +172,7 @@ def setup_timeedit(bot, voice_time_tracking, update_voice_times, save_memory):
             voice_time_tracking[user_id]['total_time'] = max(0, voice_time_tracking[user_id]['total_time'] - seconds_to_remove)
             
             # Save the changes
-            save_memory()
+            save_memory('remove', ctx.guild.id, user_id)
             
             # Format the removed time for display
             hours = int(seconds_to_remove // 3600)
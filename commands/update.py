@@ -1,10 +1,14 @@
 import os
 import sys
+import asyncio
 import subprocess
 import logging
 from discord.ext import commands
 
-def setup_update(bot, save_memory, periodic_update, update_voice_times):
+# Seconds git may take before the update is aborted
+GIT_TIMEOUT = 120
+
+def setup_update(bot, flush_memory, scheduler, update_voice_times, blocking_io, cluster=None):
     @bot.command(name='update')
     async def update(ctx):
         """Update the bot from GitHub and restart. Only allowed for specific administrator."""
@@ -16,29 +20,28 @@ def setup_update(bot, save_memory, periodic_update, update_voice_times):
         logging.info("Update command received. Pulling from GitHub...")
         
         try:
-            # Run git pull with force flags
-            process = subprocess.Popen(['git', 'fetch', 'origin', 'master'],
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE)
-            output, error = process.communicate()
+            # Run git pull with force flags, without blocking the event loop
+            returncode, output, error = await blocking_io.run_process(
+                'git fetch', 'git', 'fetch', 'origin', 'master', timeout=GIT_TIMEOUT)
             
-            if process.returncode == 0:
-                reset_process = subprocess.Popen(['git', 'reset', '--hard', 'origin/master'],
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE)
-                output, error = reset_process.communicate()
+            if returncode == 0:
+                returncode, output, error = await blocking_io.run_process(
+                    'git reset', 'git', 'reset', '--hard', 'origin/master', timeout=GIT_TIMEOUT)
                 
-                if reset_process.returncode == 0:
+                if returncode == 0:
                     await ctx.send("Update successful! Restarting bot...")
                     logging.info("Git pull successful. Restarting bot...")
                     
-                    # Save state and stop periodic updates
-                    save_memory()
-                    periodic_update.stop()
+                    # Save state and stop scheduled jobs
+                    await scheduler.shutdown()  # Lets a running backup or reset finish
                     update_voice_times()  # Update all active voice times before saving
-                    save_memory()
+                    await flush_memory()
+                    
+                    # Clustered: the coordinator restarts every worker on the new code
+                    if cluster and await cluster.request_restart():
+                        return
                     
-                    # Restart the bot
+                    # Restart the bot (Popen only spawns the new process, it does not wait for it)
                     script_path = os.path.abspath(sys.argv[0])
                     subprocess.Popen([sys.executable, script_path])
                     try:
@@ -54,6 +57,9 @@ def setup_update(bot, save_memory, periodic_update, update_voice_times):
                 await ctx.send(f"Failed to update: {error_msg}")
                 logging.error(f"Git fetch failed: {error_msg}")
                 
+        except asyncio.TimeoutError:
+            await ctx.send(f"Failed to update: git did not finish within {GIT_TIMEOUT} seconds")
+            logging.error(f"Update error: git timed out after {GIT_TIMEOUT} seconds")
         except Exception as e:
             await ctx.send(f"An error occurred during update: {str(e)}")
             logging.error(f"Update error: {str(e)}")
@@ -0,0 +1,439 @@
+import bisect
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from datetime import datetime, timedelta
+from core.journal import LEGACY_GUILD_KEY
+from core.persistence import atomic_write_bytes
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: catalog writes are only serialized within one process
+    fcntl = None
+
+# memory-YYYY-MM-DD-HHMM[SS][.base|.delta].json[.gz]; plain memory-*.json copies are full backups
+POINT_FILENAME_PATTERN = re.compile(
+    r'^memory-(\d{4})-(\d{2})-(\d{2})-(\d{2})(\d{2})(\d{2})?(?:\.(base|delta))?\.json(\.gz)?$'
+)
+
+# Retention: every backup for KEEP_ALL, then the last one per day for KEEP_DAILY, then the last one per month
+KEEP_ALL = timedelta(hours=48)
+KEEP_DAILY = timedelta(days=90)
+
+
+CATALOG_FILENAME = 'catalog.json'
+# Version 2 lists the backups from before per-guild backups (backup/YYYY/MM/DD/, loose backup/memory-*.json)
+CATALOG_VERSION = 2
+
+
+class BackupPoint:
+    __slots__ = ('taken_at', 'kind', 'path', 'size', 'checksum')
+
+    def __init__(self, taken_at, kind, path, size=None, checksum=None):
+        self.taken_at = taken_at
+        self.kind = kind
+        self.path = path
+        self.size = size
+        self.checksum = checksum
+
+    def __repr__(self):
+        return f"BackupPoint({self.taken_at:%Y-%m-%d %H:%M:%S}, {self.kind})"
+
+
+def is_guild_dir_name(name):
+    # Years are four digits, Discord snowflakes are much longer
+    return name.isdigit() and len(name) > 4
+
+
+def file_checksum(payload):
+    return hashlib.sha256(payload).hexdigest()
+
+
+def read_point(point):
+    """Read a backup point, verifying its checksum when the catalog has one."""
+    with open(point.path, 'rb') as f:
+        payload = f.read()
+    if point.checksum is not None and file_checksum(payload) != point.checksum:
+        raise ValueError(f"checksum mismatch in {point.path}")
+    if point.path.endswith('.gz'):
+        payload = gzip.decompress(payload)
+    return json.loads(payload)
+
+
+def apply_point(state, kind, content):
+    """Apply a base (full {user_id: record}) or delta ({'changed': ..., 'removed': [...]}) to state."""
+    if kind == 'base':
+        state.clear()
+        state.update(content)
+    else:
+        state.update(content.get('changed', {}))
+        for user_id in content.get('removed', ()):
+            state.pop(user_id, None)
+
+
+class BackupEngine:
+    """
+    Incremental compressed backups per guild in backup/<guild_id>/YYYY/MM/DD/.
+    Each backup is either a gzip base (every record) or a gzip delta holding only
+    the records that changed since the previous backup, so backup I/O grows with
+    churn. A point in time is rebuilt from the last base plus the deltas after it.
+    Every point is listed in backup/catalog.json (timestamp, path, size, checksum),
+    so finding a backup is a bisect over a per-guild list of timestamps kept in step
+    with the points, instead of a directory walk. Full backups
+    from before per-guild backups are listed under the legacy partition until
+    adopt_legacy files them under the guild their data was migrated into. After a backup
+    or prune only that guild's entries are replaced in the catalog on disk, under a
+    lock file, so processes backing up different guilds (clustered mode) share it.
+    backup, prune and restore may run in worker threads and are serialized by a lock;
+    lookups take it too, so they belong in worker threads as well (load_catalog at startup).
+    """
+
+    def __init__(self, directory='backup', max_chain=50):
+        self.directory = directory
+        self.max_chain = max_chain
+        self.catalog_path = os.path.join(directory, CATALOG_FILENAME)
+        self._points = {}       # guild_id -> [BackupPoint] oldest first
+        self._times = {}        # guild_id -> [taken_at] of _points, for bisect
+        self._last_state = {}   # guild_id -> {user_id: record} of the newest point
+        self._catalog_loaded = False
+        self._lock = threading.RLock()
+
+    def _guild_dir(self, guild_id):
+        return os.path.join(self.directory, str(guild_id))
+
+    def load_catalog(self):
+        """Read the catalog unless that already happened (the first lookup would do it otherwise)."""
+        with self._lock:
+            if not self._catalog_loaded:
+                self._load_catalog()
+
+    def _set_points(self, guild_id, points):
+        self._points[guild_id] = points
+        self._times[guild_id] = [point.taken_at for point in points]
+
+    def _load_catalog(self):
+        """Read the catalog, or build it from a directory scan the first time."""
+        self._catalog_loaded = True
+        try:
+            with open(self.catalog_path, 'r') as f:
+                catalog = json.load(f)
+        except FileNotFoundError:
+            catalog = None
+        except json.JSONDecodeError:
+            logging.warning(f"{self.catalog_path} is corrupt, rebuilding it from the backup folders")
+            catalog = None
+
+        if catalog is not None:
+            for guild_id, entries in catalog.get('guilds', {}).items():
+                self._set_points(guild_id, [
+                    BackupPoint(datetime.fromisoformat(taken_at), kind, os.path.join(self.directory, path), size, checksum)
+                    for taken_at, kind, path, size, checksum in entries
+                ])
+            if catalog.get('version', 1) < CATALOG_VERSION:
+                # Older catalogs only listed the per-guild folders
+                legacy = self._scan(LEGACY_GUILD_KEY)
+                if legacy:
+                    self._set_points(LEGACY_GUILD_KEY, legacy)
+                    logging.info(f"Added {len(legacy)} backups from before per-guild backups to the catalog")
+                self._save_catalog(LEGACY_GUILD_KEY)
+            return
+
+        for guild_id in self.guild_ids() + [LEGACY_GUILD_KEY]:
+            points = self._scan(guild_id)
+            if points:
+                self._set_points(guild_id, points)
+        if self._points:
+            self._save_catalog()
+            logging.info(f"Built backup catalog with {sum(len(p) for p in self._points.values())} backups")
+
+    def _scan(self, guild_id):
+        """Read the points of a guild's folder; the legacy partition is every backup outside the guild folders."""
+        points = []
+        legacy = guild_id == LEGACY_GUILD_KEY
+        for root, dirs, files in os.walk(self.directory if legacy else self._guild_dir(guild_id)):
+            if legacy and root == self.directory:
+                dirs[:] = [name for name in dirs if not is_guild_dir_name(name)]
+            for filename in files:
+                match = POINT_FILENAME_PATTERN.match(filename)
+                if not match:
+                    continue
+                year, month, day, hour, minute, second, kind, _gz = match.groups()
+                taken_at = datetime(int(year), int(month), int(day), int(hour), int(minute), int(second or 0))
+                path = os.path.join(root, filename)
+                with open(path, 'rb') as f:
+                    payload = f.read()
+                points.append(BackupPoint(taken_at, kind or 'base', path, len(payload), file_checksum(payload)))
+        # A base and a delta with the same timestamp describe the same state; the base goes first
+        points.sort(key=lambda point: (point.taken_at, point.kind != 'base'))
+        return points
+
+    def _save_catalog(self, *guild_ids):
+        """Write the catalog; with guild_ids the other guilds' entries are kept as they are on disk."""
+        guilds = {
+            key: [
+                [point.taken_at.isoformat(), point.kind, os.path.relpath(point.path, self.directory), point.size, point.checksum]
+                for point in points
+            ]
+            for key, points in self._points.items() if points
+        }
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.catalog_path + '.lock', 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            if guild_ids:
+                try:
+                    with open(self.catalog_path, 'r') as f:
+                        on_disk = json.load(f).get('guilds', {})
+                except (FileNotFoundError, json.JSONDecodeError):
+                    on_disk = {}
+                # Another process may have backed up its guilds since this one loaded the catalog
+                guilds.update((key, entries) for key, entries in on_disk.items() if key not in guild_ids)
+            catalog = {'version': CATALOG_VERSION, 'guilds': guilds}
+            atomic_write_bytes(self.catalog_path, json.dumps(catalog, separators=(',', ':')).encode('utf-8'))
+
+    def points(self, guild_id):
+        """Backup points of a guild, oldest first."""
+        self.load_catalog()
+        guild_id = str(guild_id)
+        if guild_id not in self._points:
+            self._set_points(guild_id, [])
+        return self._points[guild_id]
+
+    def _times_of(self, guild_id):
+        self.points(guild_id)
+        return self._times[str(guild_id)]
+
+    def latest(self, guild_id):
+        points = self.points(guild_id)
+        return points[-1] if points else None
+
+    def at_or_before(self, guild_id, at):
+        """Newest point taken at or before at, or None."""
+        with self._lock:
+            points = self.points(guild_id)
+            index = bisect.bisect_right(self._times_of(guild_id), at)
+            return points[index - 1] if index > 0 else None
+
+    def closest(self, guild_id, at):
+        """Point whose timestamp is closest to at, or None."""
+        with self._lock:
+            points = self.points(guild_id)
+            index = bisect.bisect_left(self._times_of(guild_id), at)
+            candidates = points[max(index - 1, 0):index + 1]
+            return min(candidates, key=lambda point: abs(point.taken_at - at)) if candidates else None
+
+    def in_range(self, guild_id, start, end):
+        """Points taken in [start, end), oldest first."""
+        with self._lock:
+            points = self.points(guild_id)
+            times = self._times_of(guild_id)
+            return points[bisect.bisect_left(times, start):bisect.bisect_left(times, end)]
+
+    def _chain_start(self, points, index):
+        """Index of the base that the point at index is rebuilt from."""
+        for i in range(index, -1, -1):
+            if points[i].kind == 'base':
+                return i
+        return 0
+
+    def restore(self, guild_id, at=None):
+        """Rebuild a guild's data as of the newest backup taken at or before at (default: newest). None if there is none."""
+        with self._lock:
+            points = self.points(guild_id)
+            if at is None:
+                index = len(points) - 1
+            else:
+                index = bisect.bisect_right(self._times_of(guild_id), at) - 1
+            if index < 0:
+                return None
+            state = {}
+            for point in points[self._chain_start(points, index):index + 1]:
+                apply_point(state, point.kind, read_point(point))
+            return state
+
+    def _path(self, guild_id, taken_at, kind):
+        day_dir = os.path.join(self._guild_dir(guild_id), taken_at.strftime('%Y'), taken_at.strftime('%m'), taken_at.strftime('%d'))
+        return os.path.join(day_dir, f"memory-{taken_at:%Y-%m-%d-%H%M%S}.{kind}.json.gz")
+
+    def _write_point(self, guild_id, taken_at, kind, content):
+        path = self._path(guild_id, taken_at, kind)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        payload = gzip.compress(json.dumps(content, separators=(',', ':')).encode('utf-8'))
+        atomic_write_bytes(path, payload)
+        return BackupPoint(taken_at, kind, path, len(payload), file_checksum(payload))
+
+    def backup(self, guild_id, records, taken_at=None):
+        """
+        Back up a guild's records. Writes a delta of the changed records, or a new base
+        when the chain is long or its deltas outweigh the base. Returns (path, bytes),
+        or None when nothing changed since the previous backup.
+        """
+        guild_id = str(guild_id)
+        taken_at = taken_at or datetime.now().replace(microsecond=0)
+        with self._lock:
+            points = self.points(guild_id)
+            previous = self._last_state.get(guild_id)
+            if previous is None and points:
+                previous = self.restore(guild_id) or {}
+
+            if previous is None:
+                kind, content = 'base', records
+            else:
+                changed = {user_id: record for user_id, record in records.items() if previous.get(user_id) != record}
+                removed = [user_id for user_id in previous if user_id not in records]
+                if not changed and not removed:
+                    return None
+                kind, content = 'delta', {'changed': changed, 'removed': removed}
+                start = self._chain_start(points, len(points) - 1)
+                chain_bytes = sum(point.size for point in points[start + 1:])
+                if len(points) - start >= self.max_chain or chain_bytes > points[start].size:
+                    kind, content = 'base', records
+
+            point = self._write_point(guild_id, taken_at, kind, content)
+            points.append(point)
+            self._times[guild_id].append(taken_at)
+            self._last_state[guild_id] = {user_id: dict(record) for user_id, record in records.items()}
+            self._save_catalog(guild_id)
+            return point.path, point.size
+
+    @staticmethod
+    def retained(points, now):
+        """Which points the retention policy keeps: all for 48h, the last per day for 90 days, the last per month after that."""
+        keep = [False] * len(points)
+        seen_days = set()
+        seen_months = set()
+        for i in range(len(points) - 1, -1, -1):
+            age = now - points[i].taken_at
+            if i == len(points) - 1 or age <= KEEP_ALL:
+                keep[i] = True
+            elif age <= KEEP_DAILY:
+                day = points[i].taken_at.date()
+                if day not in seen_days:
+                    seen_days.add(day)
+                    keep[i] = True
+            else:
+                month = (points[i].taken_at.year, points[i].taken_at.month)
+                if month not in seen_months:
+                    seen_months.add(month)
+                    keep[i] = True
+        return keep
+
+    def prune(self, guild_id, now=None):
+        """
+        Apply the retention policy. Changes in dropped deltas are folded into the next
+        kept delta, and a kept delta whose base is dropped becomes a base, so every
+        kept point still rebuilds exactly. Returns the number of points removed.
+        """
+        guild_id = str(guild_id)
+        with self._lock:
+            points = self.points(guild_id)
+            keep = self.retained(points, now or datetime.now())
+            if all(keep):
+                return 0
+            first_dropped = keep.index(False)
+            start = self._chain_start(points, first_dropped)
+
+            state = {}
+            touched = set()
+            need_base = False
+            previous_kept = start > 0 and keep[start - 1]
+            replacements = []   # (index, new kind, content)
+            for i in range(start, len(points)):
+                point = points[i]
+                content = read_point(point)
+                apply_point(state, point.kind, content)
+                if not keep[i]:
+                    if point.kind == 'base':
+                        need_base = True
+                    else:
+                        touched.update(content.get('changed', {}))
+                        touched.update(content.get('removed', ()))
+                elif point.kind == 'base' or (previous_kept and not need_base and not touched):
+                    # Self-contained, or its predecessor is still there
+                    need_base = False
+                    touched.clear()
+                elif need_base or i == 0:
+                    replacements.append((i, 'base', dict(state)))
+                    need_base = False
+                    touched.clear()
+                else:
+                    touched.update(content.get('changed', {}))
+                    touched.update(content.get('removed', ()))
+                    replacements.append((i, 'delta', {
+                        'changed': {user_id: state[user_id] for user_id in touched if user_id in state},
+                        'removed': [user_id for user_id in touched if user_id not in state],
+                    }))
+                    touched.clear()
+                previous_kept = keep[i]
+                if i > first_dropped and not need_base and not touched and all(keep[i:]):
+                    break
+
+            # Write the replacements before deleting anything, so a crash never breaks a chain
+            for i, kind, content in replacements:
+                old_path = points[i].path
+                points[i] = self._write_point(guild_id, points[i].taken_at, kind, content)
+                if points[i].path != old_path:
+                    os.remove(old_path)
+            removed = 0
+            for i, point in enumerate(points):
+                if not keep[i]:
+                    try:
+                        os.remove(point.path)
+                        removed += 1
+                    except OSError as e:
+                        logging.warning(f"Could not remove backup {point.path}: {e}")
+            self._set_points(guild_id, [point for i, point in enumerate(points) if keep[i]])
+            self._save_catalog(guild_id)
+            self._remove_empty_dirs([point.path for i, point in enumerate(points) if not keep[i]])
+            return removed
+
+    def _remove_empty_dirs(self, paths):
+        """Remove the day/month/year folders left empty by removed backups (never a guild folder)."""
+        top = os.path.normpath(self.directory)
+        for directory in {os.path.normpath(os.path.dirname(path)) for path in paths}:
+            while directory.startswith(top + os.sep) and not (
+                    os.path.dirname(directory) == top and is_guild_dir_name(os.path.basename(directory))):
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    # Not empty
+                    break
+                directory = os.path.dirname(directory)
+
+    def adopt_legacy(self, guild_id):
+        """
+        File the backups from before per-guild backups under the guild their data was
+        migrated into, so !backup and !restore find them. Returns how many were moved.
+        """
+        guild_id = str(guild_id)
+        with self._lock:
+            legacy = self.points(LEGACY_GUILD_KEY)
+            if not legacy or guild_id == LEGACY_GUILD_KEY:
+                return 0
+            points = sorted(self.points(guild_id) + legacy, key=lambda point: (point.taken_at, point.kind != 'base'))
+            self._set_points(guild_id, points)
+            del self._points[LEGACY_GUILD_KEY]
+            del self._times[LEGACY_GUILD_KEY]
+            # The newest point may now be a different one
+            self._last_state.pop(guild_id, None)
+            self._save_catalog(guild_id, LEGACY_GUILD_KEY)
+            return len(legacy)
+
+    def iter_states(self, guild_id):
+        """Yield (taken_at, state) for every backup point in order, reading each file once."""
+        state = {}
+        for point in self.points(guild_id):
+            apply_point(state, point.kind, read_point(point))
+            yield point.taken_at, state
+
+    def guild_ids(self):
+        """Guilds that have a backup directory."""
+        if not os.path.isdir(self.directory):
+            return []
+        return [name for name in os.listdir(self.directory)
+                if is_guild_dir_name(name) and os.path.isdir(os.path.join(self.directory, name))]
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class OperationStats:
+    __slots__ = ('calls', 'errors', 'timeouts', 'total_seconds', 'max_seconds')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def add(self, seconds):
+        self.calls += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+
+class BlockingIO:
+    """
+    Runs blocking work away from the event loop: file I/O in a bounded thread pool,
+    subprocesses through asyncio.create_subprocess_exec. Every operation has a name,
+    a timeout and metrics (calls, errors, timeouts, average and worst duration).
+    A timed out file operation keeps running in its thread, but the caller stops
+    waiting for it; a timed out subprocess is killed. A timeout of 0 waits as long
+    as the operation takes.
+    """
+
+    def __init__(self, max_workers=4, timeout=30.0):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='blocking-io')
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.operations = {}    # name -> OperationStats
+        self.in_flight = 0
+
+    def _stats(self, name):
+        stats = self.operations.get(name)
+        if stats is None:
+            stats = self.operations[name] = OperationStats()
+        return stats
+
+    async def _measure(self, name, awaitable, timeout):
+        stats = self._stats(name)
+        start = time.perf_counter()
+        self.in_flight += 1
+        try:
+            timeout = timeout if timeout is not None else self.timeout
+            return await (asyncio.wait_for(awaitable, timeout) if timeout else awaitable)
+        except asyncio.TimeoutError:
+            stats.timeouts += 1
+            logging.error(f"Blocking I/O '{name}' timed out after {time.perf_counter() - start:.1f}s")
+            raise
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            stats.add(time.perf_counter() - start)
+
+    async def run(self, name, func, *args, timeout=None):
+        """Run func(*args) in the thread pool and return its result. Raises asyncio.TimeoutError after timeout seconds."""
+        future = asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        return await self._measure(name, future, timeout)
+
+    async def run_process(self, name, *argv, timeout=None, cwd=None):
+        """Run a command without blocking the loop. Returns (returncode, stdout bytes, stderr bytes); kills it on timeout."""
+        process = await asyncio.create_subprocess_exec(
+            *argv, cwd=cwd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            stdout, stderr = await self._measure(name, process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise
+        return process.returncode, stdout, stderr
+
+    def stats(self):
+        return {
+            'in_flight': self.in_flight,
+            'operations': {
+                name: {
+                    'calls': stats.calls,
+                    'errors': stats.errors,
+                    'timeouts': stats.timeouts,
+                    'avg_ms': stats.total_seconds / stats.calls * 1000 if stats.calls else 0.0,
+                    'max_ms': stats.max_seconds * 1000,
+                }
+                for name, stats in self.operations.items()
+            },
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
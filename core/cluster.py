@@ -0,0 +1,398 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import signal
+import sys
+import time
+
+DEFAULT_ADDRESS = '127.0.0.1:8790'
+# Seconds a worker waits for the coordinator to answer before deciding on its own
+REQUEST_TIMEOUT = 2.0
+# Restart delay of a crashed worker doubles from 1 second up to this, and resets after a minute of uptime
+MAX_RESTART_DELAY = 60.0
+STABLE_UPTIME = 60.0
+
+
+def parse_address(address):
+    host, _, port = (address or DEFAULT_ADDRESS).rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def shard_of(guild_id, shard_count):
+    """The gateway shard Discord delivers a guild's events to."""
+    return (int(guild_id) >> 22) % shard_count
+
+
+def worker_shards(worker, workers, shard_count):
+    """Shards run by one worker: shards are dealt out round-robin, so every worker gets an even share."""
+    return [shard for shard in range(shard_count) if shard % workers == worker]
+
+
+async def _send(writer, message):
+    writer.write(json.dumps(message, separators=(',', ':')).encode('utf-8') + b'\n')
+    await writer.drain()
+
+
+class ClusterCoordinator:
+    """
+    Supervisor and shared-state service of a clustered deployment. It starts one bot.py
+    process per worker with SHARD_IDS/SHARD_COUNT set, restarts workers that exit, and
+    serves newline-delimited JSON requests on a local TCP socket:
+    claim/release (cluster-wide cooldowns such as offline notices), publish (broadcast
+    to the other workers, e.g. "config changed"), report/status (per-worker stats for
+    !cluster) and restart (restart every worker, used by !restart and !update).
+    Tracking data itself is partitioned by guild and each guild lives on exactly one
+    shard, so workers share the storage backend without writing the same records.
+    """
+
+    def __init__(self, address, workers, shard_count, command, restart=True, stop_timeout=30.0):
+        self.host, self.port = parse_address(address)
+        self.workers = workers
+        self.shard_count = shard_count
+        self.command = command
+        self.restart = restart
+        self.stop_timeout = stop_timeout
+        self.claims = {}        # key -> (expires_at, worker)
+        self.connections = {}   # worker -> StreamWriter
+        self.reports = {}       # worker -> last reported stats
+        self.processes = {}     # worker -> asyncio subprocess
+        self.started_at = {}    # worker -> time the current process was started
+        self.restarts = {worker: 0 for worker in range(workers)}
+        self._restart_requested = set()
+        self._server = None
+        self._supervisors = []
+        self._stopping = False
+
+    def worker_env(self, worker):
+        env = dict(os.environ)
+        env.update({
+            'SHARD_COUNT': str(self.shard_count),
+            'SHARD_IDS': ','.join(map(str, worker_shards(worker, self.workers, self.shard_count))),
+            'CLUSTER_WORKER': str(worker),
+            'CLUSTER_ADDRESS': f"{self.host}:{self.port}",
+        })
+        if int(env.get('METRICS_PORT') or 0):
+            env['METRICS_PORT'] = str(int(env['METRICS_PORT']) + worker)
+        if env.get('RECORD_EVENTS'):
+            stem, ext = os.path.splitext(env['RECORD_EVENTS'])
+            env['RECORD_EVENTS'] = f"{stem}.worker{worker}{ext}"
+        return env
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        # Port 0 picks a free port; workers are told the real one
+        self.port = self._server.sockets[0].getsockname()[1]
+        logging.info(f"Coordinator listening on {self.host}:{self.port}, {self.workers} workers for {self.shard_count} shards")
+        self._supervisors = [asyncio.create_task(self._supervise(worker)) for worker in range(self.workers)]
+
+    async def _supervise(self, worker):
+        delay = 1.0
+        while not self._stopping:
+            process = await asyncio.create_subprocess_exec(*self.command, env=self.worker_env(worker))
+            self.processes[worker] = process
+            self.started_at[worker] = time.time()
+            shards = worker_shards(worker, self.workers, self.shard_count)
+            logging.info(f"Started worker {worker} (pid {process.pid}) for shards {shards}")
+            returncode = await process.wait()
+            uptime = time.time() - self.started_at[worker]
+            self.processes.pop(worker, None)
+            if self._stopping or not self.restart:
+                logging.info(f"Worker {worker} exited with {returncode}")
+                return
+            self.restarts[worker] += 1
+            if worker in self._restart_requested:
+                self._restart_requested.discard(worker)
+                logging.info(f"Worker {worker} stopped for the requested restart")
+                continue
+            if uptime >= STABLE_UPTIME:
+                delay = 1.0
+            logging.warning(f"Worker {worker} exited with {returncode} after {uptime:.0f}s, restarting in {delay:.0f}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RESTART_DELAY)
+
+    async def wait(self):
+        """Until every worker has exited for good (only happens with restart=False or after stop())."""
+        await asyncio.gather(*self._supervisors)
+
+    def restart_workers(self):
+        """Terminate every worker; their supervisors start them again (graceful: SIGTERM flushes state first)."""
+        for worker, process in list(self.processes.items()):
+            logging.info(f"Restarting worker {worker}")
+            self._restart_requested.add(worker)
+            process.terminate()
+
+    async def stop(self):
+        self._stopping = True
+        processes = list(self.processes.values())
+        for process in processes:
+            process.terminate()
+        try:
+            await asyncio.wait_for(asyncio.gather(*(process.wait() for process in processes)), self.stop_timeout)
+        except asyncio.TimeoutError:
+            for process in processes:
+                if process.returncode is None:
+                    logging.warning(f"Worker pid {process.pid} did not stop within {self.stop_timeout:.0f}s, killing it")
+                    process.kill()
+        await asyncio.gather(*self._supervisors, return_exceptions=True)
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def claim(self, key, ttl, worker):
+        now = time.time()
+        held = self.claims.get(key)
+        if held is not None and held[0] > now:
+            return False
+        self.claims[key] = (now + ttl, worker)
+        if len(self.claims) > 10000:
+            self.claims = {k: v for k, v in self.claims.items() if v[0] > now}
+        return True
+
+    def status(self):
+        now = time.time()
+        workers = []
+        for worker in range(self.workers):
+            process = self.processes.get(worker)
+            workers.append({
+                'worker': worker,
+                'shards': worker_shards(worker, self.workers, self.shard_count),
+                'pid': process.pid if process else None,
+                'running': process is not None,
+                'connected': worker in self.connections,
+                'uptime': now - self.started_at[worker] if process else 0.0,
+                'restarts': self.restarts[worker],
+                'stats': self.reports.get(worker, {}),
+            })
+        return {'shard_count': self.shard_count, 'workers': workers}
+
+    async def _handle(self, reader, writer):
+        worker = None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except json.JSONDecodeError:
+                    logging.warning(f"Coordinator: ignoring an invalid line from worker {worker}")
+                    continue
+                op = request.get('op')
+                reply = {'id': request.get('id')}
+                if op == 'hello':
+                    worker = request['worker']
+                    self.connections[worker] = writer
+                    logging.info(f"Worker {worker} connected (pid {request.get('pid')}, shards {request.get('shards')})")
+                elif op == 'claim':
+                    reply['granted'] = self.claim(request['key'], request['ttl'], worker)
+                elif op == 'release':
+                    held = self.claims.get(request['key'])
+                    if held is not None and held[1] == worker:
+                        del self.claims[request['key']]
+                elif op == 'publish':
+                    event = {'event': request['topic'], 'data': request.get('data'), 'from': worker}
+                    for other, other_writer in list(self.connections.items()):
+                        if other != worker:
+                            try:
+                                await _send(other_writer, event)
+                            except (ConnectionError, RuntimeError):
+                                pass
+                elif op == 'report':
+                    self.reports[worker] = dict(request.get('stats') or {}, reported_at=time.time())
+                elif op == 'status':
+                    reply['status'] = self.status()
+                elif op == 'restart':
+                    logging.info(f"Worker {worker} requested a restart of all workers")
+                    asyncio.get_running_loop().call_soon(self.restart_workers)
+                else:
+                    reply['error'] = f"unknown op {op}"
+                if request.get('id') is not None:
+                    await _send(writer, reply)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            if worker is not None and self.connections.get(worker) is writer:
+                del self.connections[worker]
+                logging.info(f"Worker {worker} disconnected")
+            writer.close()
+
+
+class ClusterClient:
+    """
+    A worker's connection to the coordinator. Reconnects in the background; while the
+    coordinator is unreachable requests return None and claim() grants locally, so a
+    worker keeps running on its own (each worker still has its local cooldowns).
+    """
+
+    def __init__(self, address, worker, shard_ids, stats=None, report_interval=15.0, timeout=REQUEST_TIMEOUT):
+        self.host, self.port = parse_address(address)
+        self.worker = worker
+        self.shard_ids = shard_ids
+        self.stats = stats
+        self.report_interval = report_interval
+        self.timeout = timeout
+        self._handlers = {}
+        self._pending = {}
+        self._ids = itertools.count(1)
+        self._writer = None
+        self._task = None
+
+    @property
+    def connected(self):
+        return self._writer is not None
+
+    def on(self, topic, callback):
+        """Call callback(data) when another worker publishes topic."""
+        self._handlers.setdefault(topic, []).append(callback)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        delay = 1.0
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+            except OSError as e:
+                logging.warning(f"Cannot reach the cluster coordinator at {self.host}:{self.port} ({e}), retrying in {delay:.0f}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+                continue
+            delay = 1.0
+            self._writer = writer
+            reporter = None
+            try:
+                await _send(writer, {'op': 'hello', 'worker': self.worker, 'pid': os.getpid(), 'shards': self.shard_ids})
+                logging.info(f"Connected to the cluster coordinator as worker {self.worker}")
+                if self.stats is not None:
+                    reporter = asyncio.get_running_loop().create_task(self._report_loop())
+                await self._read(reader)
+            except (ConnectionError, OSError, ValueError) as e:
+                logging.warning(f"Lost the cluster coordinator connection: {e}")
+            finally:
+                if reporter is not None:
+                    reporter.cancel()
+                self._writer = None
+                writer.close()
+                for future in self._pending.values():
+                    if not future.done():
+                        future.set_result(None)
+                self._pending.clear()
+            await asyncio.sleep(delay)
+
+    async def _read(self, reader):
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            message = json.loads(line)
+            if 'event' in message:
+                for callback in self._handlers.get(message['event'], ()):
+                    try:
+                        callback(message.get('data'))
+                    except Exception as e:
+                        logging.error(f"Error in cluster {message['event']} handler: {e}")
+                continue
+            future = self._pending.pop(message.get('id'), None)
+            if future is not None and not future.done():
+                future.set_result(message)
+
+    async def _report_loop(self):
+        while True:
+            try:
+                await self.send('report', stats=self.stats())
+            except Exception as e:
+                logging.error(f"Could not report worker stats: {e}")
+            await asyncio.sleep(self.report_interval)
+
+    async def send(self, op, **fields):
+        """Fire-and-forget message. Returns False when not connected."""
+        if self._writer is None:
+            return False
+        try:
+            await _send(self._writer, dict(fields, op=op))
+            return True
+        except (ConnectionError, RuntimeError):
+            return False
+
+    async def request(self, op, **fields):
+        """Send a request and wait for the reply. None when not connected or no reply within timeout."""
+        if self._writer is None:
+            return None
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            await _send(self._writer, dict(fields, op=op, id=request_id))
+            return await asyncio.wait_for(future, self.timeout)
+        except (ConnectionError, RuntimeError, asyncio.TimeoutError):
+            return None
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def claim(self, key, ttl):
+        """Take a cluster-wide cooldown. False when another worker holds it; True (local decision) without a coordinator."""
+        reply = await self.request('claim', key=key, ttl=ttl)
+        if reply is None:
+            logging.warning(f"No coordinator reply for claim {key}, deciding locally")
+            return True
+        return reply['granted']
+
+    async def release(self, key):
+        await self.send('release', key=key)
+
+    async def publish(self, topic, data=None):
+        return await self.send('publish', topic=topic, data=data)
+
+    async def status(self):
+        reply = await self.request('status')
+        return reply['status'] if reply else None
+
+    async def request_restart(self):
+        """Ask the coordinator to restart every worker (this one included). False without a coordinator."""
+        return await self.send('restart')
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+async def run_coordinator(args):
+    coordinator = ClusterCoordinator(args.address, args.workers, args.shards, args.command, restart=not args.no_restart)
+    await coordinator.start()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    waiter = asyncio.create_task(coordinator.wait())
+    stopper = asyncio.create_task(stop.wait())
+    await asyncio.wait({waiter, stopper}, return_when=asyncio.FIRST_COMPLETED)
+    logging.info("Stopping the cluster...")
+    await coordinator.stop()
+    stopper.cancel()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - coordinator - %(message)s')
+    bot_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bot.py')
+    parser = argparse.ArgumentParser(description='Run the bot as several worker processes, each with a share of the gateway shards.')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('CLUSTER_WORKERS', '2')))
+    parser.add_argument('--shards', type=int, default=int(os.getenv('SHARD_COUNT', '0')) or None,
+                        help='total gateway shards (default: one per worker)')
+    parser.add_argument('--address', default=os.getenv('CLUSTER_ADDRESS', DEFAULT_ADDRESS), help='host:port of the coordinator socket')
+    parser.add_argument('--no-restart', action='store_true', help='do not restart workers that exit')
+    parser.add_argument('command', nargs='*', help='worker command (default: this Python running bot.py)')
+    args = parser.parse_args()
+    args.shards = args.shards or args.workers
+    if args.shards < args.workers:
+        parser.error('--shards must be at least --workers')
+    args.command = args.command or [sys.executable, bot_path]
+    asyncio.run(run_coordinator(args))
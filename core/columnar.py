@@ -0,0 +1,266 @@
+import math
+from array import array
+from collections.abc import MutableMapping
+
+try:
+    import numpy as np
+except ImportError:
+    # Optional: batch operations fall back to loops over the same arrays
+    np = None
+
+IN_VOICE = 1
+NO_JOIN = math.nan
+COLUMN_KEYS = ('username', 'total_time', 'in_voice', 'join_time')
+
+
+class RecordView(MutableMapping):
+    """
+    Dict-like view of one user's row, so code written for {'username', 'total_time',
+    'in_voice', 'join_time'} records keeps working. 'join_time' is absent while the
+    row holds no join time; keys outside the columns are kept in a side dict.
+    """
+
+    __slots__ = ('table', 'user_id')
+
+    def __init__(self, table, user_id):
+        self.table = table
+        self.user_id = user_id
+
+    def _row(self):
+        try:
+            return self.table.index[self.user_id]
+        except KeyError:
+            raise KeyError(f"user {self.user_id} is no longer tracked") from None
+
+    def __getitem__(self, key):
+        table = self.table
+        row = self._row()
+        if key == 'total_time':
+            return table.total[row]
+        if key == 'join_time':
+            join_time = table.join[row]
+            if join_time != join_time:
+                raise KeyError(key)
+            return join_time
+        if key == 'in_voice':
+            return bool(table.flags[row] & IN_VOICE)
+        if key == 'username':
+            return table.names[row]
+        return table.extras[self.user_id][key]
+
+    def __setitem__(self, key, value):
+        table = self.table
+        row = self._row()
+        if key == 'total_time':
+            table.total[row] = value
+        elif key == 'join_time':
+            table.join[row] = value
+        elif key == 'in_voice':
+            table.flags[row] = (table.flags[row] | IN_VOICE) if value else (table.flags[row] & ~IN_VOICE)
+        elif key == 'username':
+            table.names[row] = value
+        else:
+            table.extras.setdefault(self.user_id, {})[key] = value
+
+    def __delitem__(self, key):
+        table = self.table
+        row = self._row()
+        if key == 'join_time':
+            if table.join[row] != table.join[row]:
+                raise KeyError(key)
+            table.join[row] = NO_JOIN
+        elif key == 'in_voice':
+            table.flags[row] &= ~IN_VOICE
+        elif key in COLUMN_KEYS:
+            raise KeyError(f"{key} is a column and cannot be removed")
+        else:
+            del table.extras[self.user_id][key]
+
+    def __iter__(self):
+        row = self._row()
+        yield 'username'
+        yield 'total_time'
+        yield 'in_voice'
+        if self.table.join[row] == self.table.join[row]:
+            yield 'join_time'
+        yield from self.table.extras.get(self.user_id, ())
+
+    def __len__(self):
+        row = self._row()
+        return 3 + (self.table.join[row] == self.table.join[row]) + len(self.table.extras.get(self.user_id, ()))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class ColumnarTracking(MutableMapping):
+    """
+    One guild's tracking data as parallel typed arrays: user IDs, totals, join times
+    (NaN while not tracking) and flags, with a {user_id: row} hash index. Rows are
+    kept dense (a removed row is replaced by the last one). Mapping access by string
+    user ID returns RecordViews, so code written for {user_id: record} dicts works
+    unchanged; accrual, resets and ordering run as batch operations over the
+    arrays, vectorized with NumPy when it is installed.
+    """
+
+    def __init__(self, records=None):
+        self.index = {}                 # int user_id -> row
+        self.ids = array('q')
+        self.total = array('d')
+        self.join = array('d')
+        self.flags = array('B')
+        self.names = []
+        self.extras = {}                # int user_id -> {key: value} outside the columns
+        self._views = {}                # int user_id -> RecordView (created on first access)
+        if records:
+            for user_id, record in records.items():
+                self[user_id] = record
+
+    def __getitem__(self, user_id):
+        key = int(user_id)
+        view = self._views.get(key)
+        if view is None:
+            if key not in self.index:
+                raise KeyError(user_id)
+            view = self._views[key] = RecordView(self, key)
+        return view
+
+    def get(self, user_id, default=None):
+        key = int(user_id)
+        if key not in self.index:
+            return default
+        return self[key]
+
+    def setdefault(self, user_id, default=None):
+        """Like dict.setdefault, but always returns the stored record (a view, not default)."""
+        if user_id not in self:
+            self[user_id] = default
+        return self[user_id]
+
+    def __contains__(self, user_id):
+        try:
+            return int(user_id) in self.index
+        except (TypeError, ValueError):
+            return False
+
+    def __setitem__(self, user_id, record):
+        key = int(user_id)
+        if isinstance(record, RecordView) and record.table is self and record.user_id == key:
+            return
+        record = dict(record)
+        row = self.index.get(key)
+        if row is None:
+            row = self.index[key] = len(self.ids)
+            self.ids.append(key)
+            self.total.append(0.0)
+            self.join.append(NO_JOIN)
+            self.flags.append(0)
+            self.names.append('Unknown')
+        self.names[row] = record.pop('username', 'Unknown')
+        self.total[row] = record.pop('total_time', 0)
+        self.flags[row] = IN_VOICE if record.pop('in_voice', False) else 0
+        self.join[row] = record.pop('join_time', NO_JOIN)
+        if record:
+            self.extras[key] = record
+        else:
+            self.extras.pop(key, None)
+
+    def __delitem__(self, user_id):
+        key = int(user_id)
+        row = self.index.pop(key)
+        last = len(self.ids) - 1
+        if row != last:
+            # Move the last row into the hole so the arrays stay dense
+            moved = self.ids[last]
+            self.ids[row] = moved
+            self.total[row] = self.total[last]
+            self.join[row] = self.join[last]
+            self.flags[row] = self.flags[last]
+            self.names[row] = self.names[last]
+            self.index[moved] = row
+        for column in (self.ids, self.total, self.join, self.flags, self.names):
+            column.pop()
+        self.extras.pop(key, None)
+        self._views.pop(key, None)
+
+    def __iter__(self):
+        return (str(user_id) for user_id in self.ids.tolist())
+
+    def __len__(self):
+        return len(self.ids)
+
+    def clear(self):
+        self.__init__()
+
+    def __repr__(self):
+        return f"ColumnarTracking({len(self)} users)"
+
+    @staticmethod
+    def vectorized():
+        """True when batch operations run on NumPy."""
+        return np is not None
+
+    def accrue(self, now):
+        """
+        Add now - join_time to every running session (in voice with a join time) and move
+        its join time to now. Returns [(user_id, previous join_time)] of the accrued sessions.
+        """
+        if not self.ids:
+            return []
+        if np is not None:
+            total = np.frombuffer(self.total, dtype=np.float64)
+            join = np.frombuffer(self.join, dtype=np.float64)
+            flags = np.frombuffer(self.flags, dtype=np.uint8)
+            rows = np.flatnonzero((flags & IN_VOICE).astype(bool) & ~np.isnan(join))
+            started = join[rows]
+            total[rows] += now - started
+            join[rows] = now
+            ids = np.frombuffer(self.ids, dtype=np.int64)[rows].tolist()
+            return list(zip(map(str, ids), started.tolist()))
+        accrued = []
+        for row, join_time in enumerate(self.join):
+            if join_time == join_time and self.flags[row] & IN_VOICE:
+                self.total[row] += now - join_time
+                self.join[row] = now
+                accrued.append((str(self.ids[row]), join_time))
+        return accrued
+
+    def reset_totals(self):
+        """Set every total_time to 0."""
+        if np is not None and self.ids:
+            np.frombuffer(self.total, dtype=np.float64)[:] = 0.0
+        else:
+            self.total = array('d', bytes(8 * len(self.ids)))
+
+    def in_voice_ids(self):
+        """User IDs (str) of the rows flagged in_voice."""
+        if np is not None and self.ids:
+            rows = np.flatnonzero(np.frombuffer(self.flags, dtype=np.uint8) & IN_VOICE)
+            return list(map(str, np.frombuffer(self.ids, dtype=np.int64)[rows].tolist()))
+        return [str(user_id) for user_id, flags in zip(self.ids, self.flags) if flags & IN_VOICE]
+
+    def active_count(self):
+        """Number of rows with a join time (sessions being counted)."""
+        if np is not None and self.ids:
+            return int(np.count_nonzero(~np.isnan(np.frombuffer(self.join, dtype=np.float64))))
+        return sum(1 for join_time in self.join if join_time == join_time)
+
+    def ranking_keys(self):
+        """{user_id: (-total_time, user_id)} in one pass over the columns (for RankingIndex)."""
+        return {user_id: (-total, user_id) for user_id, total in zip(map(str, self.ids.tolist()), self.total.tolist())}
+
+    def snapshot(self):
+        """Detached copy of the columns (no views), cheap enough to take on the event loop."""
+        copy = ColumnarTracking()
+        copy.index = dict(self.index)
+        copy.ids = array('q', self.ids)
+        copy.total = array('d', self.total)
+        copy.join = array('d', self.join)
+        copy.flags = array('B', self.flags)
+        copy.names = list(self.names)
+        copy.extras = {user_id: dict(values) for user_id, values in self.extras.items()}
+        return copy
+
+    def to_dict(self):
+        """Plain {user_id: record} copy."""
+        return {user_id: dict(self[user_id]) for user_id in self}
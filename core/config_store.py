@@ -0,0 +1,197 @@
+import asyncio
+import copy
+import json
+import logging
+import os
+from core.persistence import atomic_write_bytes
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: writes are only serialized within one process
+    fcntl = None
+
+DEFAULT_OFFLINE_MESSAGE = '<@{user_id}> is now offline'
+
+# name -> (file, defaults used when the file is missing or invalid)
+CONFIG_FILES = {
+    'ignore': ('ignore.json', {'ignored_user_ids': []}),
+    'watchlist': ('watchlist.json', {
+        'watch_everyone': False,
+        'watched_user_ids': [],
+        'offline_message': DEFAULT_OFFLINE_MESSAGE
+    }),
+    'afk': ('afkchannels.json', {'afk_channel_ids': []}),
+}
+
+
+class ConfigStore:
+    """
+    In-memory view of ignore.json, watchlist.json and afkchannels.json.
+    Lookups go through frozensets (O(1) membership), commands change the files
+    through one serialized writer, and hand edits are picked up by mtime polling.
+    With io (a BlockingIO pool) the writes and the polling run off the event loop.
+    A command's change is applied to the file as it is on disk, under a lock file,
+    so processes sharing the files (clustered mode) never overwrite each other;
+    on_write(name) is called after each such write.
+    """
+
+    def __init__(self, directory='.', io=None):
+        self.directory = directory
+        self.io = io
+        self._raw = {}
+        self._mtimes = {}
+        self._listeners = {name: [] for name in CONFIG_FILES}
+        self._write_lock = None
+        self.on_write = None
+
+        self.ignored_user_ids = frozenset()
+        self.afk_channel_ids = frozenset()
+        self.watched_user_ids = frozenset()
+        self.watch_everyone = False
+        self.offline_message = DEFAULT_OFFLINE_MESSAGE
+
+        for name in CONFIG_FILES:
+            self._load(name)
+
+    def _path(self, name):
+        return os.path.join(self.directory, CONFIG_FILES[name][0])
+
+    def _mtime(self, name):
+        try:
+            return os.stat(self._path(name)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _read(self, name):
+        """Read a config file. Returns (mtime, contents merged over the defaults)."""
+        filename, defaults = CONFIG_FILES[name]
+        mtime = self._mtime(name)
+        try:
+            with open(self._path(name), 'r') as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            logging.warning(f"{filename} not found or invalid, using defaults")
+            data = {}
+        return mtime, {**copy.deepcopy(defaults), **data}
+
+    def _load(self, name):
+        self._mtimes[name], data = self._read(name)
+        self._apply(name, data)
+
+    def _apply(self, name, data):
+        """Swap in new file contents and rebuild the lookup indexes."""
+        self._raw[name] = data
+        if name == 'ignore':
+            self.ignored_user_ids = frozenset(data.get('ignored_user_ids', []))
+        elif name == 'afk':
+            self.afk_channel_ids = frozenset(data.get('afk_channel_ids', []))
+        elif name == 'watchlist':
+            self.watch_everyone = data.get('watch_everyone', False)
+            self.watched_user_ids = frozenset(data.get('watched_user_ids', []))
+            self.offline_message = data.get('offline_message', DEFAULT_OFFLINE_MESSAGE)
+
+    def listen(self, name, callback):
+        """Call callback() whenever the named config changes (command or hand edit)."""
+        self._listeners[name].append(callback)
+
+    def _notify(self, name):
+        for callback in self._listeners[name]:
+            try:
+                callback()
+            except Exception as e:
+                logging.error(f"Error in {name} config listener: {e}")
+
+    def reload_if_changed(self):
+        """Reload any config file whose mtime changed since it was last read. Returns the changed names."""
+        changed = []
+        for name in CONFIG_FILES:
+            if self._mtime(name) != self._mtimes.get(name):
+                self._load(name)
+                logging.info(f"Reloaded {CONFIG_FILES[name][0]} after it changed on disk")
+                changed.append(name)
+        for name in changed:
+            self._notify(name)
+        return changed
+
+    def _read_changed(self):
+        """Stat every config file and read the ones whose mtime changed. Runs in the I/O pool."""
+        return {name: self._read(name) for name in CONFIG_FILES if self._mtime(name) != self._mtimes.get(name)}
+
+    async def reload_if_changed_async(self):
+        """reload_if_changed with the stat and read calls off the event loop."""
+        if self.io is None:
+            return self.reload_if_changed()
+        changed = await self.io.run('config poll', self._read_changed)
+        for name, (mtime, data) in changed.items():
+            self._mtimes[name] = mtime
+            self._apply(name, data)
+            logging.info(f"Reloaded {CONFIG_FILES[name][0]} after it changed on disk")
+        for name in changed:
+            self._notify(name)
+        return list(changed)
+
+    def list_ids(self, name, key):
+        """Return the IDs stored under key in file order (for display)."""
+        return list(self._raw[name].get(key, []))
+
+    async def _update_list(self, name, key, value, add):
+        """Add or remove value in a list-valued key and write the file. Returns False if nothing changed."""
+        if self._write_lock is None:
+            # Created lazily so it binds to the bot's event loop
+            self._write_lock = asyncio.Lock()
+        async with self._write_lock:
+            if self.io is not None:
+                changed, mtime, data = await self.io.run(f"write {CONFIG_FILES[name][0]}", self._modify_file, name, key, value, add)
+            else:
+                changed, mtime, data = await asyncio.get_running_loop().run_in_executor(None, self._modify_file, name, key, value, add)
+            updated = mtime != self._mtimes.get(name)
+            self._mtimes[name] = mtime
+            self._apply(name, data)
+        # Our write, or another process's write found while holding the lock
+        if updated:
+            self._notify(name)
+        if changed and self.on_write is not None:
+            self.on_write(name)
+        return changed
+
+    def _modify_file(self, name, key, value, add):
+        """
+        Read the file, change the list and write it back while holding the lock file.
+        Returns (changed, new mtime, contents); runs in the I/O pool.
+        """
+        with open(self._path(name) + '.lock', 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            # Always re-read: another process may have written since our last read
+            # within the same mtime tick on coarse-grained filesystems
+            mtime, data = self._read(name)
+            values = list(data.get(key, []))
+            if (value in values) == add:
+                return False, mtime, data
+            if add:
+                values.append(value)
+            else:
+                values.remove(value)
+            data[key] = values
+            # The new mtime is recorded so our own write does not look like a hand edit to the poller
+            atomic_write_bytes(self._path(name), json.dumps(data, indent=2).encode('utf-8'))
+            return True, self._mtime(name), data
+
+    async def add_ignored(self, user_id):
+        return await self._update_list('ignore', 'ignored_user_ids', user_id, add=True)
+
+    async def remove_ignored(self, user_id):
+        return await self._update_list('ignore', 'ignored_user_ids', user_id, add=False)
+
+    async def add_watched(self, user_id):
+        return await self._update_list('watchlist', 'watched_user_ids', user_id, add=True)
+
+    async def remove_watched(self, user_id):
+        return await self._update_list('watchlist', 'watched_user_ids', user_id, add=False)
+
+    async def add_afk_channel(self, channel_id):
+        return await self._update_list('afk', 'afk_channel_ids', channel_id, add=True)
+
+    async def remove_afk_channel(self, channel_id):
+        return await self._update_list('afk', 'afk_channel_ids', channel_id, add=False)
@@ -0,0 +1,76 @@
+import asyncio
+import collections
+import json
+import logging
+import time
+from core.persistence import atomic_write_bytes
+
+
+class CooldownStore:
+    """
+    Per-key cooldowns with a TTL, bounded to max_entries (oldest dropped first)
+    and persisted to a small JSON file so they survive restarts.
+    Checks are O(1) dict lookups; the file is only written when a key is marked.
+    """
+
+    def __init__(self, path='cooldowns.json', ttl=86400.0, max_entries=10000, io=None, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.io = io
+        self.clock = clock
+        self.entries = collections.OrderedDict()   # key -> marked_at (epoch seconds), oldest first
+        self._write_lock = None
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            return
+        except json.JSONDecodeError:
+            logging.warning(f"{self.path} is invalid, starting without cooldowns")
+            return
+        for key, marked_at in sorted(stored.items(), key=lambda item: item[1]):
+            self.entries[int(key)] = marked_at
+        self._expire()
+
+    def _expire(self):
+        now = self.clock()
+        while self.entries:
+            key, marked_at = next(iter(self.entries.items()))
+            if now - marked_at < self.ttl and len(self.entries) <= self.max_entries:
+                break
+            del self.entries[key]
+
+    def active(self, key):
+        """True while key is in its cooldown."""
+        marked_at = self.entries.get(key)
+        return marked_at is not None and self.clock() - marked_at < self.ttl
+
+    async def mark(self, key):
+        """Start key's cooldown now and persist it."""
+        self.entries.pop(key, None)
+        self.entries[key] = self.clock()
+        self._expire()
+        await self._save()
+
+    async def clear(self, key):
+        if self.entries.pop(key, None) is not None:
+            await self._save()
+
+    async def _save(self):
+        if self._write_lock is None:
+            # Created lazily so it binds to the bot's event loop
+            self._write_lock = asyncio.Lock()
+        async with self._write_lock:
+            # Serialized after the lock, so the last write always holds the newest state
+            payload = json.dumps({str(key): marked_at for key, marked_at in self.entries.items()}).encode('utf-8')
+            try:
+                if self.io is not None:
+                    await self.io.run(f"write {self.path}", atomic_write_bytes, self.path, payload)
+                else:
+                    await asyncio.get_running_loop().run_in_executor(None, atomic_write_bytes, self.path, payload)
+            except Exception as e:
+                logging.error(f"Could not write {self.path}: {e}")
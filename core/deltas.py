@@ -0,0 +1,96 @@
+import json
+import time
+from core.persistence import WriteBehindStore, atomic_write_bytes
+from core.storage import TrackingStorage
+
+CACHE_DESCRIPTION = "This file stores the previous leaderboard values to show time differences"
+
+
+class DeltaSnapshotStorage(TrackingStorage):
+    """
+    cache.json: the total and rank of every user the last time they were shown
+    on a leaderboard, per guild ({guild_id: {user_id: {'total': s, 'rank': n}}}).
+    """
+
+    name = 'cache'
+
+    def __init__(self, path='cache.json'):
+        self.path = path
+        # What is on disk, only touched by the writer; each write replaces the dirty guilds
+        self._written = {}
+
+    def __str__(self):
+        return self.path
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            data = {}
+        guilds = data.get('guilds', {})
+        self._written = {guild_id: dict(users) for guild_id, users in guilds.items()}
+        return {guild_id: {user_id: dict(entry) for user_id, entry in users.items()} for guild_id, users in guilds.items()}
+
+    def write(self, guild_id, records, removed_ids, full):
+        self._written[guild_id] = records
+        payload = json.dumps({
+            '_description': CACHE_DESCRIPTION,
+            '_last_updated': time.time(),
+            'guilds': self._written,
+        }, separators=(',', ':')).encode('utf-8')
+        atomic_write_bytes(self.path, payload)
+        return len(payload)
+
+    def delete_guild(self, guild_id):
+        self._written.pop(guild_id, None)
+
+
+class LeaderboardDeltas:
+    """
+    Time and rank changes since a user was last shown on the leaderboard.
+    Comparing a page only touches the displayed users, and the snapshot is
+    persisted through the same coalesced write-behind store as voice tracking.
+    """
+
+    def __init__(self, path='cache.json', flush_window=2.0, io=None):
+        self.storage = DeltaSnapshotStorage(path)
+        self.snapshots = self.storage.load()
+        self.store = WriteBehindStore(self.storage, lambda: self.snapshots, flush_window=flush_window, io=io)
+
+    def compare(self, guild_id, ranked_totals):
+        """
+        ranked_totals is [(rank, user_id, total_seconds)] for the displayed users.
+        Returns {user_id: (seconds gained or None if new, ranks climbed)} and
+        stores the new values as the users' snapshot.
+        """
+        guild_id = str(guild_id)
+        snapshot = self.snapshots.setdefault(guild_id, {})
+        deltas = {}
+        for rank, user_id, total in ranked_totals:
+            previous = snapshot.get(user_id)
+            if previous is None:
+                deltas[user_id] = (None, 0)
+            else:
+                gained = total - previous['total']
+                if gained < 0:
+                    # The counters were reset since the last post
+                    gained = total
+                deltas[user_id] = (gained, previous['rank'] - rank)
+            snapshot[user_id] = {'total': round(total), 'rank': rank}
+        if ranked_totals:
+            self.store.mark_dirty(guild_id, *(user_id for _rank, user_id, _total in ranked_totals))
+        return deltas
+
+    def forget(self, guild_id, *user_ids):
+        """Drop users from the snapshot (ignored or deleted users)."""
+        snapshot = self.snapshots.get(str(guild_id), {})
+        removed = [user_id for user_id in user_ids if snapshot.pop(user_id, None) is not None]
+        if removed:
+            self.store.mark_dirty(guild_id, *removed)
+
+    async def flush_async(self):
+        await self.store.flush_async()
+
+    def flush(self):
+        self.store.flush()
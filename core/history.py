@@ -0,0 +1,257 @@
+import bisect
+import logging
+import os
+import struct
+import threading
+from array import array
+from core.persistence import atomic_write_bytes
+
+# File layout: an 8 byte header followed by fixed-width day blocks.
+# Each block is (user_id u64, day u32, 24 x u16 seconds per hour), little endian.
+HEADER = struct.Struct('<4sHH')
+MAGIC = b'VHST'
+VERSION = 1
+HOURS_PER_BLOCK = 24
+BLOCK = struct.Struct(f'<QI{HOURS_PER_BLOCK}H')
+SECONDS_PER_HOUR = 3600
+
+
+class HistoryArchive:
+    """
+    Hourly voice time history, one file per guild (history/<guild_id>.bin).
+    Every user has one 24-slot array('H') per day they were in voice, so a
+    year of data for thousands of users stays a few megabytes. Flushes only
+    rewrite the blocks that changed, in place. Range totals over whole days come
+    from per-user prefix sums, rebuilt lazily for users that changed.
+    Buckets hold whole seconds; the sub-second part of each accrued segment is
+    carried per (user, hour) and rounded in once the hour is over, so many short
+    segments don't lose time to rounding.
+    """
+
+    def __init__(self, directory='history'):
+        self.directory = directory
+        self.guilds = {}    # guild_id -> {user_id: {day: array('H')}}
+        self.offsets = {}   # guild_id -> {(user_id, day): block index in the file}
+        self.dirty = {}     # guild_id -> {(user_id, day)}
+        self.rollups = {}   # guild_id -> {user_id: (sorted days, prefix sums of daily totals)}
+        self.fractions = {} # guild_id -> {(user_id, hour): seconds below one not yet in the bucket}
+        self.latest_hour = 0
+        self._write_lock = threading.Lock()
+        self._load()
+
+    def __str__(self):
+        return self.directory
+
+    def _path(self, guild_id):
+        return os.path.join(self.directory, f"{guild_id}.bin")
+
+    def _load(self):
+        if not os.path.isdir(self.directory):
+            return
+        for filename in os.listdir(self.directory):
+            guild_id, ext = os.path.splitext(filename)
+            if ext != '.bin' or not guild_id.isdigit():
+                continue
+            try:
+                self._load_guild(guild_id)
+            except (OSError, ValueError, struct.error) as e:
+                logging.warning(f"Could not read voice history {filename}: {e}")
+
+    def _load_guild(self, guild_id):
+        with open(self._path(guild_id), 'rb') as f:
+            payload = f.read()
+        magic, version, hours = HEADER.unpack_from(payload)
+        if magic != MAGIC or version != VERSION or hours != HOURS_PER_BLOCK:
+            raise ValueError(f"unsupported history format {magic!r} v{version}")
+        body = memoryview(payload)[HEADER.size:]
+        # A torn block at the end of the file (crash mid-append) is dropped
+        usable = len(body) - len(body) % BLOCK.size
+        users = self.guilds.setdefault(guild_id, {})
+        offsets = self.offsets.setdefault(guild_id, {})
+        for index, block in enumerate(BLOCK.iter_unpack(body[:usable])):
+            user_id, day = block[0], block[1]
+            users.setdefault(user_id, {})[day] = array('H', block[2:])
+            offsets[(user_id, day)] = index
+
+    def record(self, guild_id, user_id, start_ts, end_ts):
+        """Add the voice time between two timestamps to the hourly buckets it falls into."""
+        if end_ts <= start_ts:
+            return
+        guild_id = str(guild_id)
+        user_id = int(user_id)
+        days = self.guilds.setdefault(guild_id, {}).setdefault(user_id, {})
+        dirty = self.dirty.setdefault(guild_id, set())
+        fractions = self.fractions.setdefault(guild_id, {})
+        self.rollups.get(guild_id, {}).pop(user_id, None)
+        hour = int(start_ts // SECONDS_PER_HOUR)
+        while start_ts < end_ts:
+            hour_end = (hour + 1) * SECONDS_PER_HOUR
+            seconds = min(end_ts, hour_end) - start_ts + fractions.pop((user_id, hour), 0.0)
+            whole = int(seconds)
+            if seconds > whole:
+                fractions[(user_id, hour)] = seconds - whole
+            day, slot = divmod(hour, HOURS_PER_BLOCK)
+            buckets = days.get(day)
+            if buckets is None:
+                buckets = days[day] = array('H', bytes(2 * HOURS_PER_BLOCK))
+            buckets[slot] = min(SECONDS_PER_HOUR, buckets[slot] + whole)
+            dirty.add((user_id, day))
+            self.latest_hour = max(self.latest_hour, hour)
+            start_ts = hour_end
+            hour += 1
+
+    def _settle_fractions(self):
+        """Round the carried sub-second parts of past hours into their buckets."""
+        for guild_id, fractions in self.fractions.items():
+            past = [key for key in fractions if key[1] < self.latest_hour]
+            if not past:
+                continue
+            users = self.guilds[guild_id]
+            dirty = self.dirty.setdefault(guild_id, set())
+            for user_id, hour in past:
+                if fractions.pop((user_id, hour)) >= 0.5:
+                    day, slot = divmod(hour, HOURS_PER_BLOCK)
+                    buckets = users[user_id][day]
+                    buckets[slot] = min(SECONDS_PER_HOUR, buckets[slot] + 1)
+                    dirty.add((user_id, day))
+                    self.rollups.get(guild_id, {}).pop(user_id, None)
+
+    def user_daily(self, guild_id, user_id, start_ts, end_ts):
+        """Return [(day, seconds)] for one user between two timestamps, oldest first."""
+        days = self.guilds.get(str(guild_id), {}).get(int(user_id), {})
+        first_hour = int(start_ts // SECONDS_PER_HOUR)
+        last_hour = int(-(-end_ts // SECONDS_PER_HOUR))  # exclusive
+        first_day = first_hour // HOURS_PER_BLOCK
+        last_day = (last_hour - 1) // HOURS_PER_BLOCK
+        if last_day - first_day + 1 < len(days):
+            candidate_days = (day for day in range(first_day, last_day + 1) if day in days)
+        else:
+            candidate_days = sorted(day for day in days if first_day <= day <= last_day)
+        result = []
+        for day in candidate_days:
+            day_start = day * HOURS_PER_BLOCK
+            lo = max(first_hour - day_start, 0)
+            hi = min(last_hour - day_start, HOURS_PER_BLOCK)
+            seconds = sum(days[day][lo:hi])
+            if seconds:
+                result.append((day, seconds))
+        return result
+
+    def _rollup(self, guild_id, user_id, days):
+        rollups = self.rollups.setdefault(guild_id, {})
+        rollup = rollups.get(user_id)
+        if rollup is None:
+            sorted_days = array('I', sorted(days))
+            prefix = array('Q', [0])
+            for day in sorted_days:
+                prefix.append(prefix[-1] + sum(days[day]))
+            rollup = rollups[user_id] = (sorted_days, prefix)
+        return rollup
+
+    def _range_total(self, guild_id, user_id, days, first_hour, last_hour):
+        first_day, lo = divmod(first_hour, HOURS_PER_BLOCK)
+        last_day, hi = divmod(last_hour - 1, HOURS_PER_BLOCK)
+        if first_day == last_day:
+            buckets = days.get(first_day)
+            return sum(buckets[lo:hi + 1]) if buckets is not None else 0
+        # Partial first and last day from the buckets, whole days in between from the prefix sums
+        total = 0
+        if first_day in days:
+            total += sum(days[first_day][lo:])
+        if last_day in days:
+            total += sum(days[last_day][:hi + 1])
+        sorted_days, prefix = self._rollup(guild_id, user_id, days)
+        i = bisect.bisect_right(sorted_days, first_day)
+        j = bisect.bisect_left(sorted_days, last_day)
+        if j > i:
+            total += prefix[j] - prefix[i]
+        return total
+
+    def user_total(self, guild_id, user_id, start_ts, end_ts):
+        """Total seconds a user spent in tracked voice between two timestamps."""
+        guild_id = str(guild_id)
+        days = self.guilds.get(guild_id, {}).get(int(user_id))
+        if not days or end_ts <= start_ts:
+            return 0
+        first_hour = int(start_ts // SECONDS_PER_HOUR)
+        last_hour = int(-(-end_ts // SECONDS_PER_HOUR))  # exclusive
+        return self._range_total(guild_id, int(user_id), days, first_hour, last_hour)
+
+    def top(self, guild_id, start_ts, end_ts, limit=None, exclude_ids=()):
+        """Return [(user_id, seconds)] ordered by time in the range, highest first."""
+        guild_id = str(guild_id)
+        if end_ts <= start_ts:
+            return []
+        first_hour = int(start_ts // SECONDS_PER_HOUR)
+        last_hour = int(-(-end_ts // SECONDS_PER_HOUR))
+        totals = []
+        for user_id, days in self.guilds.get(guild_id, {}).items():
+            if user_id in exclude_ids:
+                continue
+            seconds = self._range_total(guild_id, user_id, days, first_hour, last_hour)
+            if seconds:
+                totals.append((user_id, seconds))
+        totals.sort(key=lambda item: item[1], reverse=True)
+        return totals[:limit] if limit is not None else totals
+
+    def take_snapshot(self):
+        """Pack the changed blocks on the event loop; returns work for write()."""
+        self._settle_fractions()
+        writes = []
+        for guild_id, keys in self.dirty.items():
+            users = self.guilds[guild_id]
+            offsets = self.offsets.setdefault(guild_id, {})
+            fractions = self.fractions.get(guild_id, {})
+            blocks = []
+            for user_id, day in keys:
+                index = offsets.get((user_id, day))
+                if index is None:
+                    index = offsets[(user_id, day)] = len(offsets)
+                buckets = users[user_id][day]
+                first_hour = day * HOURS_PER_BLOCK
+                if first_hour <= self.latest_hour < first_hour + HOURS_PER_BLOCK and fractions.get((user_id, self.latest_hour), 0) >= 0.5:
+                    # The running hour is written rounded; memory keeps the exact carry
+                    buckets = array('H', buckets)
+                    slot = self.latest_hour - first_hour
+                    buckets[slot] = min(SECONDS_PER_HOUR, buckets[slot] + 1)
+                blocks.append((index, BLOCK.pack(user_id, day, *buckets)))
+            blocks.sort()
+            writes.append((guild_id, blocks, keys))
+        self.dirty = {}
+        return writes
+
+    def restore_dirty(self, writes):
+        """Mark the blocks of a snapshot whose write failed as changed again, so the next flush rewrites them."""
+        for guild_id, _blocks, keys in writes:
+            self.dirty.setdefault(guild_id, set()).update(keys)
+
+    def write(self, writes):
+        """Write packed blocks to their slots, appending new ones. Returns bytes written."""
+        written = 0
+        with self._write_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            for guild_id, blocks, _keys in writes:
+                path = self._path(guild_id)
+                if not os.path.exists(path):
+                    atomic_write_bytes(path, HEADER.pack(MAGIC, VERSION, HOURS_PER_BLOCK))
+                with open(path, 'r+b') as f:
+                    for index, payload in blocks:
+                        f.seek(HEADER.size + index * BLOCK.size)
+                        f.write(payload)
+                        written += len(payload)
+                    f.flush()
+                    os.fsync(f.fileno())
+        return written
+
+    def flush(self):
+        """Synchronously write every changed block."""
+        writes = self.take_snapshot()
+        try:
+            return self.write(writes)
+        except Exception:
+            self.restore_dirty(writes)
+            raise
+
+    def stats(self):
+        blocks = sum(len(offsets) for offsets in self.offsets.values())
+        return {'guilds': len(self.guilds), 'blocks': blocks, 'bytes': blocks * BLOCK.size}
@@ -0,0 +1,144 @@
+import glob
+import json
+import logging
+import os
+import time
+
+# Operations that apply to every record of a guild and are journaled as a single entry
+BULK_OPS = ('reset', 'accrue')
+
+# Entries written before tracking was partitioned by guild belong to the legacy partition
+LEGACY_GUILD_KEY = '0'
+
+
+def apply_entry(data, entry):
+    """
+    Apply one journal entry to the per-guild tracking dictionary ({guild_id: {user_id: record}}).
+    Per-user entries carry the record's resulting state and 'accrue' is guarded
+    by the join times, so replaying them over a snapshot that already contains
+    them changes nothing. 'reset' is not: replay skips covered segments instead.
+    """
+    op = entry.get('op')
+    guild_tracking = data.setdefault(entry.get('guild_id', LEGACY_GUILD_KEY), {})
+    if op == 'reset':
+        for time_data in guild_tracking.values():
+            time_data['total_time'] = 0
+    elif op == 'accrue':
+        ts = entry['ts']
+        for time_data in guild_tracking.values():
+            if time_data.get('in_voice', False) and time_data.get('join_time', ts) < ts:
+                time_data['total_time'] += ts - time_data['join_time']
+                time_data['join_time'] = ts
+    elif 'user_id' in entry:
+        record = entry.get('record')
+        if record is None:
+            guild_tracking.pop(entry['user_id'], None)
+        else:
+            guild_tracking[entry['user_id']] = dict(record)
+
+
+class VoiceJournal:
+    """
+    Append-only NDJSON journal of voice tracking transitions.
+    Compaction rotates the live file into a numbered segment; segments are
+    deleted once a snapshot containing them has been written. The last segment
+    a snapshot covers is recorded first (path.covered), so segments left behind
+    by a crash during deletion are not replayed a second time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.covered_path = path + '.covered'
+        self.entries = 0
+        self._file = None
+        self._next_segment = max(self._segment_ids() + [self.covered()], default=0) + 1
+
+    def _segment_path(self, segment_id):
+        return f"{self.path}.{segment_id:08d}"
+
+    def _segment_ids(self):
+        ids = []
+        for segment_path in glob.glob(glob.escape(self.path) + '.*'):
+            suffix = segment_path[len(self.path) + 1:]
+            if suffix.isdigit():
+                ids.append(int(suffix))
+        return sorted(ids)
+
+    def _open(self):
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+
+    def append(self, op, guild_id, user_id=None, record=None, ts=None):
+        """Append one transition as a single line write."""
+        entry = {'ts': ts if ts is not None else time.time(), 'op': op, 'guild_id': guild_id}
+        if user_id is not None:
+            entry['user_id'] = user_id
+            entry['record'] = record
+        self._open()
+        self._file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        self._file.flush()
+        self.entries += 1
+
+    def rotate(self):
+        """Close the live journal and move it to a new segment. Returns the segment id."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        segment_id = self._next_segment
+        self._next_segment += 1
+        if os.path.exists(self.path):
+            os.replace(self.path, self._segment_path(segment_id))
+        self.entries = 0
+        return segment_id
+
+    def covered(self):
+        """Id of the last segment a written snapshot contains (0 when none was recorded)."""
+        try:
+            with open(self.covered_path, 'r') as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def discard_through(self, segment_id):
+        """Delete every segment up to and including segment_id (they are covered by a snapshot)."""
+        temp_path = self.covered_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            f.write(str(segment_id))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.covered_path)
+        for existing_id in self._segment_ids():
+            if existing_id <= segment_id:
+                try:
+                    os.remove(self._segment_path(existing_id))
+                except OSError as e:
+                    logging.warning(f"Could not remove journal segment {existing_id}: {e}")
+
+    def replay(self, data):
+        """Apply the segments no snapshot covers and the live journal to data in order. Returns the number of entries applied."""
+        covered = self.covered()
+        paths = [self._segment_path(segment_id) for segment_id in self._segment_ids() if segment_id > covered]
+        paths.append(self.path)
+        applied = 0
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                for line_number, line in enumerate(f, 1):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A crash mid-write leaves at most one torn line at the end
+                        logging.warning(f"Skipping corrupt journal line {line_number} in {path}")
+                        continue
+                    apply_entry(data, entry)
+                    applied += 1
+        return applied
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
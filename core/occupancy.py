@@ -0,0 +1,85 @@
+class OccupancyIndex:
+    """
+    In-memory index of voice channel rosters, kept up to date from voice state events.
+    For every channel it holds the non-ignored members and the subset that can be
+    tracked (not both muted and deafened), so a voice event costs O(1) instead of a
+    scan of every channel's members.
+    """
+
+    def __init__(self):
+        self.rosters = {}         # channel_id -> {member_id}
+        self.trackable = {}       # channel_id -> {member_id} not muted AND deafened
+        self.member_channel = {}  # (guild_id, member_id) -> channel_id
+        self.names = {}           # member_id -> username, for records created from the index
+
+    def roster_size(self, channel_id, exclude_member_id=None):
+        roster = self.rosters.get(channel_id, ())
+        return len(roster) - (1 if exclude_member_id in roster else 0)
+
+    def trackable_count(self, channel_id):
+        return len(self.trackable.get(channel_id, ()))
+
+    def should_track(self, channel_id, member_id):
+        """A member is tracked when they are trackable and share the channel with another trackable member."""
+        trackable = self.trackable.get(channel_id, ())
+        return member_id in trackable and len(trackable) >= 2
+
+    def _remove(self, channel_id, member_id):
+        for index in (self.rosters, self.trackable):
+            members = index.get(channel_id)
+            if members is not None:
+                members.discard(member_id)
+                if not members:
+                    del index[channel_id]
+
+    def _add(self, channel_id, member_id, trackable):
+        self.rosters.setdefault(channel_id, set()).add(member_id)
+        if trackable:
+            self.trackable.setdefault(channel_id, set()).add(member_id)
+
+    def move(self, guild_id, member_id, name, channel_id, trackable):
+        """
+        Record that a member is now in channel_id (None when they left voice).
+        Returns the (member_id, channel_id) pairs whose should-track state may have
+        flipped: the member themselves, plus every trackable member of a channel
+        whose trackable count crossed the two-member threshold.
+        """
+        key = (guild_id, member_id)
+        old_channel_id = self.member_channel.get(key)
+        affected = {c for c in (old_channel_id, channel_id) if c is not None}
+        counts_before = {c: self.trackable_count(c) for c in affected}
+
+        if old_channel_id is not None:
+            self._remove(old_channel_id, member_id)
+        if channel_id is not None:
+            self._add(channel_id, member_id, trackable)
+            self.member_channel[key] = channel_id
+            self.names[member_id] = name
+        else:
+            self.member_channel.pop(key, None)
+
+        candidates = {(member_id, channel_id)}
+        for c in affected:
+            if (counts_before[c] >= 2) != (self.trackable_count(c) >= 2):
+                candidates.update((other_id, c) for other_id in self.trackable.get(c, ()))
+        return candidates
+
+    def reset_channel(self, guild_id, channel_id, members):
+        """Replace a channel's roster from a live scan. members is an iterable of (member_id, name, trackable)."""
+        for member_id in list(self.rosters.get(channel_id, ())):
+            if self.member_channel.get((guild_id, member_id)) == channel_id:
+                del self.member_channel[(guild_id, member_id)]
+        self.rosters.pop(channel_id, None)
+        self.trackable.pop(channel_id, None)
+        for member_id, name, trackable in members:
+            old_channel_id = self.member_channel.get((guild_id, member_id))
+            if old_channel_id is not None and old_channel_id != channel_id:
+                self._remove(old_channel_id, member_id)
+            self._add(channel_id, member_id, trackable)
+            self.member_channel[(guild_id, member_id)] = channel_id
+            self.names[member_id] = name
+
+    def clear(self):
+        self.rosters.clear()
+        self.trackable.clear()
+        self.member_channel.clear()
@@ -0,0 +1,181 @@
+import asyncio
+import collections
+import logging
+import time
+import discord
+
+# Discord's message length limit
+MESSAGE_LIMIT = 2000
+
+
+class OutboundMessage:
+    __slots__ = ('content', 'coalesce', 'queued_at', 'future')
+
+    def __init__(self, content, coalesce, queued_at, future):
+        self.content = content
+        self.coalesce = coalesce
+        self.queued_at = queued_at
+        self.future = future
+
+
+def pack_lines(lines, limit=MESSAGE_LIMIT):
+    """Pack lines into as few messages of at most limit characters as possible (overlong lines are split)."""
+    chunks = []
+    current = ''
+    for line in lines:
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ''
+            chunks.append(line[:limit])
+            line = line[limit:]
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) > limit:
+            chunks.append(current)
+            current = line
+        else:
+            current = candidate
+    if current.strip():
+        chunks.append(current)
+    return chunks
+
+
+class Outbox:
+    """
+    Per-channel send queues. Callers enqueue and return immediately; one worker per
+    channel delivers the queue in order. Notices queued with coalesce=True within
+    coalesce_window seconds are merged into one message, chunked output is packed up
+    to the message size limit, and each channel stays within Discord's per-channel
+    bucket of rate messages per `per` seconds instead of running into 429 backoffs.
+    """
+
+    def __init__(self, coalesce_window=0.5, rate=5, per=5.0, max_pending=100, clock=time.monotonic):
+        self.coalesce_window = coalesce_window
+        self.rate = rate
+        self.per = per
+        self.max_pending = max_pending
+        self.clock = clock
+        self.queues = {}    # channel_id -> deque of OutboundMessage
+        self.workers = {}   # channel_id -> task draining the queue
+        self.sent = {}      # channel_id -> deque of recent send times (rate limit window)
+
+        self.messages_sent = 0
+        self.items_coalesced = 0
+        self.rate_limit_waits = 0
+        self.dropped = 0
+        self.failures = 0
+
+    def send(self, channel, content, coalesce=False):
+        """Queue a message for channel. Returns a future resolving to the sent discord.Message."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        # Nobody has to await the future; retrieve failures so they are not reported as unhandled
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        queue = self.queues.setdefault(channel.id, collections.deque())
+        if len(queue) >= self.max_pending:
+            # Drop the oldest queued message rather than growing without bound
+            dropped = queue.popleft()
+            dropped.future.cancel()
+            self.dropped += 1
+            logging.warning(f"Outbox: dropped a queued message for channel {channel.id} ({self.max_pending} pending)")
+        queue.append(OutboundMessage(content, coalesce, self.clock(), future))
+        if channel.id not in self.workers:
+            self._expire_history()
+            self.workers[channel.id] = loop.create_task(self._drain(channel))
+        return future
+
+    def send_lines(self, channel, lines):
+        """Queue lines packed into as few messages as possible. Returns the future of the last message."""
+        future = None
+        for chunk in pack_lines(lines):
+            future = self.send(channel, chunk)
+        return future
+
+    def _next_message(self, queue):
+        """Pop the head of the queue, merged with the coalescible notices right behind it."""
+        head = queue.popleft()
+        content = head.content
+        futures = [head.future]
+        if head.coalesce:
+            while queue and queue[0].coalesce and len(content) + 1 + len(queue[0].content) <= MESSAGE_LIMIT:
+                item = queue.popleft()
+                content += '\n' + item.content
+                futures.append(item.future)
+                self.items_coalesced += 1
+        return content, futures
+
+    def _expire_history(self):
+        """Forget the send times of idle channels once all of them are outside the rate window."""
+        cutoff = self.clock() - self.per
+        for channel_id in [channel_id for channel_id, recent in self.sent.items()
+                           if channel_id not in self.workers and (not recent or recent[-1] <= cutoff)]:
+            del self.sent[channel_id]
+
+    async def _wait_for_slot(self, channel_id):
+        # The history outlives the channel's worker, so a burst right after a drain is still limited
+        recent = self.sent.setdefault(channel_id, collections.deque(maxlen=self.rate))
+        cutoff = self.clock() - self.per
+        while recent and recent[0] <= cutoff:
+            recent.popleft()
+        if len(recent) == self.rate:
+            wait = recent[0] + self.per - self.clock()
+            if wait > 0:
+                self.rate_limit_waits += 1
+                await asyncio.sleep(wait)
+        recent.append(self.clock())
+
+    async def _drain(self, channel):
+        queue = self.queues[channel.id]
+        try:
+            while queue:
+                head = queue[0]
+                if head.coalesce:
+                    # Give notices for the same channel a moment to arrive and be merged
+                    wait = head.queued_at + self.coalesce_window - self.clock()
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                    if not queue:
+                        break
+                content, futures = self._next_message(queue)
+                await self._wait_for_slot(channel.id)
+                try:
+                    message = await self._deliver(channel, content)
+                except Exception as e:
+                    self.failures += 1
+                    logging.error(f"Outbox: could not send to channel {channel.id}: {e}")
+                    for future in futures:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                self.messages_sent += 1
+                for future in futures:
+                    if not future.done():
+                        future.set_result(message)
+        finally:
+            self.workers.pop(channel.id, None)
+            if not queue:
+                self.queues.pop(channel.id, None)
+
+    async def _deliver(self, channel, content):
+        try:
+            return await channel.send(content)
+        except discord.RateLimited as e:
+            # discord.py gave up waiting on a long rate limit - wait it out once and retry
+            self.rate_limit_waits += 1
+            await asyncio.sleep(e.retry_after)
+            return await channel.send(content)
+
+    async def flush(self):
+        """Wait until every queued message has been sent (used on shutdown)."""
+        while self.workers:
+            await asyncio.gather(*self.workers.values(), return_exceptions=True)
+
+    def stats(self):
+        return {
+            'pending': sum(len(queue) for queue in self.queues.values()),
+            'sent': self.messages_sent,
+            'coalesced': self.items_coalesced,
+            'rate_limit_waits': self.rate_limit_waits,
+            'dropped': self.dropped,
+            'failures': self.failures,
+        }
@@ -0,0 +1,252 @@
+import asyncio
+import collections
+import logging
+import os
+import tempfile
+import threading
+import time
+from core.journal import BULK_OPS
+
+
+def atomic_write_bytes(path, payload):
+    """Write bytes to a temporary file next to path and rename it into place."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class FlushError(Exception):
+    """A snapshot could not be written; guild_ids have to be rewritten by a later flush."""
+
+    def __init__(self, guild_ids, error):
+        super().__init__(f"{error} ({len(guild_ids)} guilds)")
+        self.guild_ids = guild_ids
+
+
+class WriteBehindStore:
+    """
+    Write-behind persistence for the per-guild voice tracking dictionary
+    ({guild_id: {user_id: record}}).
+    Mutations only mark records dirty; every mutation inside the flush window is
+    written to the storage backend by a single background flush off the event loop,
+    and guilds without changes are not serialized at all.
+    With a journal attached, each transition is appended to the journal instead and
+    the snapshot is only rewritten (compacting the journal) every compact_every entries.
+    Writes go through io (a BlockingIO pool) when one is given, else the default executor.
+    They are waited for up to write_timeout seconds (0: until done) rather than the pool's
+    default, since a write given up on keeps running and a retry would queue behind it.
+    """
+
+    def __init__(self, storage, get_data, flush_window=2.0, journal=None, compact_every=1000, io=None, write_timeout=0):
+        self.storage = storage
+        self.io = io
+        self.write_timeout = write_timeout
+        self.get_data = get_data
+        self.flush_window = flush_window
+        self.journal = journal
+        self.compact_every = compact_every
+
+        self.dirty = {}              # guild_id -> {user_id}
+        self.all_dirty = set()       # guild_ids that must be rewritten completely
+        self._last_ids = {guild_id: set(users) for guild_id, users in get_data().items()}
+        self._flush_handle = None
+        self._flush_task = None
+        self._write_lock = threading.Lock()
+        self._snapshot_seq = 0
+        # Snapshots waiting to be written, oldest first; writers drain them in order
+        self._pending = collections.deque()
+
+        # Metrics
+        self.started_at = time.monotonic()
+        # Optional callback(duration_seconds, bytes_written) after every snapshot write (called from the writer thread)
+        self.on_flush = None
+        self.mutations = 0
+        self.flushes = 0
+        self.bytes_written = 0
+        self.records_flushed = 0
+        self.last_flush_duration = 0.0
+
+    @property
+    def is_dirty(self):
+        return bool(self.all_dirty) or bool(self.dirty)
+
+    def mark_dirty(self, guild_id, *user_ids):
+        """Mark records of a guild as changed and schedule a coalesced flush. No IDs marks the whole guild."""
+        self.mutations += 1
+        guild_id = str(guild_id)
+        if user_ids:
+            self.dirty.setdefault(guild_id, set()).update(str(user_id) for user_id in user_ids)
+        else:
+            self.all_dirty.add(guild_id)
+        if self.journal is None or self.journal.entries >= self.compact_every:
+            self._schedule()
+
+    def mark_all_dirty(self):
+        """Force every guild to be rewritten by the next flush."""
+        self.all_dirty.update(self.get_data())
+
+    def record(self, op, guild_id, *user_ids, ts=None):
+        """Journal a tracking transition and mark the affected records dirty."""
+        guild_id = str(guild_id)
+        if self.journal is not None:
+            guild_tracking = self.get_data().get(guild_id, {})
+            if op in BULK_OPS:
+                self.journal.append(op, guild_id, ts=ts)
+            else:
+                for user_id in user_ids:
+                    record = guild_tracking.get(user_id)
+                    self.journal.append(op, guild_id, user_id, dict(record) if record is not None else None, ts=ts)
+        self.mark_dirty(guild_id, *user_ids)
+
+    def _schedule(self):
+        if self._flush_handle is not None or self._flush_task is not None:
+            # A flush is already pending; it picks up these changes
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop (startup/shutdown) - write synchronously
+            self.flush()
+            return
+        self._flush_handle = loop.call_later(self.flush_window, self._start_flush)
+
+    def _start_flush(self):
+        self._flush_handle = None
+        self._flush_task = asyncio.ensure_future(self._flush_in_background())
+
+    def _take_snapshot(self):
+        """Copy the changed records of each dirty guild on the event loop so the write can happen in a worker thread."""
+        data = self.get_data()
+        guild_writes = []
+        for guild_id in set(self.dirty) | self.all_dirty:
+            guild_tracking = data.get(guild_id, {})
+            dirty_ids = self.dirty.get(guild_id, set())
+            last_ids = self._last_ids.setdefault(guild_id, set())
+            full = guild_id in self.all_dirty or self.storage.needs_full_snapshot
+            if full:
+                if getattr(self.storage, 'accepts_columnar', False) and hasattr(guild_tracking, 'snapshot'):
+                    # Array copies instead of one dict per user
+                    records = guild_tracking.snapshot()
+                else:
+                    records = {user_id: dict(record) for user_id, record in guild_tracking.items()}
+                removed_ids = last_ids - set(guild_tracking)
+                self._last_ids[guild_id] = set(guild_tracking)
+                dirty_count = len(guild_tracking) if guild_id in self.all_dirty else len(dirty_ids)
+            else:
+                records = {user_id: dict(guild_tracking[user_id]) for user_id in dirty_ids if user_id in guild_tracking}
+                removed_ids = {user_id for user_id in dirty_ids if user_id not in guild_tracking}
+                last_ids.update(records)
+                last_ids.difference_update(removed_ids)
+                dirty_count = len(dirty_ids)
+            guild_writes.append((guild_id, records, removed_ids, full, dirty_count))
+        self.dirty.clear()
+        self.all_dirty.clear()
+        self._snapshot_seq += 1
+        # Everything journaled so far is contained in this snapshot
+        segment_id = self.journal.rotate() if self.journal is not None else None
+        self._pending.append((self._snapshot_seq, guild_writes, segment_id))
+        return self._snapshot_seq
+
+    def _write(self, seq):
+        """Write every pending snapshot up to seq, in order. A snapshot already written by another writer is skipped."""
+        with self._write_lock:
+            while self._pending and self._pending[0][0] <= seq:
+                _seq, guild_writes, segment_id = self._pending.popleft()
+                start = time.perf_counter()
+                written = 0
+                dirty_count = 0
+                try:
+                    for guild_id, records, removed_ids, full, guild_dirty_count in guild_writes:
+                        written += self.storage.write(guild_id, records, removed_ids, full)
+                        dirty_count += guild_dirty_count
+                except Exception as e:
+                    # The dirty sets belong to the event loop; the caller marks these guilds for the next flush
+                    raise FlushError([guild_write[0] for guild_write in guild_writes], e) from e
+                if segment_id is not None:
+                    self.journal.discard_through(segment_id)
+                self.last_flush_duration = time.perf_counter() - start
+                self.flushes += 1
+                self.bytes_written += written
+                self.records_flushed += dirty_count
+                if self.on_flush is not None:
+                    self.on_flush(self.last_flush_duration, written)
+                logging.debug(f"Flushed {dirty_count} dirty records in {len(guild_writes)} guilds to {self.storage} ({written} bytes, {self.last_flush_duration * 1000:.1f}ms)")
+
+    async def _flush_in_background(self):
+        try:
+            if not self.is_dirty:
+                return
+            await self._write_async(self._take_snapshot())
+        except Exception as e:
+            logging.error(f"Background flush to {self.storage} failed: {e}")
+        finally:
+            self._flush_task = None
+        if self.is_dirty and (self.journal is None or self.journal.entries >= self.compact_every):
+            self._schedule()
+
+    def flush(self, full=False):
+        """Synchronously write pending changes now (used when no event loop is available). full rewrites every guild."""
+        if full:
+            self.mark_all_dirty()
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        try:
+            self._write(self._take_snapshot())
+        except FlushError as e:
+            # Force the next flush to rewrite the affected guilds
+            self.all_dirty.update(e.guild_ids)
+            raise
+
+    async def flush_async(self):
+        """Wait for any in-flight flush, then write the current state. Used on shutdown, !restart and !update."""
+        if self._flush_task is not None:
+            await asyncio.shield(self._flush_task)
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        await self._write_async(self._take_snapshot())
+
+    async def _write_async(self, seq):
+        try:
+            if self.io is not None:
+                await self.io.run(f"flush {self.storage}", self._write, seq, timeout=self.write_timeout)
+            else:
+                await asyncio.get_running_loop().run_in_executor(None, self._write, seq)
+        except FlushError as e:
+            # Back on the loop: force the next flush to rewrite the affected guilds
+            self.all_dirty.update(e.guild_ids)
+            raise
+
+    def drop_guild(self, guild_id):
+        """Remove a whole partition from memory and storage (used when migrating legacy data)."""
+        guild_id = str(guild_id)
+        self.get_data().pop(guild_id, None)
+        self.dirty.pop(guild_id, None)
+        self.all_dirty.discard(guild_id)
+        self._last_ids.pop(guild_id, None)
+        with self._write_lock:
+            self.storage.delete_guild(guild_id)
+
+    def stats(self):
+        """Return flush counters for logging."""
+        elapsed_minutes = max((time.monotonic() - self.started_at) / 60, 1e-9)
+        return {
+            'mutations': self.mutations,
+            'flushes': self.flushes,
+            'flush_rate_per_min': self.flushes / elapsed_minutes,
+            'bytes_written': self.bytes_written,
+            'records_flushed': self.records_flushed,
+            'last_flush_ms': self.last_flush_duration * 1000,
+        }
@@ -0,0 +1,64 @@
+import time
+
+OFFLINE_STATUSES = frozenset({'offline', 'invisible'})
+
+
+class PresenceEntry:
+    __slots__ = ('status', 'last_active')
+
+    def __init__(self, status, last_active=None):
+        self.status = status
+        self.last_active = last_active  # last message or reaction seen from the user
+
+
+class PresenceIndex:
+    """
+    Status of watched users only, fed by on_presence_update: {user_id: PresenceEntry}.
+    Presence is per user, not per guild, so the same update arriving from several
+    guilds is applied once. A user the index has not seen yet is unknown (None),
+    and callers fall back to the member cache for them.
+    """
+
+    def __init__(self, is_watched, clock=time.time):
+        self.is_watched = is_watched
+        self.clock = clock
+        self.entries = {}
+
+    def update(self, user_id, status):
+        """Record a status. Returns the previous status if it changed, else None (also for unwatched users)."""
+        if not self.is_watched(user_id):
+            return None
+        status = str(status)
+        entry = self.entries.get(user_id)
+        if entry is None:
+            self.entries[user_id] = PresenceEntry(status)
+            return None
+        if entry.status == status:
+            return None
+        previous = entry.status
+        entry.status = status
+        return previous
+
+    def touch(self, user_id):
+        """Note that a user just sent a message or reaction."""
+        entry = self.entries.get(user_id)
+        if entry is not None:
+            entry.last_active = self.clock()
+
+    def status(self, user_id):
+        entry = self.entries.get(user_id)
+        return entry.status if entry is not None else None
+
+    def is_offline(self, user_id):
+        """True/False from the index, or None when the user's status is unknown."""
+        entry = self.entries.get(user_id)
+        return entry.status in OFFLINE_STATUSES if entry is not None else None
+
+    def active_within(self, user_id, seconds):
+        entry = self.entries.get(user_id)
+        return entry is not None and entry.last_active is not None and self.clock() - entry.last_active <= seconds
+
+    def retain_watched(self):
+        """Drop users that are no longer watched (after a watchlist change)."""
+        for user_id in [user_id for user_id in self.entries if not self.is_watched(user_id)]:
+            del self.entries[user_id]
@@ -0,0 +1,166 @@
+import asyncio
+import collections
+import cProfile
+import logging
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+from datetime import datetime
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _fold(frame):
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+def _function_label(function):
+    filename, line, name = function
+    if filename == '~':
+        # Builtins: pstats names them '<built-in method ...>'
+        return name
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+class ProfileReport:
+    __slots__ = ('started_at', 'duration', 'samples', 'pstats_path', 'collapsed_path', 'summary')
+
+    def __init__(self, started_at, duration, samples, pstats_path, collapsed_path, summary):
+        self.started_at = started_at
+        self.duration = duration
+        self.samples = samples
+        self.pstats_path = pstats_path
+        self.collapsed_path = collapsed_path
+        self.summary = summary
+
+
+class Profiler:
+    """
+    On-demand profiling of the event loop thread for a bounded window.
+    While a capture runs, cProfile records every call made on the loop (event
+    handlers, command callbacks, JSON encoding, sends) and the loop's stack is
+    sampled every sample_interval seconds of CPU time (a SIGPROF timer when the
+    loop runs in the main thread, else a sampler thread). The capture is
+    written as a .pstats file (snakeviz, gprof2dot) and a .collapsed file of
+    folded stacks (flamegraph.pl, speedscope). Nothing is hooked while no
+    capture is running, so the profiler costs nothing when off.
+    """
+
+    def __init__(self, directory='profiles', source_root=None, sample_interval=0.005, io=None, clock=time.time):
+        self.directory = directory
+        self.source_root = os.path.abspath(source_root) if source_root else None
+        self.sample_interval = sample_interval
+        self.io = io
+        self.clock = clock
+        self._task = None
+        self._stop = None
+
+    def is_running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self, seconds, top=15):
+        """Start a capture of at most seconds. Returns a task resolving to the ProfileReport."""
+        if self.is_running():
+            raise RuntimeError("a profile is already running")
+        loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self._task = loop.create_task(self._capture(seconds, top))
+        return self._task
+
+    def stop(self):
+        """End the running capture early."""
+        if self._stop is not None:
+            self._stop.set()
+
+    def _sample(self, thread_id, stacks, stopped):
+        # Only sees the loop when it gives up the GIL, so biased towards waits - the fallback
+        while not stopped.wait(self.sample_interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                stacks[_fold(frame)] += 1
+
+    def _start_sampling(self, stacks):
+        """Start stack sampling. Returns a function that stops it."""
+        if hasattr(signal, 'setitimer') and threading.current_thread() is threading.main_thread():
+            def on_sample(_signum, frame):
+                stacks[_fold(frame)] += 1
+            previous = signal.signal(signal.SIGPROF, on_sample)
+            signal.setitimer(signal.ITIMER_PROF, self.sample_interval, self.sample_interval)
+
+            def stop():
+                signal.setitimer(signal.ITIMER_PROF, 0)
+                signal.signal(signal.SIGPROF, previous)
+            return stop
+
+        stopped = threading.Event()
+        sampler = threading.Thread(target=self._sample, args=(threading.get_ident(), stacks, stopped),
+                                   name='profiler-sampler', daemon=True)
+        sampler.start()
+
+        def stop():
+            stopped.set()
+            sampler.join()
+        return stop
+
+    async def _capture(self, seconds, top):
+        started_at = self.clock()
+        stacks = collections.Counter()
+        profile = cProfile.Profile()
+        logging.info(f"Profiler: capturing for up to {seconds}s")
+        # Enabled on the loop thread: cProfile hooks the thread it is enabled in
+        profile.enable()
+        stop_sampling = self._start_sampling(stacks)
+        try:
+            await asyncio.wait_for(self._stop.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            profile.disable()
+            stop_sampling()
+        duration = self.clock() - started_at
+        if self.io is not None:
+            report = await self.io.run('write profile', self._write, profile, stacks, started_at, duration, top)
+        else:
+            report = await asyncio.get_running_loop().run_in_executor(
+                None, self._write, profile, stacks, started_at, duration, top)
+        logging.info(f"Profiler: wrote {report.pstats_path} and {report.collapsed_path} ({report.samples} samples)")
+        return report
+
+    def _write(self, profile, stacks, started_at, duration, top):
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, f"profile-{datetime.fromtimestamp(started_at):%Y-%m-%d-%H%M%S}")
+        stats = pstats.Stats(profile)
+        stats.dump_stats(base + '.pstats')
+        with open(base + '.collapsed', 'w') as f:
+            for stack, count in sorted(stacks.items()):
+                f.write(f"{stack} {count}\n")
+        samples = sum(stacks.values())
+        return ProfileReport(started_at, duration, samples, base + '.pstats', base + '.collapsed',
+                             self.summarize(stats, top))
+
+    def summarize(self, stats, top=15):
+        """Top functions by own time, and the bot's own functions by cumulative time."""
+        total = stats.total_tt or 1.0
+        # pstats entries: function -> (primitive calls, calls, own time, cumulative time, callers)
+        entries = stats.stats.items()
+        lines = [f"Own time (of {stats.total_tt:.3f}s on the event loop):"]
+        for function, (_cc, calls, own, _cumulative, _callers) in sorted(entries, key=lambda item: item[1][2], reverse=True)[:top]:
+            lines.append(f"{own:8.3f}s {own / total * 100:5.1f}% {calls:>8} {_function_label(function)}")
+        if self.source_root:
+            this_file = os.path.abspath(__file__)
+            ours = [item for item in entries if item[0][0] != '~'
+                    and os.path.abspath(item[0][0]).startswith(self.source_root + os.sep)
+                    and os.path.abspath(item[0][0]) != this_file]
+            lines.append("Cumulative time of bot code:")
+            for function, (_cc, calls, _own, cumulative, _callers) in sorted(ours, key=lambda item: item[1][3], reverse=True)[:top]:
+                lines.append(f"{cumulative:8.3f}s {cumulative / total * 100:5.1f}% {calls:>8} {_function_label(function)}")
+        return '\n'.join(lines)
@@ -0,0 +1,188 @@
+import random
+
+
+class _Node:
+    __slots__ = ('key', 'priority', 'size', 'left', 'right')
+
+    def __init__(self, key):
+        self.key = key
+        self.priority = random.random()
+        self.size = 1
+        self.left = None
+        self.right = None
+
+
+def _size(node):
+    return node.size if node is not None else 0
+
+
+def _update(node):
+    node.size = 1 + _size(node.left) + _size(node.right)
+    return node
+
+
+def _merge(left, right):
+    """Merge two treaps where every key in left is smaller than every key in right."""
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        return _update(left)
+    right.left = _merge(left, right.left)
+    return _update(right)
+
+
+def _split(node, key):
+    """Split into (keys < key, keys >= key)."""
+    if node is None:
+        return None, None
+    if node.key < key:
+        left, right = _split(node.right, key)
+        node.right = left
+        return _update(node), right
+    left, right = _split(node.left, key)
+    node.left = right
+    return left, _update(node)
+
+
+def _remove(node, key):
+    if node is None:
+        return None
+    if node.key == key:
+        return _merge(node.left, node.right)
+    if key < node.key:
+        node.left = _remove(node.left, key)
+    else:
+        node.right = _remove(node.right, key)
+    return _update(node)
+
+
+class RankTree:
+    """Order-statistics treap: insert/remove/rank in O(log n), a slice of k keys in O(log n + k)."""
+
+    def __init__(self, keys=()):
+        self.root = None
+        for key in sorted(keys):
+            # Sorted input always appends at the right edge
+            self.root = _merge(self.root, _Node(key))
+
+    def __len__(self):
+        return _size(self.root)
+
+    def insert(self, key):
+        left, right = _split(self.root, key)
+        self.root = _merge(_merge(left, _Node(key)), right)
+
+    def remove(self, key):
+        self.root = _remove(self.root, key)
+
+    def rank(self, key):
+        """Number of keys smaller than key."""
+        node = self.root
+        smaller = 0
+        while node is not None:
+            if node.key < key:
+                smaller += _size(node.left) + 1
+                node = node.right
+            else:
+                node = node.left
+        return smaller
+
+    def slice(self, start, stop):
+        """Keys with index start..stop-1 in ascending order."""
+        result = []
+        self._collect(self.root, start, stop, result)
+        return result
+
+    def _collect(self, node, start, stop, result):
+        if node is None or start >= stop:
+            return
+        left_size = _size(node.left)
+        if start < left_size:
+            self._collect(node.left, start, min(stop, left_size), result)
+        if start <= left_size < stop:
+            result.append(node.key)
+        if stop > left_size + 1:
+            self._collect(node.right, max(start - left_size - 1, 0), stop - left_size - 1, result)
+
+
+class RankingIndex:
+    """
+    Per-guild leaderboard order kept up to date as totals change, so the leaderboard
+    never sorts the whole guild. Keys are (-total_time, user_id); a guild's tree is
+    built on first use and then updated for every user a save touches.
+    """
+
+    def __init__(self, get_data):
+        self.get_data = get_data
+        self.trees = {}   # guild_id -> RankTree
+        self.keys = {}    # guild_id -> {user_id: key currently in the tree}
+
+    @staticmethod
+    def _key(user_id, record):
+        return (-record.get('total_time', 0), user_id)
+
+    def _tree(self, guild_id):
+        guild_id = str(guild_id)
+        tree = self.trees.get(guild_id)
+        if tree is None:
+            tracking = self.get_data().get(guild_id, {})
+            if hasattr(tracking, 'ranking_keys'):
+                # Columnar tracking reads the keys straight from its arrays
+                keys = tracking.ranking_keys()
+            else:
+                keys = {user_id: self._key(user_id, record) for user_id, record in tracking.items()}
+            tree = self.trees[guild_id] = RankTree(keys.values())
+            self.keys[guild_id] = keys
+        return tree
+
+    def update(self, guild_id, *user_ids):
+        """Re-rank users after their records changed (or were deleted)."""
+        guild_id = str(guild_id)
+        tree = self.trees.get(guild_id)
+        if tree is None:
+            # Not queried yet - built from the current data on first use
+            return
+        tracking = self.get_data().get(guild_id, {})
+        keys = self.keys[guild_id]
+        for user_id in user_ids:
+            old_key = keys.pop(user_id, None)
+            record = tracking.get(user_id)
+            new_key = self._key(user_id, record) if record is not None else None
+            if old_key == new_key:
+                if new_key is not None:
+                    keys[user_id] = new_key
+                continue
+            if old_key is not None:
+                tree.remove(old_key)
+            if new_key is not None:
+                tree.insert(new_key)
+                keys[user_id] = new_key
+
+    def invalidate(self, guild_id=None):
+        """Drop a guild's tree (or all trees) after a bulk change; it is rebuilt on next use."""
+        if guild_id is None:
+            self.trees.clear()
+            self.keys.clear()
+        else:
+            self.trees.pop(str(guild_id), None)
+            self.keys.pop(str(guild_id), None)
+
+    def count(self, guild_id):
+        return len(self._tree(guild_id))
+
+    def top(self, guild_id, offset=0, limit=10):
+        """Return [(user_id, record)] for ranks offset+1..offset+limit."""
+        tree = self._tree(guild_id)
+        tracking = self.get_data().get(str(guild_id), {})
+        return [(user_id, tracking[user_id]) for _total, user_id in tree.slice(offset, offset + limit)]
+
+    def rank(self, guild_id, user_id):
+        """1-based rank of a user, or None when they are not tracked."""
+        tree = self._tree(guild_id)
+        key = self.keys[str(guild_id)].get(str(user_id))
+        if key is None:
+            return None
+        return tree.rank(key) + 1
@@ -0,0 +1,78 @@
+import json
+import logging
+import time
+
+# Bits of the flags recorded with a voice state
+SELF_MUTE, SELF_DEAF, MUTE, DEAF, BOT = 1, 2, 4, 8, 16
+
+
+def voice_flags(state, is_bot=False):
+    flags = BOT if is_bot else 0
+    if state is not None:
+        flags |= (SELF_MUTE if state.self_mute else 0) | (SELF_DEAF if state.self_deaf else 0)
+        flags |= (MUTE if state.mute else 0) | (DEAF if state.deaf else 0)
+    return flags
+
+
+def voice_state(state, is_bot=False):
+    """[channel_id, flags] of a voice state, or None when not in a voice channel."""
+    if state is None or state.channel is None:
+        return None
+    return [state.channel.id, voice_flags(state, is_bot)]
+
+
+class EventRecorder:
+    """
+    Compact NDJSON recording of the gateway events that drive voice tracking and
+    presence checks, one event per line: {"t": epoch seconds, "e": kind, ...}.
+    Only IDs, statuses and voice flags are recorded - no names or message content.
+    Lines go through a buffered file, so recording costs one small string write per
+    event; bench/replay.py feeds a recording back through bot.py's handlers.
+    """
+
+    def __init__(self, path, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self.events = 0
+        self._file = open(path, 'a', encoding='utf-8')
+        logging.info(f"Recording gateway events to {path}")
+
+    def record(self, kind, **fields):
+        if self._file is None:
+            return
+        fields['t'] = round(self.clock(), 3)
+        fields['e'] = kind
+        try:
+            self._file.write(json.dumps(fields, separators=(',', ':')) + '\n')
+            self.events += 1
+        except (OSError, ValueError) as e:
+            logging.error(f"Could not record {kind} event to {self.path}: {e}")
+
+    def voice(self, member, before, after):
+        self.record('voice', g=member.guild.id, u=member.id,
+                    b=voice_state(before, member.bot), a=voice_state(after, member.bot))
+
+    def rosters(self, kind, guilds):
+        """Everyone in voice right now: {guild_id: {channel_id: [[user_id, flags], ...]}}."""
+        rosters = {}
+        for guild in guilds:
+            channels = {}
+            for channel in guild.voice_channels:
+                members = [[member.id, voice_flags(member.voice, member.bot)] for member in channel.members]
+                if members:
+                    channels[str(channel.id)] = members
+            rosters[str(guild.id)] = channels
+        self.record(kind, guilds=rosters)
+
+    def config(self, config):
+        self.record('config', ignore=sorted(config.ignored_user_ids), afk=sorted(config.afk_channel_ids),
+                    watch=sorted(config.watched_user_ids), watch_everyone=config.watch_everyone)
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,72 @@
+import time
+
+
+class RenderCache:
+    """
+    Cache of rendered command output with a TTL and a signature check.
+    A cached render is reused while it is younger than ttl and the caller's
+    signature (what the output would display) is unchanged. Channels that ask
+    again within cooldown get the cached copy without any checks.
+    """
+
+    def __init__(self, ttl=30.0, cooldown=10.0, clock=time.monotonic):
+        self.ttl = ttl
+        self.cooldown = cooldown
+        self.clock = clock
+        self.entries = {}       # key -> (signature, value, rendered_at)
+        self.last_sent = {}     # channel_id -> (key, sent_at)
+
+        self.hits = 0
+        self.misses = 0
+        self.throttled = 0
+
+    def throttled_copy(self, channel_id, key):
+        """Return the cached value if this channel asked for the same key within the cooldown."""
+        last = self.last_sent.get(channel_id)
+        entry = self.entries.get(key)
+        if last is None or entry is None or last[0] != key:
+            return None
+        if self.clock() - last[1] >= self.cooldown:
+            return None
+        self.throttled += 1
+        return entry[1]
+
+    def get(self, key, signature):
+        """Return the cached value for key if it is fresh and still shows the same data."""
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == signature and self.clock() - entry[2] < self.ttl:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def put(self, key, signature, value):
+        now = self.clock()
+        # Drop expired renders so pages nobody asks for again do not pile up
+        for stale_key in [k for k, entry in self.entries.items() if now - entry[2] >= self.ttl]:
+            del self.entries[stale_key]
+        self.entries[key] = (signature, value, now)
+
+    def mark_sent(self, channel_id, key):
+        now = self.clock()
+        for stale_channel in [c for c, (_key, sent_at) in self.last_sent.items() if now - sent_at >= self.cooldown]:
+            del self.last_sent[stale_channel]
+        self.last_sent[channel_id] = (key, now)
+
+    def invalidate(self, predicate=None):
+        """Drop every cached render (or those whose key matches predicate)."""
+        if predicate is None:
+            self.entries.clear()
+        else:
+            for key in [k for k in self.entries if predicate(k)]:
+                del self.entries[key]
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.throttled
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'throttled': self.throttled,
+            'hit_rate': (self.hits + self.throttled) / lookups if lookups else 0.0,
+            'entries': len(self.entries),
+        }
@@ -0,0 +1,246 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from datetime import datetime, timedelta
+import pytz
+from core.persistence import atomic_write_bytes
+
+# (name, lowest, highest) of the five cron fields
+CRON_FIELDS = (('minute', 0, 59), ('hour', 0, 23), ('day', 1, 31), ('month', 1, 12), ('weekday', 0, 6))
+
+
+def _parse_field(text, name, lowest, highest):
+    """Parse one cron field (*, */n, a, a-b, a-b/n and comma lists) into a sorted list of values."""
+    values = set()
+    for part in text.split(','):
+        base, _slash, step = part.partition('/')
+        step = int(step) if step else 1
+        if base == '*':
+            start, end = lowest, highest
+        elif '-' in base:
+            start, end = (int(value) for value in base.split('-', 1))
+        else:
+            start = int(base)
+            end = highest if _slash else start
+        if name == 'weekday' and end == 7:
+            # 7 is Sunday as well
+            values.add(0)
+            end = 6
+        if step < 1 or start < lowest or end > highest or start > end:
+            raise ValueError(f"invalid cron {name} field: {text}")
+        values.update(range(start, end + 1, step))
+    return sorted(values)
+
+
+class CronSpec:
+    """A five-field cron expression (minute hour day month weekday, weekday 0 = Sunday) evaluated on wall-clock time."""
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron expression needs 5 fields: {expression}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            _parse_field(text, name, lowest, highest) for text, (name, lowest, highest) in zip(fields, CRON_FIELDS)
+        )
+        # Like cron: when both day and weekday are restricted, either one matching is enough
+        self.day_restricted = fields[2] != '*'
+        self.weekday_restricted = fields[4] != '*'
+
+    def __str__(self):
+        return self.expression
+
+    def _day_matches(self, moment):
+        day_ok = moment.day in self.days
+        weekday_ok = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.day_restricted and self.weekday_restricted:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+    def next_after(self, after):
+        """First matching wall-clock minute strictly after the naive datetime after."""
+        moment = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=366 * 5)
+        while moment < limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0)
+            elif not self._day_matches(moment):
+                moment = (moment + timedelta(days=1)).replace(hour=0, minute=0)
+            elif moment.hour not in self.hours:
+                next_hour = next((hour for hour in self.hours if hour > moment.hour), None)
+                if next_hour is None:
+                    moment = (moment + timedelta(days=1)).replace(hour=0, minute=0)
+                else:
+                    moment = moment.replace(hour=next_hour, minute=0)
+            elif moment.minute not in self.minutes:
+                next_minute = next((minute for minute in self.minutes if minute > moment.minute), None)
+                if next_minute is None:
+                    moment = (moment + timedelta(hours=1)).replace(minute=0)
+                else:
+                    moment = moment.replace(minute=next_minute)
+            else:
+                return moment
+        raise ValueError(f"cron expression never matches: {self.expression}")
+
+
+class Job:
+    __slots__ = ('name', 'cron', 'func', 'jitter', 'catch_up', 'order', 'slot', 'next_run', 'runs', 'failures', 'last_duration')
+
+    def __init__(self, name, cron, func, jitter, catch_up, order):
+        self.name = name
+        self.cron = cron
+        self.func = func
+        self.jitter = jitter
+        self.catch_up = catch_up
+        self.order = order
+        self.slot = None        # scheduled wall-clock time of the next run (epoch seconds)
+        self.next_run = None    # slot plus jitter
+        self.runs = 0
+        self.failures = 0
+        self.last_duration = 0.0
+
+
+class Scheduler:
+    """
+    Runs coroutine jobs on cron-like wall-clock triggers in one timezone.
+    The scheduler task sleeps until the earliest job is due (no polling), runs due
+    jobs one at a time in slot order, and delays each run by a random jitter of up
+    to job.jitter seconds. The last slot run per job is kept in state_path; a
+    catch_up job whose slot passed while the bot was down runs once on start.
+    """
+
+    def __init__(self, timezone='CET', state_path='scheduler.json', io=None, clock=time.time):
+        self.timezone = pytz.timezone(timezone)
+        self.state_path = state_path
+        self.io = io
+        self.clock = clock
+        self.jobs = {}
+        self.last_runs = self._load_state()
+        self._task = None
+        self._wakeup = None
+        self._stopping = False
+        self.current_job = None
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, 'r') as f:
+                return json.load(f).get('last_run', {})
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_state(self):
+        atomic_write_bytes(self.state_path, json.dumps({'last_run': self.last_runs}, indent=2).encode('utf-8'))
+
+    def _local(self, timestamp):
+        return datetime.fromtimestamp(timestamp, self.timezone).replace(tzinfo=None)
+
+    def _timestamp(self, local):
+        # Non-existent times (DST gap) land after the gap, ambiguous ones on the second occurrence
+        return self.timezone.normalize(self.timezone.localize(local)).timestamp()
+
+    def _schedule(self, job, after):
+        job.slot = self._timestamp(job.cron.next_after(self._local(after)))
+        job.next_run = job.slot + (random.uniform(0, job.jitter) if job.jitter else 0)
+
+    def add(self, name, cron, func, jitter=0, catch_up=False):
+        """Run await func() on every match of the cron expression, delayed by up to jitter seconds."""
+        job = Job(name, CronSpec(cron), func, jitter, catch_up, len(self.jobs))
+        now = self.clock()
+        last_run = self.last_runs.get(name)
+        if catch_up and last_run is not None and self._timestamp(job.cron.next_after(self._local(last_run))) <= now:
+            # Missed while the bot was down - run once now, however many slots were missed
+            job.slot = job.next_run = now
+            logging.info(f"Scheduler: {name} missed its run since {self._local(last_run):%Y-%m-%d %H:%M}, catching up")
+        else:
+            self._schedule(job, now)
+        self.jobs[name] = job
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            for job in self.jobs.values():
+                logging.info(f"Scheduler: {job.name} ({job.cron}, {self.timezone}) next at {self._local(job.slot):%Y-%m-%d %H:%M}")
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def shutdown(self, timeout=30.0):
+        """Stop the scheduler, letting a job that is already running finish (waits up to timeout seconds)."""
+        if self._task is None:
+            return
+        self._stopping = True
+        if self.current_job is not None:
+            logging.info(f"Scheduler: waiting for {self.current_job.name} to finish before stopping")
+            try:
+                await asyncio.wait_for(asyncio.shield(self._task), timeout)
+            except asyncio.TimeoutError:
+                logging.warning(f"Scheduler: {self.current_job.name} still running after {timeout:.0f}s, cancelling it")
+            except asyncio.CancelledError:
+                pass
+        self.stop()
+
+    def is_running(self):
+        return self._task is not None and not self._task.done()
+
+    async def _run(self):
+        while True:
+            now = self.clock()
+            due = sorted((job for job in self.jobs.values() if job.next_run <= now), key=lambda job: (job.slot, job.order))
+            for job in due:
+                if self._stopping:
+                    return
+                await self._run_job(job)
+            if self._stopping:
+                return
+            if due:
+                continue
+            self._wakeup.clear()
+            delay = min((job.next_run for job in self.jobs.values()), default=None)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), None if delay is None else max(delay - now, 0))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run_job(self, job):
+        start = time.perf_counter()
+        self.current_job = job
+        try:
+            await job.func()
+            job.runs += 1
+        except Exception as e:
+            job.failures += 1
+            logging.error(f"Scheduler: {job.name} failed: {e}")
+        finally:
+            self.current_job = None
+        job.last_duration = time.perf_counter() - start
+        self.last_runs[job.name] = job.slot
+        # Slots that passed while the job ran are skipped, not run back to back
+        self._schedule(job, max(job.slot, self.clock()))
+        try:
+            if self.io is not None:
+                await self.io.run('write scheduler state', self._save_state)
+            else:
+                self._save_state()
+        except Exception as e:
+            logging.error(f"Scheduler: could not write {self.state_path}: {e}")
+        logging.info(f"Scheduler: {job.name} took {job.last_duration * 1000:.0f}ms, next at {self._local(job.slot):%Y-%m-%d %H:%M}")
+
+    def stats(self):
+        return {
+            name: {
+                'next_run': self._local(job.next_run),
+                'runs': job.runs,
+                'failures': job.failures,
+                'last_duration_ms': job.last_duration * 1000,
+            }
+            for name, job in self.jobs.items()
+        }
@@ -0,0 +1,261 @@
+import argparse
+import json
+import math
+import mmap
+import os
+import struct
+import zlib
+from array import array
+from core.columnar import IN_VOICE, ColumnarTracking, np
+from core.persistence import atomic_write_bytes
+
+# File layout (little endian), written front to back in one pass:
+#   header   32 bytes   magic, version, record size, record count, string/extras table sizes, CRC32 of the rest
+#   records  count * 32 bytes in table order: user_id, total_time, join_time (NaN = none),
+#            offset and length of the username in the string table, flags (bit 0 = in_voice)
+#   strings  UTF-8 usernames in record order, each followed by a NUL byte
+#   extras   JSON {user_id: {key: value}} of record keys outside the columns (usually empty)
+MAGIC = b'VTSNAP\x00\x00'
+VERSION = 1
+HEADER = struct.Struct('<8sHHIIII4x')
+RECORD = struct.Struct('<qddIHBx')
+# Discord names are at most 32 characters; longer ones are cut to fit the 16-bit length field
+MAX_NAME_BYTES = 0xFFFF
+
+if np is not None:
+    RECORD_DTYPE = np.dtype([('user_id', '<i8'), ('total_time', '<f8'), ('join_time', '<f8'),
+                             ('name_offset', '<u4'), ('name_length', '<u2'), ('flags', 'u1'), ('pad', 'u1')])
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def _columns(records):
+    """Split {user_id: record} into the snapshot columns."""
+    ids, total, join, flags = array('q'), array('d'), array('d'), array('B')
+    names = []
+    extras = {}
+    for user_id, record in records.items():
+        record = dict(record)
+        ids.append(int(user_id))
+        names.append(str(record.pop('username', 'Unknown')))
+        total.append(record.pop('total_time', 0))
+        flags.append(IN_VOICE if record.pop('in_voice', False) else 0)
+        join.append(record.pop('join_time', math.nan))
+        if record:
+            extras[str(user_id)] = record
+    return ids, total, join, flags, names, extras
+
+
+def _string_table(names):
+    """NUL-terminated UTF-8 names (NULs inside names are dropped), so a table is encoded and split in one call each."""
+    text = '\x00'.join(names)
+    if text.count('\x00') != len(names) - 1:
+        names = [name.replace('\x00', '') for name in names]
+        text = '\x00'.join(names)
+    return ((text + '\x00').encode('utf-8') if names else b''), names
+
+
+def _name_lengths(names):
+    """UTF-8 length of each name, or None when one is too long for the length field."""
+    lengths = [len(name) if name.isascii() else len(name.encode('utf-8')) for name in names]
+    return lengths if not lengths or max(lengths) <= MAX_NAME_BYTES else None
+
+
+def encode_snapshot(records):
+    """Encode {user_id: record} (or a ColumnarTracking, straight from its arrays) as snapshot bytes."""
+    if isinstance(records, ColumnarTracking):
+        ids, total, join, flags, names = records.ids, records.total, records.join, records.flags, records.names
+        extras = {str(user_id): dict(values) for user_id, values in records.extras.items()}
+    else:
+        ids, total, join, flags, names, extras = _columns(records)
+    count = len(ids)
+    strings, names = _string_table(names)
+    if np is not None and count:
+        ends = np.flatnonzero(np.frombuffer(strings, dtype=np.uint8) == 0)
+        starts = np.zeros(count, dtype=np.int64)
+        starts[1:] = ends[:-1] + 1
+        lengths = ends - starts
+        if lengths.max() > MAX_NAME_BYTES:
+            return encode_snapshot(_truncated(records))
+        table = np.zeros(count, dtype=RECORD_DTYPE)
+        table['user_id'] = np.frombuffer(ids, dtype=np.int64)
+        table['total_time'] = np.frombuffer(total, dtype=np.float64)
+        table['join_time'] = np.frombuffer(join, dtype=np.float64)
+        table['name_offset'] = starts
+        table['name_length'] = lengths
+        table['flags'] = np.frombuffer(flags, dtype=np.uint8)
+        table = table.tobytes()
+    else:
+        lengths = _name_lengths(names)
+        if lengths is None:
+            return encode_snapshot(_truncated(records))
+        table = bytearray(RECORD.size * count)
+        offset = 0
+        for row, length in enumerate(lengths):
+            RECORD.pack_into(table, row * RECORD.size, ids[row], total[row], join[row], offset, length, flags[row])
+            offset += length + 1
+    return _assemble(count, table, strings, extras)
+
+
+def _truncated(records):
+    """Copy of records with every username cut to MAX_NAME_BYTES of UTF-8."""
+    records = {user_id: dict(record) for user_id, record in records.items()}
+    for record in records.values():
+        name = str(record.get('username', 'Unknown')).encode('utf-8')[:MAX_NAME_BYTES]
+        record['username'] = name.decode('utf-8', 'ignore')
+    return records
+
+
+def _assemble(count, table, strings, extras):
+    extras_bytes = json.dumps(extras, separators=(',', ':')).encode('utf-8') if extras else b''
+    checksum = zlib.crc32(extras_bytes, zlib.crc32(strings, zlib.crc32(table)))
+    header = HEADER.pack(MAGIC, VERSION, RECORD.size, count, len(strings), len(extras_bytes), checksum)
+    return b''.join((header, table, strings, extras_bytes))
+
+
+def write_snapshot(path, records):
+    """Encode and atomically write a snapshot. Returns bytes written."""
+    payload = encode_snapshot(records)
+    atomic_write_bytes(path, payload)
+    return len(payload)
+
+
+class Snapshot:
+    """
+    A snapshot file mapped into memory. Nothing is parsed up front: the header is
+    checked (and the CRC32 when verify is set), get() scans the user ID column in
+    place, and to_columnar()/to_dict() convert the whole table.
+    """
+
+    def __init__(self, path, verify=True):
+        self.path = path
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < HEADER.size:
+                raise SnapshotError(f"{path} is too short for a snapshot")
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, record_size, self.count, strings_size, extras_size, checksum = HEADER.unpack_from(self._map)
+            if magic != MAGIC:
+                raise SnapshotError(f"{path} is not a snapshot file")
+            if version != VERSION or record_size != RECORD.size:
+                raise SnapshotError(f"{path} has unsupported snapshot version {version}")
+            self._strings_at = HEADER.size + self.count * RECORD.size
+            self._extras_at = self._strings_at + strings_size
+            if self._extras_at + extras_size != size:
+                raise SnapshotError(f"{path} is truncated")
+            if verify and zlib.crc32(memoryview(self._map)[HEADER.size:]) != checksum:
+                raise SnapshotError(f"{path} failed its checksum")
+            self.extras = json.loads(self._map[self._extras_at:size]) if extras_size else {}
+        except Exception:
+            self._map.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._map.close()
+
+    def __len__(self):
+        return self.count
+
+    def _row(self, position):
+        return RECORD.unpack_from(self._map, HEADER.size + position * RECORD.size)
+
+    def _record(self, row):
+        user_id, total_time, join_time, name_offset, name_length, flags = row
+        start = self._strings_at + name_offset
+        record = {
+            'username': self._map[start:start + name_length].decode('utf-8', 'replace'),
+            'total_time': total_time,
+            'in_voice': bool(flags & IN_VOICE),
+        }
+        if join_time == join_time:
+            record['join_time'] = join_time
+        record.update(self.extras.get(str(user_id), ()))
+        return record
+
+    def get(self, user_id):
+        """One user's record, read from the mapped table without loading the rest, or None."""
+        user_id = int(user_id)
+        if np is not None and self.count:
+            table = np.frombuffer(self._map, dtype=RECORD_DTYPE, count=self.count, offset=HEADER.size)
+            rows = np.flatnonzero(table['user_id'] == user_id).tolist()
+            del table
+            return self._record(self._row(rows[0])) if rows else None
+        for row in self._rows():
+            if row[0] == user_id:
+                return self._record(row)
+        return None
+
+    def names(self):
+        """Every username in record order (one decode and split of the string table)."""
+        if self.count == 0:
+            return []
+        return self._map[self._strings_at:self._extras_at].decode('utf-8', 'replace').split('\x00', self.count)[:self.count]
+
+    def _rows(self):
+        return RECORD.iter_unpack(memoryview(self._map)[HEADER.size:self._strings_at])
+
+    def __iter__(self):
+        """(user_id, record) for every user, in table order."""
+        extras = self.extras
+        for (user_id, total_time, join_time, _offset, _length, flags), name in zip(self._rows(), self.names()):
+            record = {'username': name, 'total_time': total_time, 'in_voice': bool(flags & IN_VOICE)}
+            if join_time == join_time:
+                record['join_time'] = join_time
+            if extras:
+                record.update(extras.get(str(user_id), ()))
+            yield str(user_id), record
+
+    def to_dict(self):
+        return dict(self)
+
+    def to_columnar(self):
+        """Build a ColumnarTracking from the table: column copies with NumPy, one transposing unpack without."""
+        tracking = ColumnarTracking()
+        if self.count == 0:
+            return tracking
+        if np is not None:
+            table = np.frombuffer(self._map, dtype=RECORD_DTYPE, count=self.count, offset=HEADER.size)
+            tracking.ids = array('q', table['user_id'].tobytes())
+            tracking.total = array('d', table['total_time'].tobytes())
+            tracking.join = array('d', table['join_time'].tobytes())
+            tracking.flags = array('B', table['flags'].tobytes())
+            # Views into the map must be gone before it is closed
+            del table
+        else:
+            ids, total, join, _offsets, _lengths, flags = zip(*self._rows())
+            tracking.ids = array('q', ids)
+            tracking.total = array('d', total)
+            tracking.join = array('d', join)
+            tracking.flags = array('B', flags)
+        tracking.names = self.names()
+        tracking.index = dict(zip(tracking.ids.tolist(), range(self.count)))
+        tracking.extras = {int(user_id): dict(values) for user_id, values in self.extras.items()}
+        return tracking
+
+
+def read_snapshot(path, verify=True):
+    """Load a whole snapshot file as {user_id: record}."""
+    with Snapshot(path, verify) as snapshot:
+        return snapshot.to_dict()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert between memory JSON files and binary snapshots.')
+    parser.add_argument('direction', choices=('to-json', 'from-json'))
+    parser.add_argument('source')
+    parser.add_argument('target')
+    args = parser.parse_args()
+    if args.direction == 'to-json':
+        atomic_write_bytes(args.target, json.dumps(read_snapshot(args.source), indent=4).encode('utf-8'))
+    else:
+        with open(args.source, 'r') as f:
+            write_snapshot(args.target, json.load(f))
@@ -0,0 +1,367 @@
+import argparse
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from core.backups import BackupEngine
+from core.persistence import atomic_write_bytes
+from core.snapshot import Snapshot, SnapshotError, write_snapshot
+
+# Data written before tracking was partitioned by guild is loaded into this partition until it is migrated
+LEGACY_GUILD_ID = 0
+
+BACKUP_FILENAME_PATTERN = re.compile(r'^memory-(\d{4})-(\d{2})-(\d{2})-(\d{4})\.json$')
+
+
+class TrackingStorage:
+    """Interface for voice tracking backends used by the write-behind store."""
+
+    name = 'base'
+    # Backends that rewrite everything on each flush need a full snapshot
+    needs_full_snapshot = True
+
+    def load(self):
+        """Return the persisted tracking dictionary ({guild_id: {user_id: record}})."""
+        raise NotImplementedError
+
+    def write(self, guild_id, records, removed_ids, full):
+        """Persist a guild's records (all of them when full is True) and drop removed_ids. Returns bytes written."""
+        raise NotImplementedError
+
+    def delete_guild(self, guild_id):
+        """Remove every persisted record of a guild."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class JsonStorage(TrackingStorage):
+    """
+    One memory.json-style file per guild (memory/<guild_id>.json), rewritten atomically
+    when that guild changes. A legacy single memory.json is loaded as the legacy partition.
+    """
+
+    name = 'json'
+
+    def __init__(self, directory='memory', legacy_path='memory.json'):
+        self.directory = directory
+        self.legacy_path = legacy_path
+
+    def __str__(self):
+        return self.directory
+
+    def _path(self, guild_id):
+        if str(guild_id) == str(LEGACY_GUILD_ID):
+            return self.legacy_path
+        return os.path.join(self.directory, f"{guild_id}.json")
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def load(self):
+        data = {}
+        legacy = self._read(self.legacy_path)
+        if legacy:
+            data[str(LEGACY_GUILD_ID)] = legacy
+        if not os.path.isdir(self.directory):
+            return data
+        for filename in sorted(os.listdir(self.directory)):
+            guild_id, ext = os.path.splitext(filename)
+            if ext != '.json' or not guild_id.isdigit():
+                continue
+            guild_tracking = self._read(os.path.join(self.directory, filename))
+            if guild_tracking is None:
+                logging.warning(f"Could not read {filename}, starting guild {guild_id} empty")
+                guild_tracking = {}
+            data[guild_id] = guild_tracking
+        return data
+
+    def write(self, guild_id, records, removed_ids, full):
+        payload = json.dumps(records, indent=4).encode('utf-8')
+        path = self._path(guild_id)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        atomic_write_bytes(path, payload)
+        return len(payload)
+
+    def delete_guild(self, guild_id):
+        path = self._path(guild_id)
+        if not os.path.exists(path):
+            return
+        if path == self.legacy_path:
+            # Keep the pre-partitioning file around instead of deleting user data
+            os.replace(path, path + '.migrated')
+        else:
+            os.remove(path)
+
+
+class BinaryStorage(JsonStorage):
+    """
+    One binary snapshot per guild (memory/<guild_id>.snap, see core/snapshot.py): a
+    fixed-size record table that is memory-mapped on load and written in one pass.
+    Guilds still stored as memory/<guild_id>.json are loaded from JSON and converted
+    on their first write; backups stay JSON. The legacy partition is kept as JSON.
+    """
+
+    name = 'binary'
+    # write() takes a detached ColumnarTracking as well as {user_id: record}
+    accepts_columnar = True
+
+    def __init__(self, directory='memory', legacy_path='memory.json', columnar=False):
+        super().__init__(directory, legacy_path)
+        self.columnar = columnar
+
+    def _snap_path(self, guild_id):
+        return os.path.join(self.directory, f"{guild_id}.snap")
+
+    def load(self):
+        # JSON files of guilds that have no snapshot yet, then every snapshot
+        data = super().load()
+        if not os.path.isdir(self.directory):
+            return data
+        for filename in sorted(os.listdir(self.directory)):
+            guild_id, ext = os.path.splitext(filename)
+            if ext != '.snap' or not guild_id.isdigit():
+                continue
+            try:
+                with Snapshot(os.path.join(self.directory, filename)) as snapshot:
+                    data[guild_id] = snapshot.to_columnar() if self.columnar else snapshot.to_dict()
+            except (OSError, SnapshotError) as e:
+                if guild_id in data:
+                    logging.warning(f"Could not read {filename} ({e}), using {guild_id}.json")
+                else:
+                    logging.warning(f"Could not read {filename} ({e}), starting guild {guild_id} empty")
+                    data[guild_id] = {}
+        return data
+
+    def write(self, guild_id, records, removed_ids, full):
+        if str(guild_id) == str(LEGACY_GUILD_ID):
+            return super().write(guild_id, dict(records.items()), removed_ids, full)
+        os.makedirs(self.directory, exist_ok=True)
+        written = write_snapshot(self._snap_path(guild_id), records)
+        json_path = self._path(guild_id)
+        if os.path.exists(json_path):
+            # Converted - keep the JSON file around like the legacy memory.json
+            os.replace(json_path, json_path + '.migrated')
+        return written
+
+    def delete_guild(self, guild_id):
+        path = self._snap_path(guild_id)
+        if str(guild_id) != str(LEGACY_GUILD_ID) and os.path.exists(path):
+            os.remove(path)
+        super().delete_guild(guild_id)
+
+
+class SqliteStorage(TrackingStorage):
+    """
+    Stdlib sqlite3 backend in WAL mode. Records live in an indexed table keyed by
+    (guild_id, user_id), so a flush only updates the rows that changed.
+    """
+
+    name = 'sqlite'
+    needs_full_snapshot = False
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS voice_time (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            username TEXT NOT NULL,
+            total_time REAL NOT NULL DEFAULT 0,
+            in_voice INTEGER NOT NULL DEFAULT 0,
+            join_time REAL,
+            PRIMARY KEY (guild_id, user_id)
+        );
+        -- The leaderboard comes from the in-memory ranking index; don't maintain a sort index on every flush
+        DROP INDEX IF EXISTS idx_voice_time_total;
+        CREATE TABLE IF NOT EXISTS snapshots (
+            taken_at TEXT NOT NULL,
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            username TEXT NOT NULL,
+            total_time REAL NOT NULL,
+            PRIMARY KEY (taken_at, guild_id, user_id)
+        );
+    """
+
+    def __init__(self, path='memory.db'):
+        self.path = path
+        self._lock = threading.Lock()
+        # Writes happen in executor threads, loads and deletes on the caller's thread; the lock serializes them
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(self.SCHEMA)
+        self._conn.commit()
+
+    def __str__(self):
+        return self.path
+
+    @staticmethod
+    def _row_to_record(row):
+        username, total_time, in_voice, join_time = row
+        record = {'username': username, 'total_time': total_time, 'in_voice': bool(in_voice)}
+        if join_time is not None:
+            record['join_time'] = join_time
+        return record
+
+    @staticmethod
+    def _row_params(guild_id, user_id, record):
+        return (
+            int(guild_id),
+            int(user_id),
+            record.get('username', 'Unknown'),
+            record.get('total_time', 0),
+            1 if record.get('in_voice', False) else 0,
+            record.get('join_time'),
+        )
+
+    def is_empty(self):
+        with self._lock:
+            return self._conn.execute('SELECT 1 FROM voice_time LIMIT 1').fetchone() is None
+
+    def load(self):
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT guild_id, user_id, username, total_time, in_voice, join_time FROM voice_time'
+            ).fetchall()
+        data = {}
+        for row in rows:
+            data.setdefault(str(row[0]), {})[str(row[1])] = self._row_to_record(row[2:])
+        return data
+
+    def write(self, guild_id, records, removed_ids, full):
+        params = [self._row_params(guild_id, user_id, record) for user_id, record in records.items()]
+        with self._lock, self._conn:
+            if full:
+                self._conn.execute('DELETE FROM voice_time WHERE guild_id = ?', (int(guild_id),))
+            elif removed_ids:
+                self._conn.executemany(
+                    'DELETE FROM voice_time WHERE guild_id = ? AND user_id = ?',
+                    [(int(guild_id), int(user_id)) for user_id in removed_ids]
+                )
+            self._conn.executemany(
+                'INSERT INTO voice_time (guild_id, user_id, username, total_time, in_voice, join_time) '
+                'VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (guild_id, user_id) DO UPDATE SET username = excluded.username, '
+                'total_time = excluded.total_time, in_voice = excluded.in_voice, join_time = excluded.join_time',
+                params
+            )
+        # Approximate payload: fixed-width columns plus the username
+        return sum(40 + len(row[2].encode('utf-8')) for row in params)
+
+    def delete_guild(self, guild_id):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM voice_time WHERE guild_id = ?', (int(guild_id),))
+
+    def import_memory(self, data, guild_id=LEGACY_GUILD_ID):
+        """Replace a guild's rows with a memory.json-style dictionary."""
+        return self.write(guild_id, data, (), full=True)
+
+    def import_backup(self, backup_path, taken_at, guild_id=LEGACY_GUILD_ID):
+        """Store a backup file as a historical snapshot. Already imported snapshots are skipped."""
+        with open(backup_path, 'r') as f:
+            data = json.load(f)
+        return self.import_snapshot(data, taken_at, guild_id)
+
+    def import_snapshot(self, data, taken_at, guild_id=LEGACY_GUILD_ID):
+        """Store a {user_id: record} dictionary as a historical snapshot. Already imported snapshots are skipped."""
+        rows = [
+            (taken_at, int(guild_id), int(user_id), record.get('username', 'Unknown'), record.get('total_time', 0))
+            for user_id, record in data.items()
+        ]
+        with self._lock, self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO snapshots (taken_at, guild_id, user_id, username, total_time) VALUES (?, ?, ?, ?, ?)',
+                rows
+            )
+            return self._conn.total_changes - before
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_storage(backend=None):
+    """Build the storage backend selected by STORAGE_BACKEND (json, binary or sqlite)."""
+    backend = (backend or os.getenv('STORAGE_BACKEND', 'json')).lower()
+    if backend == 'sqlite':
+        return SqliteStorage(os.getenv('SQLITE_PATH', 'memory.db'))
+    if backend == 'binary':
+        # Snapshots load straight into columnar arrays when that layout is used
+        return BinaryStorage(os.getenv('MEMORY_DIR', 'memory'),
+                             columnar=os.getenv('TRACKING_LAYOUT', 'dict').lower() == 'columnar')
+    if backend != 'json':
+        logging.warning(f"Unknown STORAGE_BACKEND '{backend}', using json")
+    return JsonStorage(os.getenv('MEMORY_DIR', 'memory'))
+
+
+def backup_guild_id(backup_dir, path):
+    """Guild a backup file belongs to: backup/<guild_id>/YYYY/... or the legacy partition for backup/YYYY/..."""
+    first = os.path.relpath(path, backup_dir).split(os.sep)[0]
+    # Years are four digits, Discord snowflakes are much longer
+    if first.isdigit() and len(first) > 4:
+        return int(first)
+    return LEGACY_GUILD_ID
+
+
+def find_backup_files(backup_dir):
+    """Yield (guild_id, taken_at, path) for every memory-YYYY-MM-DD-HHMM.json below backup_dir."""
+    for root, _dirs, files in os.walk(backup_dir):
+        for filename in sorted(files):
+            match = BACKUP_FILENAME_PATTERN.match(filename)
+            if not match:
+                continue
+            year, month, day, hhmm = match.groups()
+            taken_at = datetime(int(year), int(month), int(day), int(hhmm[:2]), int(hhmm[2:])).isoformat()
+            path = os.path.join(root, filename)
+            yield backup_guild_id(backup_dir, path), taken_at, path
+
+
+def import_into_sqlite(db_path, memory_path='memory.json', backup_dir='backup', memory_dir='memory'):
+    """One-shot import of memory.json / memory/<guild_id>.json (live rows) and backup/ files (snapshots table) into SQLite."""
+    storage = SqliteStorage(db_path)
+    try:
+        if (memory_path and os.path.exists(memory_path)) or (memory_dir and os.path.isdir(memory_dir)):
+            data = JsonStorage(memory_dir or 'memory', memory_path or 'memory.json').load()
+            for guild_id, guild_tracking in data.items():
+                storage.import_memory(guild_tracking, guild_id)
+                logging.info(f"Imported {len(guild_tracking)} users of guild {guild_id} into {db_path}")
+
+        if backup_dir and os.path.isdir(backup_dir):
+            files = 0
+            rows = 0
+            for guild_id, taken_at, path in find_backup_files(backup_dir):
+                try:
+                    rows += storage.import_backup(path, taken_at, guild_id)
+                    files += 1
+                except (json.JSONDecodeError, OSError, ValueError) as e:
+                    logging.warning(f"Skipping backup {path}: {e}")
+            # Incremental backups: rebuild every point of each guild's chain in one pass
+            engine = BackupEngine(backup_dir)
+            for guild_id in engine.guild_ids():
+                for taken_at, state in engine.iter_states(guild_id):
+                    rows += storage.import_snapshot(state, taken_at.isoformat(), guild_id)
+                    files += 1
+            logging.info(f"Imported {rows} snapshot rows from {files} backups in {backup_dir}")
+    finally:
+        storage.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Import memory.json and backup/ files into the SQLite backend.')
+    parser.add_argument('--db', default=os.getenv('SQLITE_PATH', 'memory.db'))
+    parser.add_argument('--memory', default='memory.json')
+    parser.add_argument('--memory-dir', default=os.getenv('MEMORY_DIR', 'memory'))
+    parser.add_argument('--backups', default='backup')
+    args = parser.parse_args()
+    import_into_sqlite(args.db, args.memory, args.backups, args.memory_dir)